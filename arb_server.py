@@ -9,225 +9,40 @@ from flask import Response, abort, jsonify, make_response, request, Flask
 
 from constants import DEFAULT_SESSION_TTL
 from relay_board import RelayBoard
+from board_registry import BoardRegistry
+from config_registry import ConfigRegistry
+from relay_counters import RelayCounters
 
 
 class HVACSimServer:
     """HVAC Simulator server"""
-    def __init__(self):
+    def __init__(self, serve: bool = True):
+        """
+        :param serve: run the Flask server, False only builds the app (e.g. for benchmark.py's test client)
+        """
         self.app = None
         self._success_response = {}
         self.session_id = None  # Initializing None session_id, ie. no session in progress.
         self.last_event_time = 0  # Last event does not exist before server is launched
         self.valid_config_commands = {}
         self.app = Flask(__name__)  # Flask server initializing
-        self.init_server()
+        self.init_server(serve)
 
     def set_valid_config_commands(self):
-        """Initialize valid config commands via rb.configurations. This needs to be in it's own helper function as each
-        state defined is dependent on environment variables (e.g. has_pek), which in theory can change along with
-        configurations sent into start_session. I.e. default configurations initialized above do not necessarily reflect
-        the state set in start_session (hence why it is called there as well as in __init__)."""
-        self.valid_config_commands = {  # Valid config commands found in relay_board.py
-            "CONFIG_POWER": self.rb.configurations.CONFIG_POWER,
-
-            "CONFIG_FAN": self.rb.configurations.CONFIG_FAN,
-            "CONFIG_FAN_2_STAGE": self.rb.configurations.CONFIG_FAN_2_STAGE,
-            "CONFIG_FAN_3_STAGE": self.rb.configurations.CONFIG_FAN_3_STAGE,
-            "CONFIG_FAN_ACC": self.rb.configurations.CONFIG_FAN_ACC,
-            "CONFIG_FAN_2_STAGE_ACC": self.rb.configurations.CONFIG_FAN_2_STAGE_ACC,
-            "CONFIG_FAN_3_STAGE_ACC": self.rb.configurations.CONFIG_FAN_3_STAGE_ACC,
-
-            "CONFIG_FAN_ACC_2_STAGE": self.rb.configurations.CONFIG_FAN_ACC_2_STAGE,
-            "CONFIG_FAN_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FAN_2_STAGE_ACC_2_STAGE,
-            "CONFIG_FAN_3_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_BO_1_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE,
-            "CONFIG_BO_2_STAGE": self.rb.configurations.CONFIG_BO_2_STAGE,
-            "CONFIG_BO_1_STAGE_ACC": self.rb.configurations.CONFIG_BO_1_STAGE_ACC,
-            "CONFIG_BO_2_STAGE_ACC": self.rb.configurations.CONFIG_BO_2_STAGE_ACC,
-            "CONFIG_BO_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_ACC_2_STAGE,
-            "CONFIG_BO_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_BO_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_FN_1_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE,
-            "CONFIG_FN_1_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_FAN_2_STAGE,
-            "CONFIG_FN_1_STAGE_FAN_3_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_FAN_3_STAGE,
-            "CONFIG_FN_1_STAGE_ACC": self.rb.configurations.CONFIG_FN_1_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_FAN_2_STAGE_ACC": self.rb.configurations.CONFIG_FN_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_FAN_3_STAGE_ACC": self.rb.configurations.CONFIG_FN_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_ACC_2_STAGE,
-            "CONFIG_FN_1_STAGE_FAN_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_FN_1_STAGE_FAN_2_STAGE_ACC_2_STAGE,
-            "CONFIG_FN_1_STAGE_FAN_3_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_FN_1_STAGE_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_AC_1_STAGE": self.rb.configurations.CONFIG_AC_1_STAGE,
-            "CONFIG_AC_1_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_AC_1_STAGE_FAN_2_STAGE,
-            "CONFIG_AC_1_STAGE_FAN_3_STAGE": self.rb.configurations.CONFIG_AC_1_STAGE_FAN_3_STAGE,
-            "CONFIG_AC_1_STAGE_ACC": self.rb.configurations.CONFIG_AC_1_STAGE_ACC,
-            "CONFIG_AC_1_STAGE_FAN_2_STAGE_ACC": self.rb.configurations.CONFIG_AC_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_AC_1_STAGE_FAN_3_STAGE_ACC": self.rb.configurations.CONFIG_AC_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_AC_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_AC_1_STAGE_ACC_2_STAGE,
-            "CONFIG_AC_1_STAGE_FAN_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_AC_1_STAGE_FAN_2_STAGE_ACC_2_STAGE,
-            "CONFIG_AC_1_STAGE_FAN_3_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_AC_1_STAGE_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_BO_1_STAGE_AC_1_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE,
-            "CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_2_STAGE,
-            "CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_3_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_3_STAGE,
-            "CONFIG_BO_1_STAGE_AC_1_STAGE_ACC": self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE_ACC,
-            "CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_2_STAGE_ACC":
-                self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_3_STAGE_ACC":
-                self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_BO_1_STAGE_AC_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE_ACC_2_STAGE,
-
-            "CONFIG_FN_1_STAGE_AC_1_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_2_STAGE,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_3_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_3_STAGE,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_ACC": self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_PEK_ACC": self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_PEK_ACC,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_2_STAGE_ACC":
-                self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_3_STAGE_ACC":
-                self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_ACC_2_STAGE,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_2_STAGE_ACC_2_STAGE,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_3_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_FN_2_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE,
-            "CONFIG_FN_2_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE_FAN_2_STAGE,
-            "CONFIG_FN_2_STAGE_ACC": self.rb.configurations.CONFIG_FN_2_STAGE_ACC,
-            "CONFIG_FN_2_STAGE_FAN_2_STAGE_ACC": self.rb.configurations.CONFIG_FN_2_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_FN_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_AC_2_STAGE": self.rb.configurations.CONFIG_AC_2_STAGE,
-            "CONFIG_AC_2_STAGE_ACC": self.rb.configurations.CONFIG_AC_2_STAGE_ACC,
-            "CONFIG_AC_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_AC_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPCOOL_1_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_FAN_2_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_FAN_3_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_FAN_3_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_FAN_2_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_FAN_3_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_ACC_2_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_FAN_3_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPHEAT_1_STAGE": self.rb.configurations.CONFIG_HPHEAT_1_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_FAN_2_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_FAN_3_STAGE": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_FAN_3_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_FAN_2_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_FAN_3_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_ACC_2_STAGE,
-
-            "CONFIG_BO_2_STAGE_AC_1_STAGE": self.rb.configurations.CONFIG_BO_2_STAGE_AC_1_STAGE,
-            "CONFIG_BO_1_STAGE_AC_2_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_AC_2_STAGE,
-            "CONFIG_BO_2_STAGE_AC_1_STAGE_ACC": self.rb.configurations.CONFIG_BO_2_STAGE_AC_1_STAGE_ACC,
-            "CONFIG_BO_1_STAGE_AC_2_STAGE_ACC": self.rb.configurations.CONFIG_BO_1_STAGE_AC_2_STAGE_ACC,
-            "CONFIG_BO_2_STAGE_AC_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_BO_2_STAGE_AC_1_STAGE_ACC_2_STAGE,
-            "CONFIG_BO_1_STAGE_AC_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_AC_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_FN_1_STAGE_AC_2_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_AC_2_STAGE,
-            "CONFIG_FN_2_STAGE_AC_1_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE_AC_1_STAGE,
-            "CONFIG_FN_1_STAGE_AC_2_STAGE_ACC": self.rb.configurations.CONFIG_FN_1_STAGE_AC_2_STAGE_ACC,
-            "CONFIG_FN_2_STAGE_AC_1_STAGE_ACC": self.rb.configurations.CONFIG_FN_2_STAGE_AC_1_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_AC_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_AC_2_STAGE_ACC_2_STAGE,
-            "CONFIG_FN_2_STAGE_AC_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE_AC_1_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPCOOL_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_2_STAGE,
-            "CONFIG_HPHEAT_2_STAGE": self.rb.configurations.CONFIG_HPHEAT_2_STAGE,
-            "CONFIG_HPCOOL_2_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_2_STAGE_ACC,
-            "CONFIG_HPHEAT_2_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_2_STAGE_ACC,
-            "CONFIG_HPCOOL_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_2_STAGE_ACC_2_STAGE,
-            "CONFIG_HPHEAT_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_HPHEAT_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_2_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_3_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_3_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_ACC_2_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC_2_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_2_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_3_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_3_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_ACC_2_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC_2_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPHEAT_1_STAGE_AUX_2_STAGE": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_2_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_AUX_2_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_2_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_AUX_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_BO_2_STAGE_AC_2_STAGE": self.rb.configurations.CONFIG_BO_2_STAGE_AC_2_STAGE,
-            "CONFIG_BO_2_STAGE_AC_2_STAGE_ACC": self.rb.configurations.CONFIG_BO_2_STAGE_AC_2_STAGE_ACC,
-            "CONFIG_BO_2_STAGE_AC_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_BO_2_STAGE_AC_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_FN_2_STAGE_AC_2_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE_AC_2_STAGE,
-            "CONFIG_FN_2_STAGE_AC_2_STAGE_ACC": self.rb.configurations.CONFIG_FN_2_STAGE_AC_2_STAGE_ACC,
-            "CONFIG_FN_2_STAGE_AC_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE_AC_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPCOOL_1_STAGE_AUX_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_2_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_AUX_2_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_2_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_AUX_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPCOOL_2_STAGE_AUX_1_STAGE": self.rb.configurations.CONFIG_HPCOOL_2_STAGE_AUX_1_STAGE,
-            "CONFIG_HPCOOL_2_STAGE_AUX_1_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_2_STAGE_AUX_1_STAGE_ACC,
-            "CONFIG_HPCOOL_2_STAGE_AUX_1_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_2_STAGE_AUX_1_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPHEAT_2_STAGE_AUX_1_STAGE": self.rb.configurations.CONFIG_HPHEAT_2_STAGE_AUX_1_STAGE,
-            "CONFIG_HPHEAT_2_STAGE_AUX_1_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_2_STAGE_AUX_1_STAGE_ACC,
-            "CONFIG_HPHEAT_2_STAGE_AUX_1_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_2_STAGE_AUX_1_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE": self.rb.configurations.CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE,
-            "CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE_ACC,
-            "CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE,
-            "CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE_ACC,
-            "CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE_ACC_2_STAGE,
-            "CONFIG_ALL": self.rb.configurations.CONFIG_ALL
-        }
+        """Point the valid config commands at the registry of the relay board's current model and flags. The registry
+        is derived from SwitchModuleConfigurations and only lists configurations valid for those flags, it is built
+        once per flag combination and shared, so calling this on every session start is free."""
+        self.valid_config_commands = self.rb.registry.commands
 
     def _init_relay_board(self):
         """Initialize the RelayBoard with default values."""
-        self.rb = RelayBoard("ares")
+        self.rb = RelayBoard("ares", board=BoardRegistry.load().default())
         self.set_valid_config_commands()
         # Configure default powered state
         self.rb.configure(self.rb.configurations.CONFIG_POWER)
 
-    def init_server(self):
-        """Initializes and runs the Flask server"""
+    def init_server(self, serve: bool = True):
+        """Initializes the Flask server and runs it unless `serve` is False"""
         self.valid_config_commands = {}
 
         self._success_response = {"state": "success", "session_id": "", "start_time": None, "value": None}
@@ -246,6 +61,8 @@ class HVACSimServer:
         self.app.add_url_rule('/api/clear/', 'clear_all_sessions', self.clear_all_sessions, methods=['DELETE'])
         self.app.add_url_rule('/api/stop/', 'stop_server', self.stop_server, methods=['DELETE'])
         self.app.add_url_rule('/api/get_arb_config/', 'get_arb_config', self.get_arb_config, methods=['GET'])
+        self.app.add_url_rule('/api/configs/', 'get_configs', self.get_configs, methods=['GET'])
+        self.app.add_url_rule('/api/relays/counters/', 'get_relay_counters', self.get_relay_counters, methods=['GET'])
         # Aquastat requests
         self.app.add_url_rule('/api/aquastat/start/', 'aquastat_start', self.start_aquastat_mode, methods=['POST'])
         self.app.add_url_rule('/api/aquastat/end/', 'aquastat_end', self.end_aquastat_mode, methods=['POST'])
@@ -256,6 +73,8 @@ class HVACSimServer:
 
         self._init_relay_board()
         self.port = 5000
+        if not serve:
+            return
         # Start flask server.
         self.app.run(debug=False, port=self.port, host='0.0.0.0')
         
@@ -388,10 +207,9 @@ class HVACSimServer:
             response.status_code = 400
             abort(response)
         try:
-            if self.rb:
-                self.rb.cleanup()
-            self.rb = RelayBoard(request.json["model"], request.json["has_pek"], request.json["has_rh"],
-                                 request.json["has_rc"], request.json["in_phase"], request.json["acc_minus"])
+            # GPIO, the buses and the sampler stay up between sessions, only the configurations and relays change
+            self.rb.switch_session(request.json["model"], request.json["has_pek"], request.json["has_rh"],
+                                   request.json["has_rc"], request.json["in_phase"], request.json["acc_minus"])
             self.set_valid_config_commands()
             self.rb.configure(self.rb.configurations.CONFIG_POWER)
         except ValueError as e:
@@ -547,6 +365,35 @@ class HVACSimServer:
         """
         return self.rb.switch_module.read_config()
 
+    def get_configs(self) -> Response:
+        """Returns every valid config name with its pins. Uses the model and flags from the query string (model,
+        has_pek, has_rh, has_rc, in_phase, acc_minus) when a model is given, the relay board's current ones otherwise.
+        Answers 304 when If-None-Match matches the catalog's ETag, 400 for an unknown model or invalid flags.
+        """
+        if "model" in request.args:
+            flags = {
+                flag: request.args.get(flag, default).lower() in ("1", "true")
+                for flag, default in (("has_pek", "false"), ("has_rh", "false"), ("has_rc", "true"),
+                                      ("in_phase", "true"), ("acc_minus", "false"))
+            }
+            try:
+                registry = ConfigRegistry.get(request.args["model"], **flags)
+            except ValueError as e:
+                return make_response(str(e), 400)
+        else:
+            registry = self.rb.registry
+        if registry.not_modified(request.headers.get("If-None-Match")):
+            response = make_response("", 304)
+        else:
+            response = make_response(jsonify(registry.catalog()), 200)
+        response.headers["ETag"] = registry.etag
+        return response
+
+    def get_relay_counters(self) -> Response:
+        """Returns how many times each relay of the board closed and opened, counted across restarts"""
+        counters = RelayCounters.for_board(self.rb.board.name)
+        return make_response(jsonify({"board": self.rb.board.name, "relays": counters.counts()}), 200)
+
     def get_status(self):
         """Return the current availability of the device, determined by the check_session_timeout helper function."""
         if self.check_session_timeout():  # Either no session exists or it has timed out.
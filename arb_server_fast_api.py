@@ -1,29 +1,43 @@
+import asyncio
 import json
 import os
 import signal
 import time
-from binascii import b2a_hex
-from os import urandom
-from typing import Dict, Union
+from typing import Dict, List, Optional, Union
 
 from service_logging import log
 
-from fastapi import FastAPI, Request, HTTPException, Response
+from fastapi import FastAPI, Request, HTTPException, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from constants import DEFAULT_SESSION_TTL
-from relay_board import RelayBoard
+from constants import DEFAULT_SESSION_TTL, QUEUE_TICKET_TTL
+from config_registry import ConfigRegistry
+from switch_module_configurations import SwitchModuleConfigurations
+from board_registry import BoardRegistry
+from session_leases import BoardSlot, Lease, LeaseManager, Ticket
+from relay_counters import RelayCounters
+from sense_sampler import Sample
+from step_sequence import resolve_event, run_sequence_async, validate_steps
+from sense_module_events import describe_state
+from service_metrics import CONTENT_TYPE, SENSED_STATE, RequestMetrics, render
+import relay_state
 
 
 class HVACSimServer:
     """HVAC Simulator Server with FastAPI"""
 
-    VALID_MODELS = ("athena", "nike", "apollo", "vulcan","ares", "artemis", "attisPro", "attisRetail")
+    VALID_MODELS = SwitchModuleConfigurations.MODELS
+
+    # seconds between SSE keepalive comments while the relay state is unchanged
+    STREAM_KEEPALIVE = 15
 
     def __init__(self):
         self.app = FastAPI(title="HVAC Simulator API")
+        self.app.add_middleware(RequestMetrics)
         self._init_state()
         self._setup_routes()
-        self._init_relay_board()
+        self.leases.init_boards()
 
     # --------------------------
     # Pydantic Models
@@ -43,15 +57,40 @@ class HVACSimServer:
     class SessionID(BaseModel):
         session_id: str
 
+    class TicketID(BaseModel):
+        ticket: str
+
+    class TicketWait(BaseModel):
+        ticket: str
+        timeout: float = 30
+
+    class WaitRequest(BaseModel):
+        session_id: str
+        event: Union[int, str]  # bitmask or SenseModuleEvents EVENT_* name
+        timeout: float = 0
+
+    class SequenceStep(BaseModel):
+        config: Optional[str] = None
+        aquastat: Optional[str] = None  # start, end, open or close
+        event: Optional[Union[int, str]] = None  # bitmask or SenseModuleEvents EVENT_* name
+        timeout: float = 0
+        dwell: float = 0
+
+    class SequenceRequest(BaseModel):
+        session_id: str
+        steps: List["HVACSimServer.SequenceStep"]
+        stop_on_failure: bool = True
+        stream: bool = False  # newline delimited JSON, one line per step then the summary
+
     # --------------------------
     # Initialization
     # --------------------------
     def _init_state(self):
         """Initialize server state"""
-        self.session_id = None
-        self.last_event_time = 0
-        self.rb = None
-        self.valid_config_commands = {}
+        # every board of the board registry, leased to one session each. Relay and bus work of a board runs on the
+        # executor of its bus, one operation at a time in arrival order
+        self.leases = LeaseManager(BoardRegistry.load(), DEFAULT_SESSION_TTL, QUEUE_TICKET_TTL)
+        SENSED_STATE.set_function(self._sensed_states)
         self._success_response = {
             "state": "success",
             "session_id": "",
@@ -59,259 +98,86 @@ class HVACSimServer:
             "value": None
         }
 
-    def _init_relay_board(self, model: str = "ares"):
-        """Initialize the RelayBoard"""
-        self.rb = RelayBoard(model)
-        self._update_valid_commands()
-        self.rb.configure(self.rb.configurations.CONFIG_POWER)
-
-    def _update_valid_commands(self):
-        """Initialize valid config commands via rb.configurations. This needs to be in it's own helper function as each
-        state defined is dependent on environment variables (e.g. has_pek), which in theory can change along with
-        configurations sent into start_session. I.e. default configurations initialized above do not necessarily reflect
-        the state set in start_session (hence why it is called there as well as in __init__)."""
-        self.valid_config_commands = {  # Valid config commands found in relay_board.py
-            "CONFIG_POWER": self.rb.configurations.CONFIG_POWER,
-
-            "CONFIG_FAN": self.rb.configurations.CONFIG_FAN,
-            "CONFIG_FAN_2_STAGE": self.rb.configurations.CONFIG_FAN_2_STAGE,
-            "CONFIG_FAN_3_STAGE": self.rb.configurations.CONFIG_FAN_3_STAGE,
-            "CONFIG_FAN_ACC": self.rb.configurations.CONFIG_FAN_ACC,
-            "CONFIG_FAN_2_STAGE_ACC": self.rb.configurations.CONFIG_FAN_2_STAGE_ACC,
-            "CONFIG_FAN_3_STAGE_ACC": self.rb.configurations.CONFIG_FAN_3_STAGE_ACC,
-
-            "CONFIG_FAN_ACC_2_STAGE": self.rb.configurations.CONFIG_FAN_ACC_2_STAGE,
-            "CONFIG_FAN_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FAN_2_STAGE_ACC_2_STAGE,
-            "CONFIG_FAN_3_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_BO_1_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE,
-            "CONFIG_BO_2_STAGE": self.rb.configurations.CONFIG_BO_2_STAGE,
-            "CONFIG_BO_1_STAGE_ACC": self.rb.configurations.CONFIG_BO_1_STAGE_ACC,
-            "CONFIG_BO_2_STAGE_ACC": self.rb.configurations.CONFIG_BO_2_STAGE_ACC,
-            "CONFIG_BO_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_ACC_2_STAGE,
-            "CONFIG_BO_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_BO_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_FN_1_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE,
-            "CONFIG_FN_1_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_FAN_2_STAGE,
-            "CONFIG_FN_1_STAGE_FAN_3_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_FAN_3_STAGE,
-            "CONFIG_FN_1_STAGE_ACC": self.rb.configurations.CONFIG_FN_1_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_FAN_2_STAGE_ACC": self.rb.configurations.CONFIG_FN_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_FAN_3_STAGE_ACC": self.rb.configurations.CONFIG_FN_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_ACC_2_STAGE,
-            "CONFIG_FN_1_STAGE_FAN_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_FN_1_STAGE_FAN_2_STAGE_ACC_2_STAGE,
-            "CONFIG_FN_1_STAGE_FAN_3_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_FN_1_STAGE_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_AC_1_STAGE": self.rb.configurations.CONFIG_AC_1_STAGE,
-            "CONFIG_AC_1_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_AC_1_STAGE_FAN_2_STAGE,
-            "CONFIG_AC_1_STAGE_FAN_3_STAGE": self.rb.configurations.CONFIG_AC_1_STAGE_FAN_3_STAGE,
-            "CONFIG_AC_1_STAGE_ACC": self.rb.configurations.CONFIG_AC_1_STAGE_ACC,
-            "CONFIG_AC_1_STAGE_FAN_2_STAGE_ACC": self.rb.configurations.CONFIG_AC_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_AC_1_STAGE_FAN_3_STAGE_ACC": self.rb.configurations.CONFIG_AC_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_AC_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_AC_1_STAGE_ACC_2_STAGE,
-            "CONFIG_AC_1_STAGE_FAN_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_AC_1_STAGE_FAN_2_STAGE_ACC_2_STAGE,
-            "CONFIG_AC_1_STAGE_FAN_3_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_AC_1_STAGE_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_BO_1_STAGE_AC_1_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE,
-            "CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_2_STAGE,
-            "CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_3_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_3_STAGE,
-            "CONFIG_BO_1_STAGE_AC_1_STAGE_ACC": self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE_ACC,
-            "CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_2_STAGE_ACC":
-                self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_3_STAGE_ACC":
-                self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_BO_1_STAGE_AC_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_AC_1_STAGE_ACC_2_STAGE,
-
-            "CONFIG_FN_1_STAGE_AC_1_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_2_STAGE,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_3_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_3_STAGE,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_ACC": self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_PEK_ACC": self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_PEK_ACC,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_2_STAGE_ACC":
-                self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_3_STAGE_ACC":
-                self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_ACC_2_STAGE,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_2_STAGE_ACC_2_STAGE,
-            "CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_3_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_FN_1_STAGE_AC_1_STAGE_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_FN_2_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE,
-            "CONFIG_FN_2_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE_FAN_2_STAGE,
-            "CONFIG_FN_2_STAGE_ACC": self.rb.configurations.CONFIG_FN_2_STAGE_ACC,
-            "CONFIG_FN_2_STAGE_FAN_2_STAGE_ACC": self.rb.configurations.CONFIG_FN_2_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_FN_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_AC_2_STAGE": self.rb.configurations.CONFIG_AC_2_STAGE,
-            "CONFIG_AC_2_STAGE_ACC": self.rb.configurations.CONFIG_AC_2_STAGE_ACC,
-            "CONFIG_AC_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_AC_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPCOOL_1_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_FAN_2_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_FAN_3_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_FAN_3_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_FAN_2_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_FAN_3_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_ACC_2_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_FAN_3_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPHEAT_1_STAGE": self.rb.configurations.CONFIG_HPHEAT_1_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_FAN_2_STAGE": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_FAN_2_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_FAN_3_STAGE": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_FAN_3_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_FAN_2_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_FAN_3_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_ACC_2_STAGE,
-
-            "CONFIG_BO_2_STAGE_AC_1_STAGE": self.rb.configurations.CONFIG_BO_2_STAGE_AC_1_STAGE,
-            "CONFIG_BO_1_STAGE_AC_2_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_AC_2_STAGE,
-            "CONFIG_BO_2_STAGE_AC_1_STAGE_ACC": self.rb.configurations.CONFIG_BO_2_STAGE_AC_1_STAGE_ACC,
-            "CONFIG_BO_1_STAGE_AC_2_STAGE_ACC": self.rb.configurations.CONFIG_BO_1_STAGE_AC_2_STAGE_ACC,
-            "CONFIG_BO_2_STAGE_AC_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_BO_2_STAGE_AC_1_STAGE_ACC_2_STAGE,
-            "CONFIG_BO_1_STAGE_AC_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_BO_1_STAGE_AC_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_FN_1_STAGE_AC_2_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_AC_2_STAGE,
-            "CONFIG_FN_2_STAGE_AC_1_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE_AC_1_STAGE,
-            "CONFIG_FN_1_STAGE_AC_2_STAGE_ACC": self.rb.configurations.CONFIG_FN_1_STAGE_AC_2_STAGE_ACC,
-            "CONFIG_FN_2_STAGE_AC_1_STAGE_ACC": self.rb.configurations.CONFIG_FN_2_STAGE_AC_1_STAGE_ACC,
-            "CONFIG_FN_1_STAGE_AC_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FN_1_STAGE_AC_2_STAGE_ACC_2_STAGE,
-            "CONFIG_FN_2_STAGE_AC_1_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE_AC_1_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPCOOL_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_2_STAGE,
-            "CONFIG_HPHEAT_2_STAGE": self.rb.configurations.CONFIG_HPHEAT_2_STAGE,
-            "CONFIG_HPCOOL_2_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_2_STAGE_ACC,
-            "CONFIG_HPHEAT_2_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_2_STAGE_ACC,
-            "CONFIG_HPCOOL_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_2_STAGE_ACC_2_STAGE,
-            "CONFIG_HPHEAT_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_HPHEAT_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_2_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_3_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_3_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_ACC_2_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC_2_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_2_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_3_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_3_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_ACC_2_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_2_STAGE_ACC_2_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_1_STAGE_FAN_3_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPHEAT_1_STAGE_AUX_2_STAGE": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_2_STAGE,
-            "CONFIG_HPHEAT_1_STAGE_AUX_2_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_2_STAGE_ACC,
-            "CONFIG_HPHEAT_1_STAGE_AUX_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_1_STAGE_AUX_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_BO_2_STAGE_AC_2_STAGE": self.rb.configurations.CONFIG_BO_2_STAGE_AC_2_STAGE,
-            "CONFIG_BO_2_STAGE_AC_2_STAGE_ACC": self.rb.configurations.CONFIG_BO_2_STAGE_AC_2_STAGE_ACC,
-            "CONFIG_BO_2_STAGE_AC_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_BO_2_STAGE_AC_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_FN_2_STAGE_AC_2_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE_AC_2_STAGE,
-            "CONFIG_FN_2_STAGE_AC_2_STAGE_ACC": self.rb.configurations.CONFIG_FN_2_STAGE_AC_2_STAGE_ACC,
-            "CONFIG_FN_2_STAGE_AC_2_STAGE_ACC_2_STAGE": self.rb.configurations.CONFIG_FN_2_STAGE_AC_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPCOOL_1_STAGE_AUX_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_2_STAGE,
-            "CONFIG_HPCOOL_1_STAGE_AUX_2_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_2_STAGE_ACC,
-            "CONFIG_HPCOOL_1_STAGE_AUX_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_1_STAGE_AUX_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPCOOL_2_STAGE_AUX_1_STAGE": self.rb.configurations.CONFIG_HPCOOL_2_STAGE_AUX_1_STAGE,
-            "CONFIG_HPCOOL_2_STAGE_AUX_1_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_2_STAGE_AUX_1_STAGE_ACC,
-            "CONFIG_HPCOOL_2_STAGE_AUX_1_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_2_STAGE_AUX_1_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPHEAT_2_STAGE_AUX_1_STAGE": self.rb.configurations.CONFIG_HPHEAT_2_STAGE_AUX_1_STAGE,
-            "CONFIG_HPHEAT_2_STAGE_AUX_1_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_2_STAGE_AUX_1_STAGE_ACC,
-            "CONFIG_HPHEAT_2_STAGE_AUX_1_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_2_STAGE_AUX_1_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE": self.rb.configurations.CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE,
-            "CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE_ACC": self.rb.configurations.CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE_ACC,
-            "CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE_ACC_2_STAGE,
-
-            "CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE": self.rb.configurations.CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE,
-            "CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE_ACC": self.rb.configurations.CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE_ACC,
-            "CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE_ACC_2_STAGE":
-                self.rb.configurations.CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE_ACC_2_STAGE,
-            "CONFIG_ALL": self.rb.configurations.CONFIG_ALL
-        }
-
     # --------------------------
     # Dependency Injections
     # --------------------------
-    def _validate_session(self, request: Union[Request, BaseModel, None]=None) -> Dict:
-        """Validate session and return request data"""
-        if self._check_session_timeout():
-            raise HTTPException(status_code=400, detail="Session Expired")
-        data = {}
-        if request is not None:
-            try:
-                data = request.model_dump()
-            except:
-                raise HTTPException(status_code=400, detail="Invalid request body")
-
-            if not data.get("session_id"):
-                raise HTTPException(status_code=400, detail="Session ID missing")
-            if data["session_id"] != self.session_id:
+    def _validate_session(self, request: Union[Request, BaseModel]) -> Lease:
+        """Validate session and return the lease of the board it is routed to"""
+        try:
+            data = request.model_dump()
+        except:
+            raise HTTPException(status_code=400, detail="Invalid request body")
+
+        if not data.get("session_id"):
+            raise HTTPException(status_code=400, detail="Session ID missing")
+        lease = self.leases.get(data["session_id"])
+        if lease is None:
+            if self.leases.expired(data["session_id"]):
+                raise HTTPException(status_code=400, detail="Session Expired")
+            raise HTTPException(status_code=401, detail="Invalid session ID")
+
+        lease.touch()
+        return lease
+
+    def _slot(self, board: Optional[str] = None, session_id: Optional[str] = None) -> BoardSlot:
+        """Board of the session `session_id`, the board named `board`, or the default board for endpoints that
+        do not need a session"""
+        if session_id is not None:
+            lease = self.leases.get(session_id)
+            if lease is None:
                 raise HTTPException(status_code=401, detail="Invalid session ID")
-
-        self.last_event_time = time.time()
-        return data
-
-    def _require_no_active_session(self):
-        """Ensure no active session exists"""
-        if not self._check_session_timeout():
-            raise HTTPException(status_code=400, detail="Session already exists")
+            return lease.slot
+        if board is None:
+            return self.leases.default_slot()
+        if board not in self.leases.slots:
+            raise HTTPException(status_code=404, detail=f"Unknown board {board}")
+        return self.leases.slots[board]
+
+    def _ticket(self, ticket_id: str) -> Ticket:
+        """Queued ticket by ID"""
+        ticket = self.leases.ticket(ticket_id)
+        if ticket is None:
+            raise HTTPException(status_code=404, detail="Unknown ticket")
+        return ticket
+
+    def _check_model(self, model: str):
+        """Ensure the model is valid and some board takes it"""
+        if model not in self.VALID_MODELS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid model. Must be one of: {self.VALID_MODELS}"
+            )
+        if not any(slot.accepts(model) for slot in self.leases.slots.values()):
+            raise HTTPException(status_code=400, detail=f"No board takes model {model}")
 
     # --------------------------
     # Core Methods
     # --------------------------
-    def _check_session_timeout(self) -> bool:
-        """Check if session has timed out"""
-        if self.session_id:
-            if (time.time() - self.last_event_time) > DEFAULT_SESSION_TTL:
-                self.last_event_time = time.time()
-                self._cleanup_session()
-                return True
-            elapsed_time = time.time() - self.last_event_time
-            log.info("Time between events: " + str(elapsed_time))
-            return False
-
-        self.last_event_time = time.time()
-        return True
-
-    def _cleanup_session(self):
-        """Clean up current session"""
-        if self.rb:
-            self.rb.cleanup()
-        self.session_id = None
-        self._init_relay_board()
+    def _session_response(self, lease: Lease) -> Dict:
+        response = self._success_response.copy()
+        response.update({
+            "session_id": lease.session_id,
+            "start_time": time.ctime(lease.start_time),
+            "board": lease.slot.board.name
+        })
+        return response
+
+    def _ticket_response(self, ticket: Ticket) -> Dict:
+        return {
+            "state": "waiting",
+            "ticket": ticket.ticket_id,
+            "position": self.leases.position(ticket),
+            "ttl": ticket.ttl
+        }
+
+    @staticmethod
+    def _configure(slot: BoardSlot, config: str) -> Dict:
+        """Apply a named configuration and read it back. Runs on the hardware executor."""
+        slot.rb.configure(slot.rb.registry[config])
+        return {
+            "start_time": time.ctime(time.time()),
+            "relay_states": slot.rb.switch_module.read_config_str()
+        }
 
     # --------------------------
     # Endpoints
@@ -322,15 +188,31 @@ class HVACSimServer:
         self.app.post("/api/session/")(self.start_session)
         self.app.delete("/api/session/")(self.end_session)
         self.app.get("/api/status/")(self.get_status)
+        self.app.get("/api/boards/")(self.get_boards)
+
+        # Reservation queue endpoints
+        self.app.post("/api/queue/")(self.enqueue_session)
+        self.app.post("/api/queue/wait/")(self.wait_for_ticket)
+        self.app.delete("/api/queue/")(self.cancel_ticket)
+        self.app.get("/api/queue/")(self.get_queue)
 
         # Relay endpoints
         self.app.post("/api/relays/")(self.get_relay_state)
         self.app.post("/api/relays/configure/")(self.set_relay_state)
+        self.app.post("/api/relays/wait/")(self.wait_for_relay_state)
+        self.app.post("/api/sequence/")(self.run_step_sequence)
+        self.app.get("/api/relays/history/")(self.get_relay_history)
+        self.app.get("/api/relays/counters/")(self.get_relay_counters)
+        self.app.get("/api/relays/stream/")(self.stream_relay_states)
+        self.app.websocket("/api/relays/ws/")(self.relay_states_websocket)
 
         # Maintenance endpoints
         self.app.delete("/api/clear/")(self.clear_all_sessions)
         self.app.delete("/api/stop/")(self.stop_server)
         self.app.get("/api/get_arb_config/")(self.get_arb_config)
+        self.app.get("/api/configs/")(self.get_configs)
+        self.app.get("/api/sampler/")(self.get_sampler_stats)
+        self.app.get("/metrics")(self.get_metrics)
 
         # Aquastat endpoints
         self.app.post("/api/aquastat/start/")(self.start_aquastat_mode)
@@ -340,117 +222,330 @@ class HVACSimServer:
         self.app.get("/api/aquastat/mode/")(self.get_aquastat_mode)
         self.app.get("/api/aquastat/state/")(self.get_aquastat_state)
 
-    def start_session(self, config: SessionConfig):
-        """Start a new HVAC simulation session"""
-        self._require_no_active_session()
+    async def start_session(self, config: SessionConfig):
+        """Start a new HVAC simulation session on a free board that takes the model"""
+        self._check_model(config.model)
 
-        if config.model not in self.VALID_MODELS:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid model. Must be one of: {self.VALID_MODELS}"
-            )
+        try:
+            lease = await self.leases.acquire(config.model_dump())
+        except ValueError as e:
+            raise HTTPException(status_code=418, detail=str(e))
+        if lease is None:
+            raise HTTPException(status_code=400, detail="Session already exists")
+        return self._session_response(lease)
 
+    async def enqueue_session(self, config: SessionConfig):
+        """Queue for a session on a board that takes the model. Returns a ticket to long-poll with
+        /api/queue/wait/, position 0 means a board is already being started for it."""
+        self._check_model(config.model)
+        flags = config.model_dump()
         try:
-            if self.rb:
-                self.rb.cleanup()
-
-            self.rb = RelayBoard(
-                model=config.model,
-                has_pek=config.has_pek,
-                has_rh=config.has_rh,
-                has_rc=config.has_rc,
-                in_phase=config.in_phase,
-                acc_minus=config.acc_minus
-            )
-            self._update_valid_commands()
-            self.rb.configure(self.rb.configurations.CONFIG_POWER)
+            # invalid flags are refused now rather than when the ticket reaches the front
+            ConfigRegistry.get(**flags)
         except ValueError as e:
-            self._cleanup_session()
             raise HTTPException(status_code=418, detail=str(e))
+        ticket = self.leases.enqueue(flags)
+        return self._ticket_response(ticket)
+
+    async def wait_for_ticket(self, request: TicketWait):
+        """Long-poll a ticket. Returns the session as soon as the ticket is turned into one, or the ticket's place
+        in the queue if the timeout expires first."""
+        ticket = self._ticket(request.ticket)
+        if request.timeout < 0:
+            raise HTTPException(status_code=400, detail="Timeout must not be negative")
+        if not await self.leases.wait(ticket, request.timeout):
+            return self._ticket_response(ticket)
+        lease = ticket.ready.result()
+        if lease is None:
+            raise HTTPException(status_code=410, detail=ticket.error)
+        return self._session_response(self.leases.claim(ticket))
+
+    async def cancel_ticket(self, request: TicketID):
+        """Leave the queue, ending the session the ticket was turned into if it was not picked up yet"""
+        self.leases.cancel(self._ticket(request.ticket))
+        return Response(content="Ticket cancelled", status_code=200)
+
+    async def get_queue(self):
+        """Get the models waiting in the queue, oldest first. Ticket IDs are not exposed."""
+        return [
+            {"position": i, "model": ticket.flags["model"], "waiting_s": time.time() - ticket.created}
+            for i, ticket in enumerate(self.leases.waiting(), 1)
+        ]
+
+    async def end_session(self, request: SessionID):
+        """End a session, freeing its board"""
+        lease = self._validate_session(request)
+        await asyncio.wrap_future(self.leases.release(lease))
+        return Response(content ="Session cleared", status_code=200)
 
-        self.session_id = b2a_hex(urandom(15)).decode("utf-8")
-        response = self._success_response.copy()
-        response.update({
-            "session_id": self.session_id,
-            "start_time": time.ctime(time.time())
-        })
-        return response
+    async def get_relay_state(self, request: SessionID, format: Optional[str] = None) -> Dict:
+        """Get current relay states, or the raw sensed bitmask with ?format=mask"""
+        slot = self._validate_session(request).slot
+        if format not in (None, "mask"):
+            raise HTTPException(status_code=400, detail="Format must be mask or omitted")
+        if slot.rb.sense_module.sampling:
+            # answered from the latest sample, no bus access
+            state = slot.rb.sense_module.read_relay_state()
+        else:
+            state = await slot.hw.run(slot.rb.sense_module.read_relay_state)
+        if format == "mask":
+            return {"state": state}
+        return slot.rb.sense_module.decode_relay_states(state)
+
+    async def get_relay_counters(self, board: Optional[str] = None, session_id: Optional[str] = None):
+        """Get how many times each relay of the board closed and opened, counted across restarts"""
+        slot = self._slot(board, session_id)
+        return {"board": slot.board.name, "relays": RelayCounters.for_board(slot.board.name).counts()}
+
+    async def get_relay_history(self, at: Optional[float] = None, start: Optional[float] = None,
+                          end: Optional[float] = None, board: Optional[str] = None,
+                          session_id: Optional[str] = None):
+        """Get the relay state at time `at`, or the transitions between `start` and `end` (seconds since epoch)"""
+        sense_module = self._slot(board, session_id).rb.sense_module
+        history = sense_module.history
+        if at is not None:
+            state = history.state_at(history.to_monotonic_ns(at))
+            if state is None:
+                raise HTTPException(status_code=404, detail="No relay state recorded at that time")
+            return {"time": at, "state": state, "relay_states": sense_module.decode_relay_states(state)}
+
+        end = time.time() if end is None else end
+        start = end - history.max_age_ns / 1e9 if start is None else start
+        if start > end:
+            raise HTTPException(status_code=400, detail="start must not be after end")
+        transitions = history.transitions(history.to_monotonic_ns(start), history.to_monotonic_ns(end))
+        return {
+            "start": start,
+            "end": end,
+            "transitions": [
+                {"time": history.to_wall_time(timestamp_ns), "state": state,
+                 "relay_states": sense_module.decode_relay_states(state)}
+                for timestamp_ns, state in transitions
+            ]
+        }
 
-    def end_session(self, request: SessionID):
-        """End the current session"""
-        self._validate_session(request)
-        self._cleanup_session()
-        return Response(content ="Session cleared", status_code=200)
+    @staticmethod
+    def _relay_state_message(slot: BoardSlot, sample: Sample) -> Dict:
+        """Formats a sample for the streaming endpoints"""
+        return {
+            "time": slot.rb.sense_module.history.to_wall_time(sample.timestamp_ns),
+            "state": sample.state,
+            "relay_states": slot.rb.sense_module.decode_relay_states(sample.state)
+        }
 
-    def get_relay_state(self, request: SessionID)-> Dict[str, bool]:
-        """Get current relay states"""
-        self._validate_session(request)
-        return json.loads(self.rb.sense_module.get_relay_states())
+    async def stream_relay_states(self, board: Optional[str] = None, session_id: Optional[str] = None):
+        """Server-Sent Events stream of relay states, one event per sensed change"""
+        slot = self._slot(board, session_id)
+
+        async def events():
+            with slot.broadcaster.subscribe() as subscription:
+                while True:
+                    try:
+                        sample = await asyncio.wait_for(subscription.next(), self.STREAM_KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                        continue
+                    yield f"data: {json.dumps(self._relay_state_message(slot, sample))}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    async def relay_states_websocket(self, websocket: WebSocket, board: Optional[str] = None,
+                                     session_id: Optional[str] = None):
+        """WebSocket stream of relay states, one message per sensed change"""
+        slot = self._slot(board, session_id)
+        await websocket.accept()
+        try:
+            with slot.broadcaster.subscribe() as subscription:
+                while True:
+                    sample = await subscription.next()
+                    await websocket.send_json(self._relay_state_message(slot, sample))
+        except WebSocketDisconnect:
+            pass
+
+    async def wait_for_relay_state(self, request: WaitRequest):
+        """Long-poll until the sensed relay state matches the expected event or the timeout expires"""
+        slot = self._validate_session(request).slot
+        try:
+            expected = resolve_event(request.event)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if request.timeout < 0:
+            raise HTTPException(status_code=400, detail="Timeout must not be negative")
+
+        start_ns = time.monotonic_ns()
+        sense_module = slot.rb.sense_module
+        matched, sample = await self._wait_for_state(slot, expected, request.timeout)
+        latency = max(sample.timestamp_ns - start_ns, 0) / 1e9 if matched else None
+        return {
+            "matched": matched,
+            "latency": latency,
+            "elapsed": (time.monotonic_ns() - start_ns) / 1e9,
+            "expected": expected,
+            "state": sample.state,
+            "relay_states": sense_module.decode_relay_states(sample.state),
+            "description": describe_state(sample.state, expected)
+        }
+
+    @staticmethod
+    async def _wait_for_state(slot: BoardSlot, expected: int, timeout: float):
+        """Waits for the sensed state of `slot`'s board to match `expected`, off the hardware executor
+
+        :return: (matched, last sample)
+        """
+        start_ns = time.monotonic_ns()
+        sense_module = slot.rb.sense_module
+        if sense_module.sampling or sense_module.int_pin is not None:
+            matched, sample = await slot.broadcaster.wait_for_state(expected, timeout)
+            sense_module.record_wait(timeout, matched, max(sample.timestamp_ns - start_ns, 0) / 1e9)
+            return matched, sample
+        # nothing pushes state changes without the sampler or interrupts, fall back to the polling wait. It stays off
+        # the hardware executor so a long wait cannot hold up other requests, its reads take the bus lock
+        matched = await run_in_threadpool(slot.rb.wait_for_event, expected, timeout)
+        return matched, sense_module.last_sample
+
+    async def run_step_sequence(self, request: SequenceRequest):
+        """Run an ordered list of configure / aquastat / wait / dwell steps and report per step timing and pass/fail,
+        streamed as newline delimited JSON if requested. Only configure and aquastat actions take the hardware
+        executor, waits and dwells leave it free for other requests."""
+        lease = self._validate_session(request)
+        slot = lease.slot
+        try:
+            steps = validate_steps([step.model_dump() for step in request.steps], slot.rb.registry)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        results = asyncio.Queue()
+
+        async def wait_for_event(expected: int, timeout: float) -> bool:
+            matched, _ = await self._wait_for_state(slot, expected, timeout)
+            return matched
+
+        def on_result(result: Dict):
+            # a long plan is session activity too
+            lease.touch()
+            results.put_nowait(result)
 
-    def set_relay_state(self, request: RelayConfig):
+        sequence = run_sequence_async(slot.rb, steps, slot.hw.run, wait_for_event, request.stop_on_failure, on_result)
+        if not request.stream:
+            return await sequence
+
+        task = asyncio.ensure_future(sequence)
+        task.add_done_callback(lambda _: results.put_nowait(None))
+
+        async def lines():
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                yield json.dumps(result) + "\n"
+            summary = task.result()
+            del summary["results"]
+            yield json.dumps(summary) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    async def set_relay_state(self, request: RelayConfig):
         """Configure relay states"""
-        data = self._validate_session(request)
+        lease = self._validate_session(request)
 
-        if "config" not in data or data["config"] not in self.valid_config_commands:
+        if request.config not in lease.slot.rb.registry:
             raise HTTPException(status_code=400, detail="Invalid configuration command")
 
         try:
-            self.rb.configure(self.valid_config_commands[data["config"]])
-            return {
-                "start_time": time.ctime(time.time()),
-                "relay_states": self.rb.switch_module.read_config_str()
-            }
+            return await lease.slot.hw.run(self._configure, lease.slot, request.config)
         except ValueError as e:
-            self._cleanup_session()
+            # answer once the board is back in its default state, like end_session
+            try:
+                await asyncio.wrap_future(self.leases.release(lease))
+            except Exception as reset_error:
+                log.warning(f"Resetting {lease.slot.board.name} after a failed configure failed: {reset_error}")
             raise HTTPException(status_code=500, detail=str(e))
 
-    def get_status(self):
-        """Get server availability status"""
-        return "Available" if self._check_session_timeout() else "Busy"
+    async def get_status(self, model: Optional[str] = None):
+        """Get server availability status, "Available" while any board (taking `model` if given) is free"""
+        return "Available" if self.leases.free_slot(model, skip_queued=True) is not None else "Busy"
+
+    async def get_boards(self):
+        """Get every board with its bus, the models it takes and whether it is leased"""
+        return [slot.status() for slot in self.leases.slots.values()]
 
-    def clear_all_sessions(self):
-        """Force clear all sessions"""
-        self._cleanup_session()
+    async def clear_all_sessions(self):
+        """Force clear all sessions, rebuilding every relay board from scratch"""
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in self.leases.release_all(full=True)))
         return {"message": "Sessions cleared"}
 
-    def stop_server(self):
+    async def stop_server(self):
         """Shutdown the server"""
         try:
-            if self.rb:
-                self.rb.cleanup()
+            await asyncio.gather(*(
+                slot.hw.run(slot.rb.cleanup) for slot in self.leases.slots.values() if slot.rb
+            ))
             os.kill(os.getpid(), signal.SIGINT)
             return {"message": "Server shutdown initiated"}
         except Exception as e:
             raise HTTPException(status_code=409, detail=str(e))
 
-    def get_arb_config(self):
-        """Get current ARB configuration"""
-        return self.rb.switch_module.read_config()
+    async def get_arb_config(self, board: Optional[str] = None, session_id: Optional[str] = None):
+        """Get current ARB configuration (read from the switch module shadow, no bus access)"""
+        return self._slot(board, session_id).rb.switch_module.read_config()
+
+    async def get_configs(self, request: Request, model: Optional[str] = None, has_pek: bool = False,
+                          has_rh: bool = False, has_rc: bool = True, in_phase: bool = True, acc_minus: bool = False,
+                          board: Optional[str] = None, session_id: Optional[str] = None):
+        """Get every valid config name with its pins, for the given model and flags or a relay board's current ones.
+        Supports If-None-Match against the catalog's ETag."""
+        if model is None:
+            registry = self._slot(board, session_id).rb.registry
+        elif model not in self.VALID_MODELS:
+            raise HTTPException(status_code=400, detail=f"Invalid model. Must be one of: {self.VALID_MODELS}")
+        else:
+            try:
+                registry = ConfigRegistry.get(model, has_pek, has_rh, has_rc, in_phase, acc_minus)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        if registry.not_modified(request.headers.get("if-none-match")):
+            return Response(status_code=304, headers={"ETag": registry.etag})
+        return JSONResponse(content=registry.catalog(), headers={"ETag": registry.etag})
+
+    async def get_metrics(self):
+        """Get the metrics of this Pi in the Prometheus text format"""
+        return Response(render(), media_type=CONTENT_TYPE)
+
+    def _sensed_states(self):
+        """((board, wire), 1 if energized) of every board, from the latest sample so a scrape never touches the bus"""
+        for slot in self.leases.slots.values():
+            if slot.rb is None:
+                continue
+            for wire, energized in relay_state.decode(slot.rb.sense_module.last_sample.state).items():
+                yield (slot.board.name, wire), int(energized)
+
+    async def get_sampler_stats(self, board: Optional[str] = None, session_id: Optional[str] = None):
+        """Get sense sampler rate, jitter and missed deadline counts"""
+        return self._slot(board, session_id).rb.sampler.stats()
 
     # Aquastat Endpoints
-    def start_aquastat_mode(self, request: SessionID):
-        self._validate_session(request)
-        return self.rb.switch_module.start_aquastat_mode()
+    async def start_aquastat_mode(self, request: SessionID):
+        slot = self._validate_session(request).slot
+        return await slot.hw.run(slot.rb.switch_module.start_aquastat_mode)
 
-    def end_aquastat_mode(self, request: SessionID):
-        self._validate_session(request)
-        return self.rb.switch_module.end_aquastat_mode()
+    async def end_aquastat_mode(self, request: SessionID):
+        slot = self._validate_session(request).slot
+        return await slot.hw.run(slot.rb.switch_module.end_aquastat_mode)
 
-    def open_aquastat(self, request: SessionID):
-        self._validate_session(request)
-        return self.rb.switch_module.open_aquastat()
+    async def open_aquastat(self, request: SessionID):
+        slot = self._validate_session(request).slot
+        return await slot.hw.run(slot.rb.switch_module.open_aquastat)
 
-    def close_aquastat(self, request: SessionID):
-        self._validate_session(request)
-        return self.rb.switch_module.close_aquastat()
+    async def close_aquastat(self, request: SessionID):
+        slot = self._validate_session(request).slot
+        return await slot.hw.run(slot.rb.switch_module.close_aquastat)
 
-    def get_aquastat_mode(self):
-        self._validate_session()
-        return self.rb.switch_module.get_aquastat_mode()
+    # mode and state are read from the switch module shadow, no bus access
+    async def get_aquastat_mode(self, board: Optional[str] = None, session_id: Optional[str] = None):
+        return self._slot(board, session_id).rb.switch_module.get_aquastat_mode()
 
-    def get_aquastat_state(self):
-        self._validate_session()
-        return self.rb.switch_module.get_aquastat_state()
+    async def get_aquastat_state(self, board: Optional[str] = None, session_id: Optional[str] = None):
+        return self._slot(board, session_id).rb.switch_module.get_aquastat_state()
 
 
 def run_server():
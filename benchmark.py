@@ -0,0 +1,394 @@
+"""Benchmarks of the hardware path on the simulated bus
+
+Runs against the software simulator (HVAC_BACKEND=sim, see hvac_simulator.py) with a configurable latency per i2c
+transaction and measures:
+
+- configure: SwitchModule.configure wall time and bus transactions for every CONFIG_* transition pair
+- detection: wait_for_event latency from a simulated thermostat call to the match, with the sense mode the board runs
+  in (sampler, interrupts or polling, set by SENSE_SAMPLER/SENSE_INTERRUPTS as on the rigs)
+- relay_states: cost of one get_relay_states call, from the sampler's last sample and from the bus
+- endpoints: requests per second and p50/p99 latency of the endpoints of arb_server.py and arb_server_fast_api.py,
+  through the frameworks' in-process test clients so the numbers cover the server stack without the network
+
+Relays settle instantly by default so the settling times of the relay profile don't hide the cost of the bus and the
+drivers, --settling keeps the profile times. Results are written as JSON. With --baseline the p50/p99/mean times,
+bus transactions and requests per second are compared against a stored result, and the run fails if any of them got
+worse by more than --tolerance.
+
+Usage: LOG_LEVEL=WARNING python benchmark.py --latency 0.0002 --output bench.json [--baseline baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from typing import Callable, Dict, List
+
+# before anything imports constants, the benchmarks never drive real relays
+os.environ.setdefault("HVAC_BACKEND", "sim")
+
+from constants import HVAC_BACKEND, HVAC_SIM_LATENCY
+from service_logging import log
+from board_registry import BoardRegistry
+from relay_board import RelayBoard
+from relay_settling import RelayProfile
+from sense_module_events import SenseModuleEvents
+from switch_module_configurations import SwitchModuleConfigurations
+
+DEFAULT_SESSION = {"model": "ares", "has_pek": False, "has_rh": False, "has_rc": True, "in_phase": True,
+                   "acc_minus": False}
+SUITES = ("configure", "detection", "relay_states", "endpoints")
+# compared metric -> True if lower is better
+COMPARED = {"p50_s": True, "p99_s": True, "mean_s": True, "transactions": True, "rps": False}
+
+
+def summarize(samples: List[float]) -> Dict:
+    """Count, mean and nearest rank percentiles of timing samples in seconds"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean_s": sum(ordered) / len(ordered),
+        "min_s": ordered[0],
+        "p50_s": percentile(0.50),
+        "p99_s": percentile(0.99),
+        "max_s": ordered[-1],
+    }
+
+
+def instant_settling(relay_board: RelayBoard):
+    """Lets the relays of `relay_board` settle as soon as they are written"""
+    pins = dict.fromkeys(SwitchModuleConfigurations.DATA, 0.0)
+    relay_board.settler.profile = RelayProfile(relay_board.board.revision, operate=pins, release=pins)
+
+
+def sense_mode(relay_board: RelayBoard) -> str:
+    if relay_board.sense_module.int_pin is not None:
+        return "interrupts"
+    return "sampler" if relay_board.sense_module.sampling else "polling"
+
+
+def bench_configure(relay_board: RelayBoard, simulator, repeats: int = 1) -> Dict:
+    """Times configure for every ordered pair of configurations of the board's registry, each starting from the
+    first configuration of the pair. The sampler is stopped meanwhile so the bus transactions counted are the
+    configure's own."""
+    bus = simulator.bus(relay_board.board.bus_number)
+    commands = relay_board.registry.commands
+    pairs, samples, transactions = {}, [], 0
+    sampling = relay_board.sampler.running
+    relay_board.sampler.stop()
+    for before in commands:
+        for after in commands:
+            elapsed = []
+            for _ in range(repeats):
+                relay_board.configure(commands[before])
+                count = bus.transactions
+                start = time.perf_counter()
+                relay_board.configure(commands[after])
+                elapsed.append(time.perf_counter() - start)
+                count = bus.transactions - count
+            samples.extend(elapsed)
+            transactions += count
+            pairs[f"{before} -> {after}"] = {"elapsed_s": min(elapsed), "transactions": count}
+    if sampling:
+        relay_board.sampler.start()
+    return {"configurations": len(commands), "summary": dict(summarize(samples), transactions=transactions),
+            "pairs": pairs}
+
+
+def bench_detection(relay_board: RelayBoard, simulator, samples: int = 50, timeout: float = 5) -> Dict:
+    """Times wait_for_event from a fan call of the simulated thermostat until the sense module matches EVENT_FAN"""
+    board = simulator.board(relay_board.board.name)
+    relay_board.configure(relay_board.configurations.CONFIG_FAN)
+    latencies, timeouts = [], 0
+    try:
+        for _ in range(samples):
+            board.set_calls(set())
+            relay_board.wait_for_event(SenseModuleEvents.EVENT_NONE, timeout)
+            matched = {}
+
+            def waiter():
+                matched["result"] = relay_board.wait_for_event(SenseModuleEvents.EVENT_FAN, timeout)
+                matched["at"] = time.perf_counter()
+
+            thread = threading.Thread(target=waiter, name="hvac-bench-waiter")
+            thread.start()
+            # lets the waiter block and spreads the call over the sampling period
+            time.sleep(random.uniform(0.002, 0.012))
+            start = time.perf_counter()
+            board.set_calls({"G"})
+            thread.join()
+            if matched["result"]:
+                latencies.append(matched["at"] - start)
+            else:
+                timeouts += 1
+    finally:
+        board.set_calls(None)
+    return dict(summarize(latencies), mode=sense_mode(relay_board), timeouts=timeouts)
+
+
+def bench_relay_states(relay_board: RelayBoard, calls: int = 2000) -> Dict:
+    """Times get_relay_states with the sampler running and with every call reading the bus"""
+
+    def timed() -> Dict:
+        samples = []
+        for _ in range(calls):
+            start = time.perf_counter()
+            relay_board.sense_module.get_relay_states()
+            samples.append(time.perf_counter() - start)
+        return summarize(samples)
+
+    results = {}
+    if not relay_board.sampler.running:
+        relay_board.sampler.start()
+    results["sampling"] = timed()
+    relay_board.sampler.stop()
+    results["bus"] = timed()
+    relay_board.sampler.start()
+    return results
+
+
+def bench_requests(send: Callable, requests: List, count: int) -> Dict:
+    """Sends every request `count` times in a row
+
+    :param send: sends one (method, path, body) request and returns its status code
+    :param requests: (name, method, path, body) of the requests, body may be a callable returning it
+    :return: name -> timing summary, requests per second and count of responses that were not 2xx
+    """
+    results = {}
+    for name, method, path, body in requests:
+        samples, errors = [], 0
+        for i in range(count):
+            payload = body(i) if callable(body) else body
+            start = time.perf_counter()
+            status = send(method, path, payload)
+            samples.append(time.perf_counter() - start)
+            errors += not 200 <= status < 300
+        results[name] = dict(summarize(samples), rps=len(samples) / sum(samples), errors=errors)
+    return results
+
+
+def session_requests(session: Dict, configs: List[str]) -> List:
+    """Endpoints that both servers serve within a session"""
+    return [
+        ("GET /api/status/", "GET", "/api/status/", None),
+        ("GET /api/configs/", "GET", "/api/configs/", None),
+        ("POST /api/relays/", "POST", "/api/relays/", session),
+        ("POST /api/relays/configure/", "POST", "/api/relays/configure/",
+         lambda i: dict(session, config=configs[i % len(configs)])),
+    ]
+
+
+def bench_session_cycle(send: Callable, start_session: Callable, count: int) -> Dict:
+    """Times starting and ending a session `count` times"""
+    starts, ends, errors = [], [], 0
+    for _ in range(count):
+        start = time.perf_counter()
+        session_id = start_session()
+        starts.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        status = send("DELETE", "/api/session/", {"session_id": session_id})
+        ends.append(time.perf_counter() - start)
+        errors += not 200 <= status < 300
+    return {
+        "POST /api/session/": dict(summarize(starts), rps=len(starts) / sum(starts)),
+        "DELETE /api/session/": dict(summarize(ends), rps=len(ends) / sum(ends), errors=errors),
+    }
+
+
+def bench_flask(count: int, settling: bool) -> Dict:
+    """Endpoints of arb_server.py through Flask's test client. get_arb_config and the aquastat getters are left out,
+    the switch module answers them with FastAPI responses that only arb_server_fast_api.py can serve."""
+    import arb_server
+
+    server = arb_server.HVACSimServer(serve=False)
+    if not settling:
+        instant_settling(server.rb)
+    client = server.app.test_client()
+
+    def send(method, path, body):
+        return client.open(path, method=method, json=body).status_code
+
+    def start_session():
+        response = client.post("/api/session/", json=DEFAULT_SESSION)
+        return response.get_json()["session_id"]
+
+    try:
+        results = bench_session_cycle(send, start_session, max(1, count // 10))
+        session = {"session_id": start_session()}
+        results.update(bench_requests(send, session_requests(session, ["CONFIG_FAN", "CONFIG_POWER"]), count))
+        send("DELETE", "/api/session/", session)
+    finally:
+        server.rb.cleanup()
+    return results
+
+
+def bench_fast_api(count: int, settling: bool) -> Dict:
+    """Endpoints of arb_server_fast_api.py through Starlette's test client"""
+    from fastapi.testclient import TestClient
+    import arb_server_fast_api
+
+    server = arb_server_fast_api.HVACSimServer()
+    slots = list(server.leases.slots.values())
+    if not settling:
+        for slot in slots:
+            instant_settling(slot.rb)
+    try:
+        with TestClient(server.app) as client:
+
+            def send(method, path, body):
+                return client.request(method, path, json=body).status_code
+
+            def start_session():
+                return client.post("/api/session/", json=DEFAULT_SESSION).json()["session_id"]
+
+            results = bench_session_cycle(send, start_session, max(1, count // 10))
+            session = {"session_id": start_session()}
+            requests = session_requests(session, ["CONFIG_FAN", "CONFIG_POWER"]) + [
+                ("POST /api/relays/wait/", "POST", "/api/relays/wait/", dict(session, event="EVENT_FAN", timeout=0)),
+                ("GET /api/get_arb_config/", "GET", "/api/get_arb_config/", None),
+                ("GET /api/aquastat/mode/", "GET", "/api/aquastat/mode/", None),
+                ("GET /api/aquastat/state/", "GET", "/api/aquastat/state/", None),
+                ("GET /api/boards/", "GET", "/api/boards/", None),
+                ("GET /metrics", "GET", "/metrics", None),
+            ]
+            results.update(bench_requests(send, requests, count))
+            send("DELETE", "/api/session/", session)
+    finally:
+        for slot in slots:
+            slot.rb.cleanup()
+    return results
+
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    """Compared metrics of a result as "suite.name.metric" -> value, the per pair configure times are left out"""
+    metrics = {}
+    for key, value in results.items():
+        if key in ("meta", "comparison", "pairs"):
+            continue
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{prefix}{key}."))
+        elif key in COMPARED and isinstance(value, (int, float)):
+            metrics[prefix + key] = value
+    return metrics
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> Dict:
+    """Compares the metrics of `results` present in both against `baseline`
+
+    :param tolerance: relative change allowed before a metric counts as a regression or an improvement
+    :return: {"regressions": [...], "improvements": [...], "compared": count}, each entry with the metric, its
+        baseline and current value and the relative change
+    """
+    current, previous = flatten(results), flatten(baseline)
+    regressions, improvements = [], []
+    for metric in sorted(current.keys() & previous.keys()):
+        before, after = previous[metric], current[metric]
+        if not before:
+            continue
+        change = (after - before) / before
+        worse = change if COMPARED[metric.rsplit(".", 1)[1]] else -change
+        entry = {"metric": metric, "baseline": before, "current": after, "change": change}
+        if worse > tolerance:
+            regressions.append(entry)
+        elif worse < -tolerance:
+            improvements.append(entry)
+    return {"tolerance": tolerance, "compared": len(current.keys() & previous.keys()),
+            "regressions": regressions, "improvements": improvements}
+
+
+def run(suites: List[str], latency: float, settling: bool, detection_samples: int, requests: int,
+        repeats: int) -> Dict:
+    """Runs the benchmark suites on the default board of the board registry
+
+    :return: results by suite, with the run's settings under "meta"
+    """
+    # imported here, SIMULATOR only exists on the sim backend
+    from hvac_simulator import SIMULATOR
+
+    SIMULATOR.set_latency(latency)
+    board = BoardRegistry.load().default()
+    results = {"meta": {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "board": board.name,
+        "latency_s": latency,
+        "settling": settling,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+    }}
+
+    if {"configure", "detection", "relay_states"} & set(suites):
+        relay_board = RelayBoard(**DEFAULT_SESSION, board=board)
+        if not settling:
+            instant_settling(relay_board)
+        try:
+            results["meta"]["sense_mode"] = sense_mode(relay_board)
+            if "configure" in suites:
+                log.warning("Benchmarking configure")
+                results["configure"] = bench_configure(relay_board, SIMULATOR, repeats)
+            if "detection" in suites:
+                log.warning("Benchmarking detection")
+                results["detection"] = bench_detection(relay_board, SIMULATOR, detection_samples)
+            if "relay_states" in suites:
+                log.warning("Benchmarking get_relay_states")
+                results["relay_states"] = bench_relay_states(relay_board)
+        finally:
+            relay_board.cleanup()
+
+    if "endpoints" in suites:
+        log.warning("Benchmarking the endpoints of arb_server.py")
+        results["endpoints"] = {"flask": bench_flask(requests, settling)}
+        log.warning("Benchmarking the endpoints of arb_server_fast_api.py")
+        results["endpoints"]["fast_api"] = bench_fast_api(requests, settling)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the HVAC simulator hardware path on the simulated bus")
+    parser.add_argument("--suite", action="append", dest="suites", choices=SUITES,
+                        help="suite to run, repeat to run several, all by default")
+    parser.add_argument("--latency", type=float, default=HVAC_SIM_LATENCY,
+                        help="seconds every simulated i2c transaction takes")
+    parser.add_argument("--settling", action="store_true", help="wait out the relay profile's settling times")
+    parser.add_argument("--repeats", type=int, default=1, help="times every configure pair is timed, best is kept")
+    parser.add_argument("--detection-samples", type=int, default=50, help="simulated calls timed for detection")
+    parser.add_argument("--requests", type=int, default=200, help="requests sent to every endpoint")
+    parser.add_argument("--output", help="write the results here instead of stdout")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slowdown of a metric before it counts as a regression")
+    args = parser.parse_args(argv)
+    if HVAC_BACKEND != "sim":
+        parser.error(f"benchmarks run on the simulator only, HVAC_BACKEND is {HVAC_BACKEND}")
+
+    results = run(args.suites or list(SUITES), args.latency, args.settling, args.detection_samples, args.requests,
+                  args.repeats)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("latency_s") != args.latency:
+            log.warning(f"Baseline was taken with a latency of {baseline.get('meta', {}).get('latency_s')} s, "
+                        f"this run uses {args.latency} s")
+        results["comparison"] = compare(results, baseline, args.tolerance)
+        for entry in results["comparison"]["regressions"]:
+            log.warning(f"Regression in {entry['metric']}: {entry['baseline']:.6g} -> {entry['current']:.6g} "
+                        f"({entry['change']:+.0%})")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    else:
+        json.dump(results, sys.stdout, indent=4)
+        print()
+    return 1 if results.get("comparison", {}).get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
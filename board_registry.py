@@ -0,0 +1,120 @@
+"""Registry of the HVAC Sim boards driven by this Pi
+
+Every board is described by a BoardDescriptor (bus number, expander addresses, board revision and control GPIOs) and
+a RelayBoard is built from its descriptor. Without a boards file the registry holds the single default board on bus 1.
+With BOARDS_CONFIG pointing at a JSON file it holds every board listed there:
+
+    [
+        {"name": "rack1", "bus_number": 1, "sense_address": "0x22", "ic1_address": "0x21", "ic2_address": "0x20",
+         "revision": "v2", "gpio": {"execute": 18, "dbg_led": 17, "out1_rstn": 19, "out2_rstn": 13, "in_rstn": 26}},
+        {"name": "rack2", "bus_number": 3, "sense_address": "0x22", "ic1_address": "0x21", "ic2_address": "0x20",
+         "gpio": {"execute": 20, "dbg_led": 21, "out1_rstn": 16, "out2_rstn": 7, "in_rstn": 8},
+         "models": ["artemis"]}
+    ]
+
+Addresses may be given as numbers or as "0x.." strings and default to the V2 addresses. Control GPIOs missing from
+"gpio" are not wired on that fixture. "models" restricts a board to the thermostat models its fixture takes, without
+it the board takes any model. Each bus gets its own HardwareExecutor, so boards on different buses are driven in
+parallel while boards sharing a bus take turns.
+"""
+import json
+from types import MappingProxyType
+from typing import Dict, Iterator, List
+
+from constants import BOARD_REVISION, BOARDS_CONFIG, DEVICE_LIST
+from hardware_executor import HardwareExecutor
+from relay_board import DEFAULT_BOARD, DEFAULT_GPIO, BoardDescriptor
+
+
+def _address(value) -> int:
+    """i2c address from a number or a "0x.." string"""
+    return int(value, 0) if isinstance(value, str) else int(value)
+
+
+def descriptor_from_dict(data: Dict) -> BoardDescriptor:
+    """Builds a descriptor from one entry of the boards file
+
+    :raises ValueError: if the entry has no name or names an unknown control GPIO or model
+    """
+    if not data.get("name"):
+        raise ValueError("Every board needs a name")
+    gpio = data.get("gpio", {})
+    unknown = set(gpio) - set(DEFAULT_GPIO)
+    if unknown:
+        raise ValueError(f"Board {data['name']}: unknown control GPIOs {sorted(unknown)}")
+    models = data.get("models")
+    if models is not None and set(models) - set(DEVICE_LIST):
+        raise ValueError(f"Board {data['name']}: unknown models {sorted(set(models) - set(DEVICE_LIST))}")
+    return BoardDescriptor(
+        name=data["name"],
+        bus_number=int(data.get("bus_number", DEFAULT_BOARD.bus_number)),
+        sense_address=_address(data.get("sense_address", DEFAULT_BOARD.sense_address)),
+        ic1_address=_address(data.get("ic1_address", DEFAULT_BOARD.ic1_address)),
+        ic2_address=_address(data.get("ic2_address", DEFAULT_BOARD.ic2_address)),
+        revision=data.get("revision", BOARD_REVISION),
+        gpio=MappingProxyType({name: gpio.get(name) for name in DEFAULT_GPIO}),
+        models=tuple(models) if models is not None else None,
+    )
+
+
+class BoardRegistry:
+
+    def __init__(self, descriptors: List[BoardDescriptor]):
+        """
+        :param descriptors: boards in the order they are listed, the first one is the default
+        :raises ValueError: if two boards share a name, an expander address on the same bus or a control GPIO
+        """
+        if not descriptors:
+            raise ValueError("At least one board is needed")
+        boards, addresses, channels = {}, {}, {}
+        for board in descriptors:
+            if board.name in boards:
+                raise ValueError(f"Board {board.name} is listed twice")
+            for address in (board.sense_address, board.ic1_address, board.ic2_address):
+                owner = addresses.setdefault((board.bus_number, address), board.name)
+                if owner != board.name:
+                    raise ValueError(
+                        f"Boards {owner} and {board.name} both use address {address:#04x} on bus {board.bus_number}"
+                    )
+            for pin in board.gpio.values():
+                if pin is None:
+                    continue
+                owner = channels.setdefault(pin, board.name)
+                if owner != board.name:
+                    raise ValueError(f"Boards {owner} and {board.name} both use GPIO {pin}")
+            boards[board.name] = board
+        # board name -> descriptor, in the order they were listed
+        self.boards = MappingProxyType(boards)
+
+    @classmethod
+    def load(cls, path: str = BOARDS_CONFIG) -> "BoardRegistry":
+        """Loads the boards listed in `path`, or the single default board if no path is given
+
+        :raises ValueError: if the file describes an invalid set of boards
+        """
+        if not path:
+            return cls([DEFAULT_BOARD])
+        with open(path) as f:
+            data = json.load(f)
+        return cls([descriptor_from_dict(entry) for entry in data])
+
+    def __iter__(self) -> Iterator[BoardDescriptor]:
+        return iter(self.boards.values())
+
+    def __len__(self) -> int:
+        return len(self.boards)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.boards
+
+    def __getitem__(self, name: str) -> BoardDescriptor:
+        return self.boards[name]
+
+    def default(self) -> BoardDescriptor:
+        """The first board listed"""
+        return next(iter(self.boards.values()))
+
+    @staticmethod
+    def executor(board: BoardDescriptor) -> HardwareExecutor:
+        """The hardware executor of the bus `board` is on"""
+        return HardwareExecutor.for_bus(board.bus_number)
@@ -0,0 +1,66 @@
+"""Registry of valid relay configurations
+
+The registry of a flag combination is derived from the CONFIG_* attributes of SwitchModuleConfigurations, so new
+configurations show up in both servers without touching a hand maintained table. Only configurations that are valid
+for the flags are listed. Registries are immutable and built once per flag combination per process, the catalog they
+publish carries an ETag so clients can cache it.
+"""
+import hashlib
+import json
+import threading
+from types import MappingProxyType
+from typing import Dict, Optional, Tuple
+
+from switch_module_configurations import SwitchModuleConfigurations
+
+
+class ConfigRegistry:
+
+    # one registry per flag combination, shared by both servers and every session of the process
+    _registries = {}
+    _registries_lock = threading.Lock()
+
+    def __init__(self, model, has_pek=False, has_rh=False, has_rc=True, in_phase=True, acc_minus=False):
+        configurations = SwitchModuleConfigurations.get(model, has_pek, has_rh, has_rc, in_phase, acc_minus)
+        # config name -> tuple of pins, in the order the configurations are defined
+        self.commands = MappingProxyType({
+            name: tuple(getattr(configurations, name)) for name in configurations.COMPILED
+        })
+        self.flags = MappingProxyType({
+            "model": model, "has_pek": has_pek, "has_rh": has_rh, "has_rc": has_rc, "in_phase": in_phase,
+            "acc_minus": acc_minus
+        })
+        self.etag = '"' + hashlib.sha1(json.dumps(self.catalog(), sort_keys=True).encode()).hexdigest() + '"'
+
+    @classmethod
+    def get(cls, model, has_pek=False, has_rh=False, has_rc=True, in_phase=True, acc_minus=False) -> "ConfigRegistry":
+        """Returns the registry of a flag combination, built the first time it is seen
+
+        :raises ValueError: if the flag combination is invalid
+        """
+        key = (model, has_pek, has_rh, has_rc, in_phase, acc_minus)
+        with cls._registries_lock:
+            if key not in cls._registries:
+                cls._registries[key] = cls(*key)
+            return cls._registries[key]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.commands
+
+    def __getitem__(self, name: str) -> Tuple[str, ...]:
+        return self.commands[name]
+
+    def catalog(self) -> Dict[str, Dict]:
+        """Flags and every valid config name with its pins
+
+        :return: {"flags": {...}, "configs": {name: [pins]}}, a copy the caller may modify
+        """
+        return {"flags": dict(self.flags), "configs": {name: list(pins) for name, pins in self.commands.items()}}
+
+    def not_modified(self, if_none_match: Optional[str]) -> bool:
+        """True if an If-None-Match header value matches the catalog's ETag"""
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # weak comparison, W/ prefixed tags match too
+        return "*" in tags or any((tag[2:] if tag.startswith("W/") else tag) == self.etag for tag in tags)
@@ -1,3 +1,4 @@
+import os
 from types import SimpleNamespace
 
 # Aquastat/Pipe Sensor Constants
@@ -15,3 +16,47 @@ DEVICE_LIST = ["athena","nike","apollo","vulcan","ares","artemis","attisPro","at
 
 # DEFAULT_HVAC_IP = "0.0.0.0"
 DEFAULT_SESSION_TTL = 3600  # 1 hour
+# Seconds a reservation queue ticket may go without being polled before it is dropped
+QUEUE_TICKET_TTL = float(os.getenv("QUEUE_TICKET_TTL", "120"))
+
+# Seconds between switch module shadow register verification passes, 0 disables the pass
+SHADOW_VERIFY_INTERVAL = float(os.getenv("SHADOW_VERIFY_INTERVAL", "0"))
+
+# Wake sense module waiters from the expander's interrupt line instead of polling the bus every 2 seconds
+SENSE_INTERRUPTS = os.getenv("SENSE_INTERRUPTS", "0") == "1"
+
+# Background sense sampler, rates in Hz. The sampler runs at the max rate right after a transition and backs off to
+# the min rate while the inputs are quiet. Off by default, it keeps the bus busy at 20-100 Hz so rigs opt in
+SENSE_SAMPLER = os.getenv("SENSE_SAMPLER", "0") == "1"
+SENSE_SAMPLER_MIN_RATE = float(os.getenv("SENSE_SAMPLER_MIN_RATE", "20"))
+SENSE_SAMPLER_MAX_RATE = float(os.getenv("SENSE_SAMPLER_MAX_RATE", "100"))
+
+# In-memory relay state history, bounded by number of transitions and by age in seconds
+RELAY_HISTORY_MAX_ENTRIES = int(os.getenv("RELAY_HISTORY_MAX_ENTRIES", "4096"))
+RELAY_HISTORY_MAX_AGE = float(os.getenv("RELAY_HISTORY_MAX_AGE", str(12 * 3600)))
+
+# Directory for state written at runtime (relay profile, relay counters), kept out of the source tree
+STATE_DIR = os.getenv(
+    "HVAC_STATE_DIR", os.path.join(os.getenv("XDG_STATE_HOME", os.path.expanduser("~/.local/state")), "hvac_sim")
+)
+
+# Relay settling profile (operate/release times and sense map per board revision), see relay_settling.py
+BOARD_REVISION = os.getenv("BOARD_REVISION", "v2")
+RELAY_PROFILE_PATH = os.getenv("RELAY_PROFILE_PATH", os.path.join(STATE_DIR, "relay_profile.json"))
+# Measure the relays with a sense mapping when the relay board starts and store the times in the profile
+RELAY_CALIBRATE = os.getenv("RELAY_CALIBRATE", "0") == "1"
+
+# JSON file describing every HVAC Sim board driven by this Pi, see board_registry.py. Unset drives the single default
+# board on bus 1
+BOARDS_CONFIG = os.getenv("BOARDS_CONFIG", "")
+
+# Hardware backend, "rpi" drives the real boards through RPi.GPIO and smbus2, "sim" runs against the software
+# simulator in hvac_simulator.py
+HVAC_BACKEND = os.getenv("HVAC_BACKEND", "rpi")
+# Seconds every simulated i2c transaction takes
+HVAC_SIM_LATENCY = float(os.getenv("HVAC_SIM_LATENCY", "0"))
+# Directory of the persistent per-relay actuation counters, one file per board, see relay_counters.py. The simulator
+# keeps its own so simulated runs on a rig do not count against the real relays
+RELAY_COUNTERS_DIR = os.getenv(
+    "RELAY_COUNTERS_DIR", os.path.join(STATE_DIR, "relay_counters" if HVAC_BACKEND == "rpi" else "relay_counters_sim")
+)
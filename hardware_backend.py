@@ -0,0 +1,15 @@
+"""Hardware backend selection
+
+The drivers get RPi.GPIO and the SMBus class from here instead of importing them directly. HVAC_BACKEND=rpi (the
+default) uses the real RPi.GPIO and smbus2 on a Raspberry Pi. HVAC_BACKEND=sim swaps in the pure software simulator of
+hvac_simulator.py, so both servers and the scenario runner run unchanged on any Linux box without the Pi packages.
+"""
+from constants import HVAC_BACKEND
+
+if HVAC_BACKEND == "sim":
+    from hvac_simulator import GPIO, SimulatedSMBus as SMBus
+elif HVAC_BACKEND == "rpi":
+    import RPi.GPIO as GPIO
+    from smbus2 import SMBus
+else:
+    raise ImportError(f"Unknown HVAC_BACKEND {HVAC_BACKEND}, must be rpi or sim")
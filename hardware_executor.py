@@ -0,0 +1,69 @@
+"""Dedicated executor for hardware work
+
+Every request that drives the relays or reads the bus is funnelled through one worker thread, so hardware operations
+from concurrent requests run one after the other in submission order instead of interleaving on the bus. Async
+handlers await the result without tying up a thread of the shared threadpool, which keeps cheap endpoints responsive
+while a long configure is in flight.
+
+Boards on different i2c buses do not contend for anything, so each bus gets its own executor through `for_bus` and
+boards on separate buses run in parallel. Boards sharing a bus share its executor.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict
+
+
+class HardwareExecutor:
+
+    # one executor per i2c bus, shared by every board on that bus
+    _buses: Dict[int, "HardwareExecutor"] = {}
+    _buses_lock = threading.Lock()
+
+    def __init__(self, name: str = "hvac-hw"):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name, initializer=self._register_worker)
+        self._worker = None
+
+    @classmethod
+    def for_bus(cls, bus_number: int) -> "HardwareExecutor":
+        """Returns the executor of `bus_number`, starting it on first use
+
+        :param bus_number: i2c bus number the boards driven through the executor are on
+        :return: the process wide executor of that bus
+        """
+        with cls._buses_lock:
+            executor = cls._buses.get(bus_number)
+            if executor is None:
+                executor = cls(f"hvac-hw-bus{bus_number}")
+                cls._buses[bus_number] = executor
+            return executor
+
+    def _register_worker(self):
+        self._worker = threading.current_thread()
+
+    def on_worker(self) -> bool:
+        """True when called from the hardware worker thread"""
+        return threading.current_thread() is self._worker
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Queues `fn` on the hardware thread without waiting for it
+
+        :return: concurrent.futures.Future of the result
+        """
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def call(self, fn, *args, **kwargs):
+        """Runs `fn` on the hardware thread and blocks until it returns. Runs inline if already on that thread."""
+        if self.on_worker():
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def run(self, fn, *args, **kwargs):
+        """Runs `fn` on the hardware thread and awaits its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True):
+        """Stops accepting work and optionally waits for queued work to finish"""
+        self._executor.shutdown(wait=wait)
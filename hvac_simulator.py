@@ -0,0 +1,462 @@
+"""Pure software stand-in for the HVAC Sim hardware
+
+Selected with HVAC_BACKEND=sim (see hardware_backend.py). It provides:
+
+- SimulatedMCP23017, the registers of one expander (IODIR, IPOL, GPINTEN, DEFVAL, INTCON, IOCON, INTF, INTCAP, GPIO,
+  OLAT) in IOCON.BANK=0 layout with sequential block access and interrupt on change
+- SimulatedSMBus, a drop in for smbus2.SMBus on a simulated bus, with a configurable latency per transaction
+- SimulatedGPIO, a drop in for the RPi.GPIO module, with edge detection callbacks run on their own thread
+- SimulatedBoard, the three expanders of one HVAC Sim board and the wiring between them: a thermostat call is driven
+  on a thermostat terminal (following the model's quirks, e.g. Artemis drives O/B on W2) and reaches a sense module
+  input through a switch module relay only while that relay is closed
+
+Boards are created from the board registry the first time a bus is opened. By default the simulated thermostat calls
+on every terminal, so the sensed state follows the closed relays and the servers behave as on a rig with a thermostat
+calling for everything the configuration connects. Tests and benchmarks drive specific calls through SIMULATOR:
+
+    board = SIMULATOR.board("board0")
+    board.set_calls({"G", "Y1"})
+"""
+import errno
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from constants import HVAC_SIM_LATENCY
+from sense_module_events import SenseModuleEvents
+from switch_module_configurations import BANK_INDEX, SwitchModuleConfigurations
+
+# MCP23017 register addresses with IOCON.BANK = 0, port B is always the port A address + 1
+IODIRA = 0x00
+IPOLA = 0x02
+GPINTENA = 0x04
+DEFVALA = 0x06
+INTCONA = 0x08
+IOCON = 0x0A
+GPPUA = 0x0C
+INTFA = 0x0E
+INTCAPA = 0x10
+GPIOA = 0x12
+OLATA = 0x14
+REGISTER_COUNT = 0x16
+
+# thermostat terminal -> (relay, sensed input) pairs it reaches the sense module through
+WIRING = {
+    "G": (("S6_G_NO_PEK", SenseModuleEvents.IN_G), ("S7_G_PEK_ATHENA", SenseModuleEvents.IN_G)),
+    "Y1": (("S11_Y1_NO_PEK", SenseModuleEvents.IN_Y1), ("S12_Y_PEK_ATHENA", SenseModuleEvents.IN_Y1)),
+    "Y2": (("S16_Y2_G2", SenseModuleEvents.IN_Y2),),
+    "W1": (("S14_W1_NO_PEK", SenseModuleEvents.IN_W1), ("S15_W_PEK", SenseModuleEvents.IN_W1)),
+    "W2": (("S17_W2_G3", SenseModuleEvents.IN_W2),),
+    "OB": (("S18_OB", SenseModuleEvents.IN_OB),),
+    "ACC": (("S19_ACCP", SenseModuleEvents.IN_ACC), ("S20_ACCM", SenseModuleEvents.IN_ACC)),
+    "PEK": (("S13_Y_PEK_NOT_ATHENA", SenseModuleEvents.IN_PEK),),
+    "PEK_ALT": (("PEK_ALT", SenseModuleEvents.IN_PEK_ALT),),
+}
+
+# thermostat call -> terminal it is driven on, calls not listed are driven on the terminal of the same name
+CALL_TERMINALS = {"G2": "Y2", "G3": "W2"}
+# model quirks on top of CALL_TERMINALS
+MODEL_CALL_TERMINALS = {
+    # W2 and O/B share a terminal, G3 and ACC+ come out on PEK+
+    "artemis": {"OB": "W2", "G3": "PEK_ALT", "ACC": "PEK_ALT"},
+    "attisRetail": {"OB": "W2", "Y2": "W2", "G2": "W2"},
+}
+
+
+def call_terminal(model: str, call: str) -> str:
+    """Thermostat terminal `model` drives `call` on"""
+    return MODEL_CALL_TERMINALS.get(model, {}).get(call, CALL_TERMINALS.get(call, call))
+
+
+class SimulatedMCP23017:
+
+    def __init__(self, address: int):
+        self.address = address
+        self.registers = [0] * REGISTER_COUNT
+        # power on reset, every pin an input
+        self.registers[IODIRA] = self.registers[IODIRA + 1] = 0xFF
+        # levels driven onto the pins from outside, port B in the upper byte
+        self.inputs = 0
+        self.interrupt_asserted = False
+        # called with the expander after a write that may change what it drives
+        self.on_output: Optional[Callable[["SimulatedMCP23017"], None]] = None
+        # called with True when INT asserts and False when it clears
+        self.on_interrupt: Optional[Callable[[bool], None]] = None
+
+    def word(self, register: int) -> int:
+        """A/B register pair as a 16 bit value, port B in the upper byte"""
+        return self.registers[register] | self.registers[register + 1] << 8
+
+    def pin_levels(self) -> int:
+        """Levels on the pins, output latch for outputs and external levels for inputs"""
+        iodir = self.word(IODIRA)
+        return (self.word(OLATA) & ~iodir | self.inputs & iodir) & 0xFFFF
+
+    def outputs(self) -> int:
+        """Output latch bits of the pins set as outputs"""
+        return self.word(OLATA) & ~self.word(IODIRA) & 0xFFFF
+
+    def read(self, register: int) -> int:
+        if register in (GPIOA, GPIOA + 1, INTCAPA, INTCAPA + 1):
+            # reading GPIO or INTCAP clears the interrupt
+            self._set_interrupt(False)
+        if register in (GPIOA, GPIOA + 1):
+            levels = self.pin_levels() ^ (self.word(IPOLA) & self.word(IODIRA))
+            return levels >> (8 * (register - GPIOA)) & 0xFF
+        return self.registers[register]
+
+    def write(self, register: int, value: int):
+        if register in (INTFA, INTFA + 1, INTCAPA, INTCAPA + 1):
+            # read only
+            return
+        if register in (GPIOA, GPIOA + 1):
+            # writes to GPIO go to the output latch
+            register += OLATA - GPIOA
+        if register in (IOCON, IOCON + 1):
+            # one register mapped at both addresses
+            self.registers[IOCON] = self.registers[IOCON + 1] = value & 0xFF
+        else:
+            self.registers[register] = value & 0xFF
+        if register in (IODIRA, IODIRA + 1, OLATA, OLATA + 1) and self.on_output is not None:
+            self.on_output(self)
+
+    def read_block(self, register: int, length: int) -> List[int]:
+        """Sequential read, the register pointer increments and wraps past the last register"""
+        return [self.read((register + i) % REGISTER_COUNT) for i in range(length)]
+
+    def write_block(self, register: int, data: Iterable[int]):
+        for i, value in enumerate(data):
+            self.write((register + i) % REGISTER_COUNT, value)
+
+    def drive_inputs(self, levels: int):
+        """Sets the levels driven onto the pins from outside, raising interrupt on change where enabled"""
+        previous = self.pin_levels()
+        self.inputs = levels & 0xFFFF
+        current = self.pin_levels()
+        enabled = self.word(GPINTENA) & self.word(IODIRA)
+        intcon = self.word(INTCONA)
+        # INTCON 0 compares against the previous level, 1 against DEFVAL
+        triggered = enabled & (((previous ^ current) & ~intcon) | ((self.word(DEFVALA) ^ current) & intcon))
+        if not triggered:
+            return
+        intf = self.word(INTFA) | triggered
+        self.registers[INTFA], self.registers[INTFA + 1] = intf & 0xFF, intf >> 8
+        if not self.interrupt_asserted:
+            captured = current ^ (self.word(IPOLA) & self.word(IODIRA))
+            self.registers[INTCAPA], self.registers[INTCAPA + 1] = captured & 0xFF, captured >> 8
+            self._set_interrupt(True)
+
+    def _set_interrupt(self, asserted: bool):
+        if asserted == self.interrupt_asserted:
+            return
+        self.interrupt_asserted = asserted
+        if not asserted:
+            self.registers[INTFA] = self.registers[INTFA + 1] = 0
+        if self.on_interrupt is not None:
+            self.on_interrupt(asserted)
+
+
+class SimulatedI2CBus:
+    """Devices on one simulated bus, with the per transaction latency and error injection"""
+
+    def __init__(self, bus_number: int, latency: float):
+        self.bus_number = bus_number
+        # seconds every transaction takes
+        self.latency = latency
+        self.devices: Dict[int, SimulatedMCP23017] = {}
+        self.lock = threading.RLock()
+        self.transactions = 0
+        # the next `fail_transactions` transactions fail with a remote I/O error, as on a NACK
+        self.fail_transactions = 0
+
+    def device(self, address: int) -> SimulatedMCP23017:
+        """Expander at `address`, created if the bus has none there yet"""
+        with self.lock:
+            if address not in self.devices:
+                self.devices[address] = SimulatedMCP23017(address)
+            return self.devices[address]
+
+    def transaction(self, address: int) -> SimulatedMCP23017:
+        """Accounts for one transaction to `address` and returns the device answering it
+
+        :raises OSError: if nothing answers at `address` or an error was injected
+        """
+        self.transactions += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_transactions:
+            self.fail_transactions -= 1
+            raise OSError(errno.EREMOTEIO, f"Injected i2c error at {address:#04x} on bus {self.bus_number}")
+        device = self.devices.get(address)
+        if device is None:
+            raise OSError(errno.EREMOTEIO, f"No device at {address:#04x} on bus {self.bus_number}")
+        return device
+
+
+class SimulatedSMBus:
+    """Drop in for smbus2.SMBus, covering the calls the register transport makes"""
+
+    def __init__(self, bus_number: int):
+        self.bus_number = bus_number
+        self.sim_bus = SIMULATOR.bus(bus_number)
+
+    def read_byte_data(self, i2c_addr: int, register: int) -> int:
+        with self.sim_bus.lock:
+            return self.sim_bus.transaction(i2c_addr).read(register)
+
+    def write_byte_data(self, i2c_addr: int, register: int, value: int):
+        with self.sim_bus.lock:
+            self.sim_bus.transaction(i2c_addr).write(register, value)
+
+    def read_i2c_block_data(self, i2c_addr: int, register: int, length: int) -> List[int]:
+        with self.sim_bus.lock:
+            return self.sim_bus.transaction(i2c_addr).read_block(register, length)
+
+    def write_i2c_block_data(self, i2c_addr: int, register: int, data: List[int]):
+        with self.sim_bus.lock:
+            self.sim_bus.transaction(i2c_addr).write_block(register, data)
+
+    def close(self):
+        pass
+
+
+class SimulatedBoard:
+    """The sense and switch expanders of one HVAC Sim board, wired through a simulated thermostat"""
+
+    def __init__(self, name: str, bus: SimulatedI2CBus, sense_address: int, ic1_address: int, ic2_address: int,
+                 int_pin: Optional[int] = None, model: str = "ares"):
+        """
+        :param int_pin: BCM number of the GPIO the sense expander's INT line is wired to, None if not wired
+        :param model: thermostat model, selects the terminal quirks
+        """
+        self.name = name
+        self.bus = bus
+        self.model = model
+        self.int_pin = int_pin
+        # thermostat calls currently made, None calls on every terminal
+        self.calls: Optional[Set[str]] = None
+        # sensed inputs forced regardless of the wiring, None follows the wiring
+        self.forced_inputs: Optional[int] = None
+        self.sense = bus.device(sense_address)
+        self.ic1 = bus.device(ic1_address)
+        self.ic2 = bus.device(ic2_address)
+        self.ic1.on_output = self.ic2.on_output = lambda _: self.update()
+        if int_pin is not None:
+            # INT is active low, released high by the Pi's pull-up
+            GPIO.drive(int_pin, GPIO.HIGH)
+            self.sense.on_interrupt = lambda asserted: GPIO.drive(int_pin, GPIO.LOW if asserted else GPIO.HIGH)
+
+    def relay_image(self) -> Tuple[int, int, int, int]:
+        """(IC1_GPIOA, IC1_GPIOB, IC2_GPIOA, IC2_GPIOB) as driven onto the relays"""
+        ic1, ic2 = self.ic1.outputs(), self.ic2.outputs()
+        return ic1 & 0xFF, ic1 >> 8, ic2 & 0xFF, ic2 >> 8
+
+    def closed_relays(self) -> List[str]:
+        """Names of the relays currently closed"""
+        image = self.relay_image()
+        return [
+            pin for pin, bank in SwitchModuleConfigurations.BANK.items()
+            if image[BANK_INDEX[bank]] & SwitchModuleConfigurations.DATA[pin]
+        ]
+
+    def energized_terminals(self) -> Set[str]:
+        if self.calls is None:
+            return set(WIRING)
+        return {call_terminal(self.model, call) for call in self.calls}
+
+    def sensed_inputs(self) -> int:
+        """Sense module inputs the wiring produces for the current relays and thermostat calls"""
+        if self.forced_inputs is not None:
+            return self.forced_inputs
+        closed = set(self.closed_relays())
+        inputs = 0
+        for terminal in self.energized_terminals():
+            for relay, bit in WIRING.get(terminal, ()):
+                if relay in closed:
+                    inputs |= bit
+        return inputs
+
+    def update(self):
+        """Recomputes the sense module inputs, called whenever the relays or the thermostat change"""
+        with self.bus.lock:
+            self.sense.drive_inputs(self.sensed_inputs())
+
+    def set_calls(self, calls: Optional[Iterable[str]]):
+        """Sets the thermostat calls, e.g. {"G", "Y1"}. None calls on every terminal."""
+        self.calls = set(calls) if calls is not None else None
+        self.update()
+
+    def set_model(self, model: str):
+        self.model = model
+        self.update()
+
+    def force_inputs(self, inputs: Optional[int]):
+        """Forces the sensed inputs to `inputs` regardless of relays and calls, None to follow the wiring again"""
+        self.forced_inputs = inputs
+        self.update()
+
+
+class SimulatedGPIO:
+    """Drop in for the RPi.GPIO module. Edge detection callbacks run on one events thread, like RPi.GPIO's."""
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.mode = None
+        self.directions: Dict[int, int] = {}
+        self.levels: Dict[int, int] = {}
+        self._edges: Dict[int, Tuple[int, List[Callable]]] = {}
+        self._events = queue.Queue()
+        self._events_thread = None
+
+    @staticmethod
+    def _channels(channel) -> List[int]:
+        return list(channel) if isinstance(channel, (list, tuple)) else [channel]
+
+    def setmode(self, mode: int):
+        self.mode = mode
+
+    def getmode(self) -> Optional[int]:
+        return self.mode
+
+    def setwarnings(self, flag: bool):
+        pass
+
+    def setup(self, channel, direction: int, pull_up_down: int = PUD_OFF, initial: Optional[int] = None):
+        with self._lock:
+            for ch in self._channels(channel):
+                self.directions[ch] = direction
+                if direction == self.OUT:
+                    self.levels[ch] = initial if initial is not None else self.levels.get(ch, self.LOW)
+                elif ch not in self.levels:
+                    self.levels[ch] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+
+    def output(self, channel, value):
+        values = self._channels(value) if isinstance(value, (list, tuple)) else None
+        with self._lock:
+            for i, ch in enumerate(self._channels(channel)):
+                if self.directions.get(ch) != self.OUT:
+                    raise RuntimeError(f"The GPIO channel {ch} has not been set up as an OUTPUT")
+                self.levels[ch] = int(bool(values[i] if values is not None else value))
+
+    def input(self, channel: int) -> int:
+        with self._lock:
+            if channel not in self.directions:
+                raise RuntimeError(f"You must setup() the GPIO channel {channel} first")
+            return self.levels.get(channel, self.LOW)
+
+    def cleanup(self, channel=None):
+        with self._lock:
+            channels = list(self.directions) if channel is None else self._channels(channel)
+            for ch in channels:
+                self.directions.pop(ch, None)
+                self._edges.pop(ch, None)
+            if channel is None:
+                self.mode = None
+
+    def add_event_detect(self, channel: int, edge: int, callback: Optional[Callable] = None,
+                         bouncetime: Optional[int] = None):
+        with self._lock:
+            if channel in self._edges:
+                raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+            self._edges[channel] = (edge, [callback] if callback is not None else [])
+
+    def add_event_callback(self, channel: int, callback: Callable):
+        with self._lock:
+            if channel not in self._edges:
+                raise RuntimeError("Add event detection using add_event_detect first before adding a callback")
+            self._edges[channel][1].append(callback)
+
+    def remove_event_detect(self, channel: int):
+        with self._lock:
+            self._edges.pop(channel, None)
+
+    def drive(self, channel: int, level: int):
+        """Simulator side: sets the level something outside the Pi drives onto `channel`, running the edge detection
+        callbacks of the channel if the level changed"""
+        with self._lock:
+            previous = self.levels.get(channel)
+            self.levels[channel] = level
+            edge, callbacks = self._edges.get(channel, (None, []))
+            if previous is None or previous == level or not callbacks:
+                return
+            if edge == self.BOTH or edge == (self.RISING if level else self.FALLING):
+                if self._events_thread is None:
+                    self._events_thread = threading.Thread(target=self._run_events, name="gpio-events", daemon=True)
+                    self._events_thread.start()
+                for callback in callbacks:
+                    self._events.put((callback, channel))
+
+    def _run_events(self):
+        while True:
+            callback, channel = self._events.get()
+            callback(channel)
+
+
+class Simulator:
+    """Every simulated bus and board of the process"""
+
+    def __init__(self, latency: float = HVAC_SIM_LATENCY):
+        self.latency = latency
+        self.buses: Dict[int, SimulatedI2CBus] = {}
+        # board name -> board
+        self.boards: Dict[str, SimulatedBoard] = {}
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    def bus(self, bus_number: int) -> SimulatedI2CBus:
+        """Simulated bus `bus_number`, with the boards of the board registry on it"""
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                self._load_boards()
+            if bus_number not in self.buses:
+                self.buses[bus_number] = SimulatedI2CBus(bus_number, self.latency)
+            return self.buses[bus_number]
+
+    def _load_boards(self):
+        # imported here, the board registry imports the drivers which import this module through hardware_backend
+        from board_registry import BoardRegistry
+        for descriptor in BoardRegistry.load():
+            self.add_board(descriptor)
+
+    def add_board(self, descriptor) -> SimulatedBoard:
+        """Puts a simulated board for a BoardDescriptor on its bus"""
+        with self._lock:
+            board = SimulatedBoard(
+                descriptor.name, self.bus(descriptor.bus_number), descriptor.sense_address, descriptor.ic1_address,
+                descriptor.ic2_address, descriptor.gpio.get("sense_int")
+            )
+            self.boards[descriptor.name] = board
+            return board
+
+    def board(self, name: str) -> SimulatedBoard:
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                self._load_boards()
+            return self.boards[name]
+
+    def set_latency(self, latency: float):
+        """Sets the seconds every transaction takes on every bus"""
+        with self._lock:
+            self.latency = latency
+            for bus in self.buses.values():
+                bus.latency = latency
+
+
+GPIO = SimulatedGPIO()
+SIMULATOR = Simulator()
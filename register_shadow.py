@@ -0,0 +1,131 @@
+"""Shadow registers for the switch module expanders
+
+The switch module expanders only ever drive outputs, so the bytes last written to their GPIO registers are known
+without asking the hardware. RegisterShadow keeps that copy in memory and is the source of truth for reads. Writes
+only go out for the bytes that actually changed. An optional low-rate verification pass reads the hardware back and
+flags any drift between the shadow and what the expanders are really driving.
+"""
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+from service_logging import log
+from register_transport import RegisterTransport
+
+# index of each bank in a register image
+IC1_GPIOA = 0
+IC1_GPIOB = 1
+IC2_GPIOA = 2
+IC2_GPIOB = 3
+
+BANK_NAMES = ("IC1_GPIOA", "IC1_GPIOB", "IC2_GPIOA", "IC2_GPIOB")
+
+
+class RegisterShadow:
+
+    def __init__(self, transport: RegisterTransport, ic1: int, ic2: int, register: int):
+        """
+        :param transport: transport used to reach the expanders
+        :param ic1: i2c address of IC1
+        :param ic2: i2c address of IC2
+        :param register: address of the port A register shadowed on both ICs (e.g. GPIOA)
+        """
+        self.transport = transport
+        self.ic1 = ic1
+        self.ic2 = ic2
+        self.register = register
+        self._image = [0b00000000, 0b00000000, 0b00000000, 0b00000000]
+        self.drift_count = 0
+        self._verify_stop = threading.Event()
+        self._verify_thread = None
+
+    @property
+    def image(self) -> Tuple[int, int, int, int]:
+        """(IC1_GPIOA, IC1_GPIOB, IC2_GPIOA, IC2_GPIOB) as currently driven"""
+        return tuple(self._image)
+
+    def _read_hardware(self) -> List[int]:
+        """Reads both expanders, one block transaction per IC"""
+        ic1_a, ic1_b = self.transport.read_port_pair(self.ic1, self.register)
+        ic2_a, ic2_b = self.transport.read_port_pair(self.ic2, self.register)
+        return [ic1_a, ic1_b, ic2_a, ic2_b]
+
+    def load(self) -> Tuple[int, int, int, int]:
+        """Seeds the shadow from the hardware. Only needed when the driver takes over expanders that may already be
+        driving outputs (e.g. after a restart).
+
+        :return: the loaded image
+        """
+        with self.transport.lock:
+            self._image = self._read_hardware()
+        return self.image
+
+    def write(self, image: Sequence[int]) -> int:
+        """Drives a new image, writing only the bytes that differ from the shadow
+
+        :param image: (IC1_GPIOA, IC1_GPIOB, IC2_GPIOA, IC2_GPIOB)
+        :return: number of bus transactions issued
+        """
+        transactions = 0
+        with self.transport.lock:
+            for address, index in ((self.ic1, IC1_GPIOA), (self.ic2, IC2_GPIOA)):
+                port_a, port_b = image[index], image[index + 1]
+                changed_a = port_a != self._image[index]
+                changed_b = port_b != self._image[index + 1]
+                if changed_a and changed_b:
+                    self.transport.write_port_pair(address, self.register, port_a, port_b)
+                elif changed_a:
+                    self.transport.write_register(address, self.register, port_a)
+                elif changed_b:
+                    self.transport.write_register(address, self.register + 1, port_b)
+                else:
+                    continue
+                self._image[index] = port_a
+                self._image[index + 1] = port_b
+                transactions += 1
+        return transactions
+
+    def verify(self) -> bool:
+        """Compares the shadow against the hardware and flags any drift. The shadow is left untouched.
+
+        :return: True if the hardware matches the shadow, False otherwise
+        """
+        # hold the bus so a write cannot land between the read back and the comparison
+        with self.transport.lock:
+            hardware = self._read_hardware()
+            image = list(self._image)
+        in_sync = True
+        for name, expected, actual in zip(BANK_NAMES, image, hardware):
+            if expected != actual:
+                in_sync = False
+                log.warning(f"Shadow drift on {name}: expected {expected:>08b} read {actual:>08b}")
+        if not in_sync:
+            self.drift_count += 1
+        return in_sync
+
+    def start_verification(self, interval: float):
+        """Starts a background thread verifying the shadow every `interval` seconds
+
+        :param interval: seconds between verification passes
+        """
+        if self._verify_thread is not None:
+            return
+        self._verify_stop.clear()
+        self._verify_thread = threading.Thread(
+            target=self._verification_loop, args=(interval,), name="shadow-verify", daemon=True
+        )
+        self._verify_thread.start()
+
+    def stop_verification(self, timeout: Optional[float] = None):
+        """Stops the background verification thread if it is running"""
+        if self._verify_thread is None:
+            return
+        self._verify_stop.set()
+        self._verify_thread.join(timeout)
+        self._verify_thread = None
+
+    def _verification_loop(self, interval: float):
+        while not self._verify_stop.wait(interval):
+            try:
+                self.verify()
+            except OSError as e:
+                log.warning(f"Shadow verification failed: {e}")
@@ -0,0 +1,201 @@
+"""Register transport for the MCP23017 I/O expanders
+
+All expanders on the HVAC Sim are left in the default IOCON.BANK=0 mode, so every A/B register pair sits at sequential
+addresses (IODIRA/IODIRB, GPIOA/GPIOB, ...). With sequential addressing enabled the expander auto-increments the
+register pointer, which lets both ports of one IC be read or written in a single block transaction. Reading both
+ports in one transaction also means the A and B bytes come from the same bus transfer and can no longer tear.
+
+The i2c-dev handle itself belongs to a BusOwner, which keeps it open for the lifetime of the process and serializes
+access with a lock. Drivers only ever hold a RegisterTransport, a lightweight view onto the owner, so tearing down
+and rebuilding a RelayBoard no longer reopens the bus.
+
+Every transaction and every failed one is counted per expander address for GET /metrics, see service_metrics.py.
+"""
+import atexit
+import threading
+from typing import Dict, Hashable, Set, Tuple
+
+from hardware_backend import SMBus
+
+from service_logging import log
+from service_metrics import I2C_ERRORS, I2C_TRANSACTIONS
+
+
+class BusOwner:
+    """Holds one open i2c bus for the lifetime of the process"""
+
+    _owners: Dict[int, "BusOwner"] = {}
+    _owners_lock = threading.Lock()
+
+    def __init__(self, bus_number: int):
+        log.info(f"Opening i2c bus {bus_number}")
+        self.bus_number = bus_number
+        self.bus = SMBus(bus_number)
+        # re-entrant so a driver can hold the bus across several transactions
+        self.lock = threading.RLock()
+        self._initialised: Set[Hashable] = set()
+        self._shadows = {}
+
+    @classmethod
+    def get(cls, bus_number: int = 1) -> "BusOwner":
+        """Returns the owner of `bus_number`, opening the bus on first use
+
+        :param bus_number: i2c bus number (/dev/i2c-<bus_number>)
+        :return: the process wide owner of that bus
+        """
+        with cls._owners_lock:
+            owner = cls._owners.get(bus_number)
+            if owner is None:
+                owner = cls(bus_number)
+                cls._owners[bus_number] = owner
+            return owner
+
+    @classmethod
+    def close_all(cls):
+        """Closes every open bus. Registered to run at interpreter exit."""
+        with cls._owners_lock:
+            for owner in cls._owners.values():
+                owner.close()
+            cls._owners.clear()
+
+    def view(self) -> "RegisterTransport":
+        """Returns a lightweight transport sharing this owner's handle and lock"""
+        return RegisterTransport(self)
+
+    def claim_init(self, key: Hashable) -> bool:
+        """Records that the device identified by `key` has been initialised
+
+        :param key: identifies the initialisation (typically the expander address)
+        :return: True the first time `key` is claimed in this process, False afterwards
+        """
+        with self.lock:
+            if key in self._initialised:
+                return False
+            self._initialised.add(key)
+            return True
+
+    def release_init(self, key: Hashable):
+        """Forgets that the device identified by `key` was initialised so the next driver re-initialises it"""
+        with self.lock:
+            self._initialised.discard(key)
+
+    def shadow(self, key: Hashable, factory):
+        """Returns the shadow registered under `key`, building it with `factory` on first use
+
+        Shadows mirror hardware state, so they live as long as the bus does rather than as long as a driver.
+        """
+        with self.lock:
+            if key not in self._shadows:
+                self._shadows[key] = factory()
+            return self._shadows[key]
+
+    def close(self):
+        """Closes the bus handle"""
+        with self.lock:
+            self.bus.close()
+
+
+atexit.register(BusOwner.close_all)
+
+
+class RegisterTransport:
+    # number of bytes in an A/B register pair
+    PORT_PAIR_LENGTH = 2
+
+    def __init__(self, owner: BusOwner):
+        self.owner = owner
+        self.bus = owner.bus
+        self.lock = owner.lock
+        self.bus_number = owner.bus_number
+
+    def __enter__(self):
+        """Context manager entry point"""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Context manager exit - automatic cleanup
+
+        :param exc_type: Exception type if any
+        :param exc_val: Exception value if any
+        :param exc_tb: Exception traceback if any
+
+        :Returns: False to propagate exceptions, True to suppress
+        """
+        self.close()
+        return False  # Never suppress exceptions in HVAC control
+
+    def close(self):
+        """Cleanup method. The bus handle belongs to the BusOwner and stays open."""
+        pass
+
+    def read_register(self, address: int, register: int) -> int:
+        """Reads a single register
+
+        :param address: i2c address of the expander
+        :param register: register address (port A or port B)
+        :return: register value
+        """
+        I2C_TRANSACTIONS.inc(self.bus_number, address)
+        try:
+            with self.lock:
+                return self.bus.read_byte_data(address, register)
+        except OSError:
+            I2C_ERRORS.inc(self.bus_number, address)
+            raise
+
+    def write_register(self, address: int, register: int, value: int):
+        """Writes a single register
+
+        :param address: i2c address of the expander
+        :param register: register address (port A or port B)
+        :param value: byte to write
+        """
+        I2C_TRANSACTIONS.inc(self.bus_number, address)
+        try:
+            with self.lock:
+                self.bus.write_byte_data(address, register, value)
+        except OSError:
+            I2C_ERRORS.inc(self.bus_number, address)
+            raise
+
+    def read_port_pair(self, address: int, register: int) -> Tuple[int, int]:
+        """Reads the A and B registers of a pair in one block transaction
+
+        :param address: i2c address of the expander
+        :param register: address of the port A register of the pair (e.g. GPIOA)
+        :return: (port A value, port B value)
+        """
+        I2C_TRANSACTIONS.inc(self.bus_number, address)
+        try:
+            with self.lock:
+                port_a, port_b = self.bus.read_i2c_block_data(address, register, self.PORT_PAIR_LENGTH)
+        except OSError:
+            I2C_ERRORS.inc(self.bus_number, address)
+            raise
+        return port_a, port_b
+
+    def write_port_pair(self, address: int, register: int, port_a: int, port_b: int):
+        """Writes the A and B registers of a pair in one block transaction
+
+        :param address: i2c address of the expander
+        :param register: address of the port A register of the pair (e.g. GPIOA)
+        :param port_a: byte to write to port A
+        :param port_b: byte to write to port B
+        """
+        I2C_TRANSACTIONS.inc(self.bus_number, address)
+        try:
+            with self.lock:
+                self.bus.write_i2c_block_data(address, register, [port_a, port_b])
+        except OSError:
+            I2C_ERRORS.inc(self.bus_number, address)
+            raise
+
+    def read_word(self, address: int, register: int) -> int:
+        """Reads an A/B register pair as a 16 bit value, port B in the upper byte
+
+        :param address: i2c address of the expander
+        :param register: address of the port A register of the pair (e.g. GPIOA)
+        :return: port A | port B << 8
+        """
+        port_a, port_b = self.read_port_pair(address, register)
+        return port_a | port_b << 8
@@ -1,11 +1,23 @@
-import RPi.GPIO
+from collections import namedtuple
+from types import MappingProxyType
 
+from hardware_backend import GPIO
+
+from constants import (
+    BOARD_REVISION, RELAY_CALIBRATE, RELAY_PROFILE_PATH, SENSE_INTERRUPTS, SENSE_SAMPLER, SENSE_SAMPLER_MAX_RATE,
+    SENSE_SAMPLER_MIN_RATE
+)
 from sense_module_events import SenseModuleEvents
 from service_logging import log
 
+from register_transport import BusOwner
+from relay_counters import RelayCounters
+from relay_settling import RelayProfile, RelaySettler, calibrate
 from sense_module import SenseModule
+from sense_sampler import SenseSampler
 from switch_module import SwitchModule
 from switch_module_configurations import SwitchModuleConfigurations
+from config_registry import ConfigRegistry
 
 RPI_EXECUTE_PIN = 18
 DBG_LED = 17
@@ -21,41 +33,107 @@ AP_RSTn = 23
 AP_BOOTn = 24
 VOLTAGE_SEL = 25
 VBUS_CON = 12
+SENSE_INT = 4  # Sense module INTA/INTB (mirrored), only used when SENSE_INTERRUPTS is enabled
+
+# Everything that tells one HVAC Sim board on the Pi from another: the i2c bus it hangs off, the addresses of its
+# expanders, its board revision (selects the relay profile), the BCM numbers of its control GPIOs and the thermostat
+# models its fixture takes. A control GPIO that is not wired on a fixture is None, models None takes any model.
+BoardDescriptor = namedtuple(
+    "BoardDescriptor",
+    ["name", "bus_number", "sense_address", "ic1_address", "ic2_address", "revision", "gpio", "models"],
+    defaults=(None,)
+)
+
+# control GPIO name -> BCM number of the single board layout
+DEFAULT_GPIO = MappingProxyType({
+    "execute": RPI_EXECUTE_PIN,
+    "dbg_led": DBG_LED,
+    "dut_det": DUT_DET,
+    "flash_sel": FLASH_SEL,
+    "i2c_en": I2C_EN,
+    "ftdi_rstn": FTDI_RSTn,
+    "usb_hub_rst": USB_HUB_RST,
+    "out2_rstn": OUT2_RSTn,
+    "out1_rstn": OUT1_RSTn,
+    "in_rstn": IN_RSTn,
+    "ap_rstn": AP_RSTn,
+    "ap_bootn": AP_BOOTn,
+    "voltage_sel": VOLTAGE_SEL,
+    "vbus_con": VBUS_CON,
+    "sense_int": SENSE_INT,
+})
+
+# control GPIOs set up as outputs, with the level they start at (None leaves the level alone)
+_OUTPUTS = (
+    ("dbg_led", GPIO.LOW),
+    ("flash_sel", GPIO.LOW),
+    ("i2c_en", GPIO.HIGH),
+    ("out2_rstn", GPIO.HIGH),
+    ("out1_rstn", GPIO.HIGH),
+    ("in_rstn", GPIO.HIGH),
+    ("ap_rstn", None),
+    ("ap_bootn", None),
+    ("voltage_sel", GPIO.LOW),
+    ("vbus_con", None),
+    ("ftdi_rstn", GPIO.HIGH),
+    ("usb_hub_rst", GPIO.LOW),
+)
+
+DEFAULT_BOARD = BoardDescriptor(
+    name="board0",
+    bus_number=1,
+    sense_address=SenseModule.IC,
+    ic1_address=SwitchModule.IC1,
+    ic2_address=SwitchModule.IC2,
+    revision=BOARD_REVISION,
+    gpio=DEFAULT_GPIO,
+)
 
 
 class RelayBoard:
 
-    def __init__(self, model, has_pek=False, has_rh=False, has_rc=True, in_phase=True, acc_minus=False):
-        RPi.GPIO.setmode(RPi.GPIO.BCM)
-        RPi.GPIO.setup(DBG_LED, RPi.GPIO.OUT)
-        RPi.GPIO.setup(DUT_DET, RPi.GPIO.IN)
-        RPi.GPIO.setup(FLASH_SEL, RPi.GPIO.OUT)
-        RPi.GPIO.setup(I2C_EN, RPi.GPIO.OUT)
-        RPi.GPIO.setup(OUT2_RSTn, RPi.GPIO.OUT)
-        RPi.GPIO.setup(OUT1_RSTn, RPi.GPIO.OUT)
-        RPi.GPIO.setup(IN_RSTn, RPi.GPIO.OUT)
-        RPi.GPIO.setup(AP_RSTn, RPi.GPIO.OUT)
-        RPi.GPIO.setup(AP_BOOTn, RPi.GPIO.OUT)
-        RPi.GPIO.setup(VOLTAGE_SEL, RPi.GPIO.OUT)
-        RPi.GPIO.setup(VBUS_CON, RPi.GPIO.OUT)
-        RPi.GPIO.setup(FTDI_RSTn, RPi.GPIO.OUT)
-        RPi.GPIO.setup(USB_HUB_RST, RPi.GPIO.OUT)
-
-        RPi.GPIO.output(VOLTAGE_SEL, RPi.GPIO.LOW)
-        RPi.GPIO.output(DBG_LED, RPi.GPIO.LOW)
-        RPi.GPIO.output(I2C_EN, RPi.GPIO.HIGH)
-        RPi.GPIO.output(OUT2_RSTn, RPi.GPIO.HIGH)
-        RPi.GPIO.output(OUT1_RSTn, RPi.GPIO.HIGH)
-        RPi.GPIO.output(IN_RSTn, RPi.GPIO.HIGH)
-        RPi.GPIO.output(FTDI_RSTn, RPi.GPIO.HIGH)
-        RPi.GPIO.output(USB_HUB_RST, RPi.GPIO.LOW)
-        RPi.GPIO.output(FLASH_SEL, RPi.GPIO.LOW)
-        self.sense_module = SenseModule()
-        self.switch_module = SwitchModule(model, has_pek, has_rh, has_rc, in_phase, acc_minus)
-        self.configurations = SwitchModuleConfigurations(model, has_pek, has_rh, has_rc, in_phase, acc_minus)
+    def __init__(self, model, has_pek=False, has_rh=False, has_rc=True, in_phase=True, acc_minus=False,
+                 board: BoardDescriptor = DEFAULT_BOARD):
+        """
+        :param board: bus, expander addresses and control GPIOs of the board to drive. Boards only touch their own
+            GPIOs, so several of them can share the Pi.
+        """
+        self.board = board
+        gpio = board.gpio
+        GPIO.setmode(GPIO.BCM)
+        if gpio.get("dut_det") is not None:
+            GPIO.setup(gpio["dut_det"], GPIO.IN)
+        for name, level in _OUTPUTS:
+            if gpio.get(name) is None:
+                continue
+            GPIO.setup(gpio[name], GPIO.OUT)
+            if level is not None:
+                GPIO.output(gpio[name], level)
+        self.sense_module = SenseModule(
+            int_pin=gpio.get("sense_int") if SENSE_INTERRUPTS else None,
+            address=board.sense_address,
+            bus_number=board.bus_number,
+        )
+        self.sampler = SenseSampler(self.sense_module, SENSE_SAMPLER_MIN_RATE, SENSE_SAMPLER_MAX_RATE)
+        if SENSE_SAMPLER:
+            self.sampler.start()
+        # relays with a sense mapping in the profile are confirmed by the sense module instead of waiting them out
+        self.settler = RelaySettler(RelayProfile.load(RELAY_PROFILE_PATH, board.revision), self.sense_module)
+        self.switch_module = SwitchModule(
+            model, has_pek, has_rh, has_rc, in_phase, acc_minus, self.settler,
+            ic1=board.ic1_address, ic2=board.ic2_address, bus_number=board.bus_number,
+            counters=RelayCounters.for_board(board.name),
+        )
+        # shared with the switch module, built once per flag combination
+        self.configurations = self.switch_module.SwitchModuleConfigurations
+        self.registry = ConfigRegistry.get(model, has_pek, has_rh, has_rc, in_phase, acc_minus)
+        # once per board per process, boards are rebuilt for every session
+        if RELAY_CALIBRATE and BusOwner.get(board.bus_number).claim_init(("relay_calibration", board.name)):
+            self.calibrate_relays(self.configurations.CONFIG_POWER)
         self.events = SenseModuleEvents()
-        RPi.GPIO.setup(RPI_EXECUTE_PIN, RPi.GPIO.OUT)
-        RPi.GPIO.output(RPI_EXECUTE_PIN, RPi.GPIO.HIGH)
+        if gpio.get("execute") is not None:
+            GPIO.setup(gpio["execute"], GPIO.OUT)
+            GPIO.output(gpio["execute"], GPIO.HIGH)
 
     def __enter__(self):
         """Context manager entry point"""
@@ -78,15 +156,24 @@ class RelayBoard:
         log.debug("Initiating RelayBoard cleanup")
 
         """Cleanup method"""
+        self.sampler.stop()
         try:
             self.switch_module.cleanup()
         finally:
-            RPi.GPIO.setmode(RPi.GPIO.BCM)
-            RPi.GPIO.setup(RPI_EXECUTE_PIN, RPi.GPIO.OUT)
-            RPi.GPIO.output(RPI_EXECUTE_PIN, RPi.GPIO.LOW)
-            RPi.GPIO.cleanup()
-            self.switch_module.terminate_bus()
+            # sense module first, its interrupt edge detection must be removed before RPi.GPIO is cleaned up
             self.sense_module.cleanup()
+            GPIO.setmode(GPIO.BCM)
+            execute = self.board.gpio.get("execute")
+            if execute is not None:
+                GPIO.setup(execute, GPIO.OUT)
+                GPIO.output(execute, GPIO.LOW)
+            # only this board's channels, other boards on the Pi keep theirs
+            GPIO.cleanup(self.gpio_channels())
+            self.switch_module.terminate_bus()
+
+    def gpio_channels(self):
+        """BCM numbers of every control GPIO wired on this board"""
+        return sorted({pin for pin in self.board.gpio.values() if pin is not None})
 
     def wait_for_event(self, event, timeout):
         """Block until a specific event occurs. If timeout is not
@@ -97,6 +184,32 @@ class RelayBoard:
 
 
     def configure(self, config):
-        """Clean up switch module pins and reconfigure with new
-        pin configuration"""
+        """Reconfigure switch module with new pin configuration,
+        switching only the relays that differ"""
         self.switch_module.configure(config)
+
+    def switch_session(self, model, has_pek=False, has_rh=False, has_rc=True, in_phase=True, acc_minus=False):
+        """Swap the model/flag dependent configurations for a new session.
+        GPIO, the buses and the sense sampler stay up and the relays are
+        left as they are, the next configure moves them by delta. Raises
+        ValueError for an invalid flag combination, leaving the board as
+        it was.
+        """
+        configurations = SwitchModuleConfigurations.get(model, has_pek, has_rh, has_rc, in_phase, acc_minus)
+        registry = ConfigRegistry.get(model, has_pek, has_rh, has_rc, in_phase, acc_minus)
+        self.switch_module.switch_model(model, has_pek, has_rh, configurations)
+        self.configurations = configurations
+        self.registry = registry
+
+    def calibrate_relays(self, config=None, repeats=5):
+        """Measure operate/release times of the relays with a sense
+        mapping and store them in the relay profile of this board revision.
+        Returns the relays that could not be measured and why.
+        """
+        if config is not None:
+            self.configure(config)
+        profile, failed = calibrate(self.switch_module, self.sense_module, self.settler.profile, repeats)
+        profile.save(RELAY_PROFILE_PATH)
+        if config is not None:
+            self.switch_module.cleanup()
+        return failed
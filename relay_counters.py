@@ -0,0 +1,124 @@
+"""Persistent per-relay actuation counters
+
+Every relay of a board has two uint64 counters, closes and opens, in a small file under RELAY_COUNTERS_DIR that is
+mapped into memory, one file per board. A relay's counters sit at its position in the switch module register image
+(bank * 8 + bit), so recording a write is one XOR per bank and one increment per relay that actually changed, no
+system call. The kernel writes the dirty page back to the file, so the counts survive restarts. Names are only
+attached when the counters are read, through SwitchModuleConfigurations.
+
+File layout, little endian: 8 byte magic, uint32 relay count, uint32 reserved, then the close counters of the 32
+relays followed by their open counters.
+"""
+import atexit
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, Sequence
+
+from service_logging import log
+from constants import RELAY_COUNTERS_DIR
+from switch_module_configurations import BANK_INDEX, SwitchModuleConfigurations
+
+MAGIC = b"HVACRLY1"
+HEADER = struct.Struct("<8sII")
+# relays in a register image, 4 banks of 8 bits
+RELAYS = 32
+FILE_SIZE = HEADER.size + 2 * RELAYS * 8
+
+# image position (bank * 8 + bit) -> relay name
+RELAY_NAMES = {
+    BANK_INDEX[bank] * 8 + SwitchModuleConfigurations.DATA[pin].bit_length() - 1: pin
+    for pin, bank in SwitchModuleConfigurations.BANK.items()
+}
+
+
+class RelayCounters:
+    """Actuation counters of one board's relays"""
+
+    _counters: Dict[str, "RelayCounters"] = {}
+    _counters_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        """
+        :param path: counter file, created if it does not exist. If it cannot be used the counters are kept in memory
+            only.
+        """
+        self.path = path
+        self._file = None
+        try:
+            self._map = self._open(path)
+        except OSError as e:
+            log.warning(f"Relay counters at {path} not persisted: {e}")
+            self._map = mmap.mmap(-1, FILE_SIZE)
+            HEADER.pack_into(self._map, 0, MAGIC, RELAYS, 0)
+        counts = memoryview(self._map)[HEADER.size:].cast("Q")
+        self._closes = counts[:RELAYS]
+        self._opens = counts[RELAYS:]
+
+    @classmethod
+    def for_board(cls, name: str) -> "RelayCounters":
+        """Returns the counters of board `name`, mapping its file on first use
+
+        :param name: board name from the board registry
+        :return: the process wide counters of that board
+        """
+        with cls._counters_lock:
+            counters = cls._counters.get(name)
+            if counters is None:
+                counters = cls(os.path.join(RELAY_COUNTERS_DIR, f"{name}.counters"))
+                cls._counters[name] = counters
+            return counters
+
+    @classmethod
+    def close_all(cls):
+        """Flushes every counter file. Registered to run at interpreter exit."""
+        with cls._counters_lock:
+            for counters in cls._counters.values():
+                counters.flush()
+
+    def _open(self, path: str) -> mmap.mmap:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                header = f.read(HEADER.size)
+            if os.path.getsize(path) != FILE_SIZE or header[:len(MAGIC)] != MAGIC:
+                log.warning(f"Relay counters at {path} are not a counter file, moved to {path}.invalid")
+                os.replace(path, path + ".invalid")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, RELAYS, 0) + bytes(FILE_SIZE - HEADER.size))
+        self._file = open(path, "r+b")
+        return mmap.mmap(self._file.fileno(), FILE_SIZE)
+
+    def record(self, before: Sequence[int], after: Sequence[int]):
+        """Counts the relays that changed between two register images
+
+        :param before: (IC1_GPIOA, IC1_GPIOB, IC2_GPIOA, IC2_GPIOB) before the write
+        :param after: the same after the write
+        """
+        for bank in range(4):
+            changed = before[bank] ^ after[bank]
+            while changed:
+                bit = changed & -changed
+                changed ^= bit
+                position = bank * 8 + bit.bit_length() - 1
+                if after[bank] & bit:
+                    self._closes[position] += 1
+                else:
+                    self._opens[position] += 1
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """Relay name -> {"closes", "opens"} of every relay of the switch module"""
+        return {
+            name: {"closes": self._closes[position], "opens": self._opens[position]}
+            for position, name in sorted(RELAY_NAMES.items(), key=lambda item: item[1])
+        }
+
+    def flush(self):
+        """Writes the counters back to their file now instead of whenever the kernel does"""
+        if self._file is not None:
+            self._map.flush()
+
+
+atexit.register(RelayCounters.close_all)
@@ -0,0 +1,111 @@
+"""Run-length encoded relay state history
+
+Only transitions are stored, as (monotonic ns timestamp, uint16 state) pairs in two array-backed rings. A state that
+is held for hours costs one entry, so a long soak test that mostly sits in one state stays in the kilobytes. The
+ring is bounded both by entry count and by age; entries older than `max_age` are dropped, except the newest expired
+entry, which is kept because it still defines the state at the start of the retained window.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+
+
+class RelayStateHistory:
+
+    def __init__(self, max_entries: int = 4096, max_age: float = 12 * 3600):
+        """
+        :param max_entries: maximum number of transitions kept
+        :param max_age: maximum age of a transition in seconds
+        """
+        self.max_entries = max_entries
+        self.max_age_ns = int(max_age * 1e9)
+        self._timestamps = array("q", [0] * max_entries)
+        self._states = array("H", [0] * max_entries)
+        self._start = 0  # index of the oldest entry
+        self._count = 0
+        self._lock = threading.Lock()
+        # converts monotonic timestamps to wall clock for API consumers
+        self.wall_offset_ns = time.time_ns() - time.monotonic_ns()
+
+    def __len__(self):
+        with self._lock:
+            self._expire(time.monotonic_ns())
+            return self._count
+
+    def _index(self, i: int) -> int:
+        return (self._start + i) % self.max_entries
+
+    def record(self, timestamp_ns: int, state: int) -> bool:
+        """Records a sample, storing it only if the state differs from the last stored state
+
+        :param timestamp_ns: time.monotonic_ns() of the sample
+        :param state: 16 bit sensed state
+        :return: True if a transition was stored, False otherwise
+        """
+        with self._lock:
+            if self._count and self._states[self._index(self._count - 1)] == state:
+                return False
+            if self._count == self.max_entries:
+                self._start = self._index(1)
+                self._count -= 1
+            i = self._index(self._count)
+            self._timestamps[i] = timestamp_ns
+            self._states[i] = state
+            self._count += 1
+            self._expire(timestamp_ns)
+            return True
+
+    def _expire(self, now_ns: int):
+        """Drops entries older than max_age, keeping the newest expired entry as the start of the window"""
+        cutoff = now_ns - self.max_age_ns
+        while self._count > 1 and self._timestamps[self._index(1)] <= cutoff:
+            self._start = self._index(1)
+            self._count -= 1
+
+    def _snapshot(self) -> Tuple[List[int], List[int]]:
+        with self._lock:
+            # an idle board records nothing, so entries also age out when they are read
+            self._expire(time.monotonic_ns())
+            indices = [self._index(i) for i in range(self._count)]
+            return [self._timestamps[i] for i in indices], [self._states[i] for i in indices]
+
+    def state_at(self, timestamp_ns: int) -> Optional[int]:
+        """State that was sensed at `timestamp_ns`
+
+        :param timestamp_ns: monotonic timestamp in ns
+        :return: the 16 bit state, or None if the history does not reach back that far
+        """
+        timestamps, states = self._snapshot()
+        i = bisect_right(timestamps, timestamp_ns)
+        if i == 0:
+            return None
+        return states[i - 1]
+
+    def transitions(self, start_ns: int, end_ns: int) -> List[Tuple[int, int]]:
+        """Transitions recorded in the window [start_ns, end_ns]
+
+        :param start_ns: monotonic timestamp in ns
+        :param end_ns: monotonic timestamp in ns
+        :return: list of (timestamp_ns, state) pairs
+        """
+        timestamps, states = self._snapshot()
+        first = bisect_right(timestamps, start_ns - 1)
+        last = bisect_right(timestamps, end_ns)
+        return list(zip(timestamps[first:last], states[first:last]))
+
+    def to_monotonic_ns(self, wall_time: float) -> int:
+        """Converts a wall clock time (seconds since epoch) to the monotonic clock used for the entries"""
+        return int(wall_time * 1e9) - self.wall_offset_ns
+
+    def to_wall_time(self, timestamp_ns: int) -> float:
+        """Converts a monotonic timestamp to wall clock seconds since epoch"""
+        return (timestamp_ns + self.wall_offset_ns) / 1e9
+
+    def memory_bytes(self) -> int:
+        """Bytes held by the ring buffers"""
+        return (
+            self._timestamps.buffer_info()[1] * self._timestamps.itemsize
+            + self._states.buffer_info()[1] * self._states.itemsize
+        )
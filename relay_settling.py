@@ -0,0 +1,191 @@
+"""Relay settling for the switch module
+
+After a write to the expanders the relays take a few milliseconds to operate (close) or release (open). Instead of a
+fixed worst case sleep, the settler waits for the slowest relay that actually changed, using per relay operate and
+release times from a RelayProfile. Where the profile maps a relay to a sense module terminal, the settler returns as
+soon as the sense module sees the terminal follow the relay.
+
+Profiles are stored per board revision in a JSON file:
+
+    {"v2": {"operate": {"S6_G_NO_PEK": 0.008}, "release": {"S6_G_NO_PEK": 0.004}, "sense": {"S6_G_NO_PEK": "IN_G"}}}
+
+Relays missing from the file use DEFAULT_OPERATE_TIME / DEFAULT_RELEASE_TIME. The sense map is per board revision and
+wiring, a sensed terminal only follows a relay if the thermostat side drives it, so it is opt-in. `calibrate` measures
+the mapped relays and writes the results back to the profile.
+"""
+import json
+import os
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from service_logging import log
+from sense_module_events import SenseModuleEvents
+from switch_module_configurations import pins_to_image
+
+# datasheet maximums of the signal relays on the switch module, in seconds
+DEFAULT_OPERATE_TIME = 0.015
+DEFAULT_RELEASE_TIME = 0.010
+
+
+class RelayProfile:
+
+    def __init__(self, revision: str, operate: Optional[Dict[str, float]] = None,
+                 release: Optional[Dict[str, float]] = None, sense: Optional[Dict[str, str]] = None):
+        """
+        :param revision: board revision the times were measured on
+        :param operate: seconds for each relay to close after its pin is set
+        :param release: seconds for each relay to open after its pin is cleared
+        :param sense: relay pin to SenseModuleEvents IN_* terminal name that follows it
+        """
+        self.revision = revision
+        self.operate = dict(operate or {})
+        self.release = dict(release or {})
+        self.sense = dict(sense or {})
+
+    def operate_time(self, pin: str) -> float:
+        return self.operate.get(pin, DEFAULT_OPERATE_TIME)
+
+    def release_time(self, pin: str) -> float:
+        return self.release.get(pin, DEFAULT_RELEASE_TIME)
+
+    def sense_mask(self, pin: str) -> int:
+        """Sense module bit that follows `pin`, 0 if the relay cannot be confirmed through the sense module"""
+        terminal = self.sense.get(pin)
+        return getattr(SenseModuleEvents, terminal) if terminal else 0
+
+    @classmethod
+    def load(cls, path: str, revision: str) -> "RelayProfile":
+        """Loads the profile of `revision` from `path`. Falls back to the default times if there is none."""
+        try:
+            with open(path) as f:
+                profiles = json.load(f)
+        except FileNotFoundError:
+            log.info(f"No relay profile at {path}, using default settling times")
+            return cls(revision)
+        profile = profiles.get(revision, {})
+        return cls(revision, profile.get("operate"), profile.get("release"), profile.get("sense"))
+
+    def save(self, path: str):
+        """Stores the profile under its revision in `path`, keeping the profiles of other revisions"""
+        profiles = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                profiles = json.load(f)
+        profiles[self.revision] = {"operate": self.operate, "release": self.release, "sense": self.sense}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(profiles, f, indent=4, sort_keys=True)
+
+
+class RelaySettler:
+    # seconds between sense module reads while confirming
+    POLL_INTERVAL = 0.001
+    # a sense confirmation gives up after this multiple of the profile time
+    CONFIRM_MARGIN = 3
+
+    def __init__(self, profile: RelayProfile, sense_module=None):
+        """
+        :param profile: operate/release times and sense map of the board
+        :param sense_module: SenseModule used to confirm mapped relays, None to rely on the profile times only
+        """
+        self.profile = profile
+        self.sense_module = sense_module
+
+    def settle(self, closed: Iterable[str], opened: Iterable[str]) -> float:
+        """Blocks until the relays that just changed have settled
+
+        :param closed: pins that were just set
+        :param opened: pins that were just cleared
+        :return: seconds waited
+        """
+        start = time.monotonic()
+        # relays that can be confirmed through the sense module and the ones that only have a time
+        timed, mask, expected, confirm_time = 0.0, 0, 0, 0.0
+        for pin, settle_time, on in (
+            [(pin, self.profile.operate_time(pin), True) for pin in closed]
+            + [(pin, self.profile.release_time(pin), False) for pin in opened]
+        ):
+            bit = self.profile.sense_mask(pin) if self.sense_module is not None else 0
+            if bit:
+                mask |= bit
+                expected |= bit if on else 0
+                confirm_time = max(confirm_time, settle_time)
+            else:
+                timed = max(timed, settle_time)
+
+        if mask and not self._confirm(mask, expected, start + confirm_time * self.CONFIRM_MARGIN):
+            log.warning(f"Relays not confirmed by the sense module within {confirm_time * self.CONFIRM_MARGIN:.3f} s")
+        remaining = start + timed - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return time.monotonic() - start
+
+    def _confirm(self, mask: int, expected: int, deadline: float) -> bool:
+        """Waits until the sensed bits in `mask` equal `expected` or `deadline` (monotonic) passes"""
+        while True:
+            if self._sensed_state() & mask == expected:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.POLL_INTERVAL)
+
+    def _sensed_state(self) -> int:
+        # the sampler already keeps the latest sample fresh, otherwise read the bus
+        if not self.sense_module.sampling:
+            self.sense_module.sample()
+        return self.sense_module.last_sample.state
+
+
+def _measure(switch_module, sense_module, pin: str, on: bool, bit: int, timeout: float) -> Optional[float]:
+    """Switches `pin` and times how long the sense module takes to follow, None if it never does"""
+    image = pins_to_image((pin,))
+    current = switch_module.shadow.image
+    target = tuple(c | b for c, b in zip(current, image)) if on else tuple(c & ~b for c, b in zip(current, image))
+    start = time.monotonic()
+    # bypasses the settler, it is what is being calibrated, the actuations are still counted
+    switch_module.write_image(target)
+    while time.monotonic() - start < timeout:
+        if bool(sense_module.transport.read_word(sense_module.IC, sense_module.GPIOA) & bit) == on:
+            return time.monotonic() - start
+        time.sleep(RelaySettler.POLL_INTERVAL)
+    return None
+
+
+def calibrate(switch_module, sense_module, profile: RelayProfile, repeats: int = 5, margin: float = 1.5,
+              timeout: float = 0.5) -> Tuple[RelayProfile, Dict[str, str]]:
+    """Measures operate and release times of every relay that has a sense mapping in `profile`
+
+    The switch module has to be in a configuration where the thermostat drives the mapped terminals. The register
+    image is restored afterwards.
+
+    :param switch_module: SwitchModule driving the relays
+    :param sense_module: SenseModule reading the terminals
+    :param profile: profile providing the sense map, updated in place with the measured times
+    :param repeats: number of close/open cycles per relay, the slowest one is kept
+    :param margin: factor applied to the slowest measured time
+    :param timeout: seconds to wait for the sense module to follow before a relay is reported as failed
+    :return: (updated profile, pin -> reason for relays that could not be measured)
+    """
+    original = switch_module.shadow.image
+    failed = {}
+    try:
+        for pin, terminal in profile.sense.items():
+            bit = profile.sense_mask(pin)
+            operate, release = [], []
+            for _ in range(repeats):
+                closed = _measure(switch_module, sense_module, pin, True, bit, timeout)
+                opened = _measure(switch_module, sense_module, pin, False, bit, timeout)
+                if closed is None or opened is None:
+                    failed[pin] = f"{terminal} did not follow within {timeout} s"
+                    break
+                operate.append(closed)
+                release.append(opened)
+            else:
+                profile.operate[pin] = round(max(operate) * margin, 4)
+                profile.release[pin] = round(max(release) * margin, 4)
+                log.info(f"Calibrated {pin}: operate {profile.operate[pin]} s, release {profile.release[pin]} s")
+    finally:
+        switch_module.write_image(original)
+    for pin, reason in failed.items():
+        log.warning(f"Could not calibrate {pin}: {reason}")
+    return profile, failed
@@ -0,0 +1,61 @@
+"""Table driven decoding of sensed relay states
+
+A sensed state is the raw uint16 read from the sense expander. Only 8 of its bits are wired to terminals, so every
+state is reduced to an 8 bit terminal index through a 65536 byte table built at import, and the index selects one of
+256 precomputed decodings. Decoding a sample is then two lookups instead of formatting a binary string and slicing it.
+"""
+from types import MappingProxyType
+from typing import Dict
+
+from sense_module_events import SenseModuleEvents
+
+# enabled terminals in reporting order, with their sensed bit
+TERMINALS = (
+    ("ACC", SenseModuleEvents.IN_ACC),
+    ("OB", SenseModuleEvents.IN_OB),
+    ("W2/G3", SenseModuleEvents.IN_W2),
+    ("Y2/G2", SenseModuleEvents.IN_Y2),
+    ("W1", SenseModuleEvents.IN_W1),
+    ("Y1", SenseModuleEvents.IN_Y1),
+    ("G", SenseModuleEvents.IN_G),
+    ("PEK_ALT", SenseModuleEvents.IN_PEK_ALT),
+)
+
+
+def _byte_index(shift: int):
+    """Terminal index contributed by each value of the state byte at `shift`"""
+    return [
+        sum(1 << i for i, (_, bit) in enumerate(TERMINALS) if (value << shift) & bit)
+        for value in range(256)
+    ]
+
+
+_HIGH, _LOW = _byte_index(8), _byte_index(0)
+# state -> terminal index, bit i of the index is TERMINALS[i]
+INDEX = bytes(_HIGH[state >> 8] | _LOW[state & 0xFF] for state in range(65536))
+
+# terminal index -> {terminal: bool}, read only
+DECODE_TABLE = tuple(
+    MappingProxyType({name: bool(index & (1 << i)) for i, (name, _) in enumerate(TERMINALS)})
+    for index in range(256)
+)
+
+# terminal index -> "ACC=0 OB=1 ..." for logs
+LOG_TABLE = tuple(
+    " ".join(f"{name}={int(bool(index & (1 << i)))}" for i, (name, _) in enumerate(TERMINALS))
+    for index in range(256)
+)
+
+
+def decode(state: int) -> Dict[str, bool]:
+    """Decodes a sensed state into the enabled terminals
+
+    :param state: relay state represented in binary, each bit representing a relay
+    :return: dictionary of terminal name to state, a copy the caller may modify
+    """
+    return dict(DECODE_TABLE[INDEX[state]])
+
+
+def format_terminals(state: int) -> str:
+    """Enabled terminals of a sensed state formatted for logs, e.g. "ACC=0 OB=1 W2/G3=0 ..." """
+    return LOG_TABLE[INDEX[state]]
@@ -0,0 +1,103 @@
+"""Relay state push to asyncio subscribers
+
+The broadcaster listens to the sense module and fans every state change out to any number of subscribers from the
+single hardware read done by the sampler (or the interrupt callback). Subscribers never queue up: each one holds only
+the latest sample, so a slow consumer skips intermediate states and always receives the newest one.
+"""
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional, Set, Tuple
+
+from sense_sampler import Sample
+
+
+class Subscription:
+    """Latest-value slot for one consumer, bound to the event loop it was created on"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, initial: Optional[Sample] = None):
+        self.loop = loop
+        self._latest = initial
+        self._ready = asyncio.Event()
+        self.coalesced = 0
+        if initial is not None:
+            self._ready.set()
+
+    def offer(self, sample: Sample):
+        """Replaces the pending sample. Must run on the subscription's loop."""
+        if self._ready.is_set():
+            self.coalesced += 1
+        self._latest = sample
+        self._ready.set()
+
+    async def next(self) -> Sample:
+        """Waits for and returns the newest sample not yet delivered"""
+        await self._ready.wait()
+        self._ready.clear()
+        return self._latest
+
+
+class RelayStateBroadcaster:
+
+    def __init__(self):
+        self._subscriptions: Set[Subscription] = set()
+        self._lock = threading.Lock()
+        self.sense_module = None
+
+    def attach(self, sense_module):
+        """Starts listening to `sense_module`, detaching from the previous one"""
+        if self.sense_module is not None:
+            self.sense_module.remove_listener(self.publish)
+        self.sense_module = sense_module
+        sense_module.add_listener(self.publish)
+
+    def publish(self, sample: Sample):
+        """Hands a new sample to every subscriber. Safe to call from any thread."""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, sample)
+            except RuntimeError:
+                # loop already closed, the subscription is removed when its consumer exits
+                pass
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    @contextmanager
+    def subscribe(self) -> Iterator[Subscription]:
+        """Registers a subscriber on the running event loop. The current state is delivered first."""
+        initial = self.sense_module.last_sample if self.sense_module is not None else None
+        subscription = Subscription(asyncio.get_running_loop(), initial)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                self._subscriptions.discard(subscription)
+
+    async def wait_for_state(self, expected: int, timeout: float) -> Tuple[bool, Sample]:
+        """Parks the caller until the sensed state equals `expected` or `timeout` seconds have passed. Only wakes on
+        state changes, no thread is held while waiting.
+
+        :param expected: relay state represented in binary, each bit representing a relay
+        :param timeout: max number of seconds to wait
+        :return: (True if the state matched, last sample seen)
+        """
+        deadline = time.monotonic() + timeout
+        with self.subscribe() as subscription:
+            sample = self.sense_module.last_sample
+            while True:
+                if sample.state == expected:
+                    return True, sample
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False, sample
+                try:
+                    sample = await asyncio.wait_for(subscription.next(), remaining)
+                except asyncio.TimeoutError:
+                    return False, self.sense_module.last_sample
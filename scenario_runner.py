@@ -0,0 +1,180 @@
+"""In-process scenario runner
+
+Runs JSON scenario files directly against a RelayBoard on the Pi, without HTTP in the loop, and writes a machine
+readable timing report. A scenario file holds one scenario or a list of them:
+
+    {
+        "name": "furnace 1 stage",
+        "session": {"model": "ares", "has_rc": true, "has_rh": false, "has_pek": false, "in_phase": true,
+                    "acc_minus": false},
+        "stop_on_failure": true,
+        "steps": [
+            {"config": "CONFIG_FN_1_STAGE", "event": "EVENT_FNHEAT_STAGE_1", "timeout": 60, "dwell": 10},
+            {"config": "CONFIG_POWER", "event": "EVENT_NONE", "timeout": 30}
+        ]
+    }
+
+Steps are the same as for POST /api/sequence/, see step_sequence.py. One relay board is kept for the whole run and
+switched between scenarios like a session start, so compiled configurations and registries are reused. The sense
+sampler keeps running underneath, so samples are already being taken while a configure settles, and the next scenario
+is loaded and validated in the background while the current one runs.
+
+With several boards in the board registry (see board_registry.py), `--board` picks the boards to run on. Scenarios
+are dealt to them round robin and every board works through its share on its own thread, so fixtures run side by side.
+
+Usage: python scenario_runner.py scenarios/*.json --report report.json [--board rack1 --board rack2]
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from service_logging import log
+from board_registry import BoardRegistry
+from config_registry import ConfigRegistry
+from relay_board import DEFAULT_BOARD, BoardDescriptor, RelayBoard
+from step_sequence import run_sequence, validate_steps
+
+DEFAULT_SESSION = {"model": "ares", "has_pek": False, "has_rh": False, "has_rc": True, "in_phase": True,
+                   "acc_minus": False}
+
+
+def load_scenarios(path: str) -> List[Dict]:
+    """Loads the scenarios of a file
+
+    :return: list of scenarios, each tagged with the file it came from
+    """
+    with open(path) as f:
+        data = json.load(f)
+    scenarios = data if isinstance(data, list) else [data]
+    for i, scenario in enumerate(scenarios):
+        scenario.setdefault("name", f"{path}[{i}]")
+        scenario["file"] = path
+    return scenarios
+
+
+def prepare_scenario(scenario: Dict) -> Dict:
+    """Validates a scenario against the registry of its flags, compiling its configurations if they are new
+
+    :return: prepared scenario with normalized steps, or with an error if it cannot run
+    """
+    start = time.monotonic()
+    session = dict(DEFAULT_SESSION, **scenario.get("session", {}))
+    prepared = {"name": scenario["name"], "file": scenario["file"], "session": session,
+                "stop_on_failure": scenario.get("stop_on_failure", True), "steps": None, "error": None}
+    try:
+        registry = ConfigRegistry.get(**session)
+        prepared["steps"] = validate_steps(scenario.get("steps", []), registry)
+    except (ValueError, TypeError) as e:
+        prepared["error"] = str(e)
+    prepared["prepare_s"] = time.monotonic() - start
+    return prepared
+
+
+def run_scenario(relay_board: RelayBoard, prepared: Dict) -> Dict:
+    """Switches the relay board to the scenario's session and runs its steps
+
+    :return: report entry of the scenario
+    """
+    report = {"name": prepared["name"], "file": prepared["file"], "prepare_s": prepared["prepare_s"]}
+    if prepared["error"] is not None:
+        log.warning(f"Skipping scenario {prepared['name']}: {prepared['error']}")
+        report.update({"passed": False, "error": prepared["error"], "elapsed_s": 0.0, "results": []})
+        return report
+
+    log.info(f"Running scenario {prepared['name']}")
+    start = time.monotonic()
+    relay_board.switch_session(**prepared["session"])
+    relay_board.configure(relay_board.configurations.CONFIG_POWER)
+    report["session_s"] = time.monotonic() - start
+    summary = run_sequence(relay_board, prepared["steps"], prepared["stop_on_failure"])
+    report.update(summary)
+    report["error"] = None
+    report["elapsed_s"] = time.monotonic() - start
+    log.info(f"Scenario {prepared['name']} {'passed' if report['passed'] else 'failed'} in "
+             f"{report['elapsed_s']:.2f} s")
+    return report
+
+
+def run_board(board: BoardDescriptor, scenarios: List[Dict]) -> Dict:
+    """Runs `scenarios` in order on one relay board
+
+    :return: {"scenarios": report entries, "sampler": sampler stats of the board}
+    """
+    reports = []
+    relay_board = RelayBoard(**DEFAULT_SESSION, board=board)
+    if not relay_board.sampler.running:
+        relay_board.sampler.start()
+    try:
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"scenario-prepare-{board.name}") as preparer:
+            upcoming = preparer.submit(prepare_scenario, scenarios[0]) if scenarios else None
+            for i in range(len(scenarios)):
+                prepared = upcoming.result()
+                # validate the next scenario while this one drives the relays
+                if i + 1 < len(scenarios):
+                    upcoming = preparer.submit(prepare_scenario, scenarios[i + 1])
+                report = run_scenario(relay_board, prepared)
+                report["board"] = board.name
+                reports.append(report)
+    finally:
+        relay_board.cleanup()
+    return {"scenarios": reports, "sampler": relay_board.sampler.stats()}
+
+
+def run_scenarios(paths: List[str], boards: Optional[List[BoardDescriptor]] = None) -> Dict:
+    """Runs every scenario of `paths`, dealt round robin to `boards` which run side by side
+
+    :param boards: boards to run on, the default board if None
+    :return: timing report of the whole run
+    """
+    started = time.time()
+    start = time.monotonic()
+    boards = boards or [DEFAULT_BOARD]
+    scenarios = [scenario for path in paths for scenario in load_scenarios(path)]
+    shares = [scenarios[i::len(boards)] for i in range(len(boards))]
+    if len(boards) == 1:
+        runs = [run_board(boards[0], shares[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=len(boards), thread_name_prefix="scenario-board") as runner:
+            runs = list(runner.map(run_board, boards, shares))
+    # back in file order, scenario i ran on board i % len(boards)
+    reports = [runs[i % len(boards)]["scenarios"][i // len(boards)] for i in range(len(scenarios))]
+
+    return {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+        "elapsed_s": time.monotonic() - start,
+        "passed": all(report["passed"] for report in reports),
+        "scenarios_passed": sum(report["passed"] for report in reports),
+        "scenarios_total": len(reports),
+        "sampler": {board.name: run["sampler"] for board, run in zip(boards, runs)},
+        "scenarios": reports,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run HVAC simulator scenario files on this relay board")
+    parser.add_argument("scenarios", nargs="+", help="scenario JSON files")
+    parser.add_argument("--report", help="write the timing report here instead of stdout")
+    parser.add_argument("--board", action="append", dest="boards",
+                        help="board of the board registry to run on, repeat to run on several boards side by side")
+    args = parser.parse_args(argv)
+
+    registry = BoardRegistry.load()
+    unknown = [name for name in args.boards or [] if name not in registry]
+    if unknown:
+        parser.error(f"unknown boards {unknown}, known boards are {list(registry.boards)}")
+    boards = [registry[name] for name in args.boards] if args.boards else [registry.default()]
+    report = run_scenarios(args.scenarios, boards)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
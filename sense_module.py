@@ -1,9 +1,19 @@
 import json
+import logging
+import threading
 import time
+from typing import Dict, Optional
 
-from service_logging import log
+from hardware_backend import GPIO
 
-import smbus2 as smbus
+from service_logging import log
+from register_transport import BusOwner
+from service_metrics import WAIT_MATCH, WAIT_TIMEOUTS
+from sense_sampler import Sample
+from sense_module_events import describe_state
+import relay_state
+from relay_history import RelayStateHistory
+from constants import RELAY_HISTORY_MAX_AGE, RELAY_HISTORY_MAX_ENTRIES
 
 
 class SenseModule:
@@ -46,6 +56,21 @@ class SenseModule:
     OLATA = 0x14
     OLATB = 0x15
 
+    # Interrupt on change enable
+    GPINTENA = 0x04
+    GPINTENB = 0x05
+
+    # Interrupt control (0 = compare against previous pin value, i.e. interrupt on any change)
+    INTCONA = 0x08
+    INTCONB = 0x09
+
+    # Configuration register, same register is mapped at 0x0A and 0x0B
+    IOCON = 0x0A
+    IOCON_MIRROR = 0b01000000  # INTA and INTB are OR'd so a change on either port asserts both lines
+
+    # Max seconds an interrupt driven wait sleeps before re-reading the bus, guards against a missed edge
+    INTERRUPT_RESYNC_INTERVAL = 10
+
     # Terminals actually connected
     ENABLED_TERMINALS = 0b1111111100001000
 
@@ -79,16 +104,37 @@ class SenseModule:
     _current_event = 0b0000000000000000
     _expected_event = 0b0000000000000000
 
-    def __init__(self):
-        log.info("Initializing sense module")
-        self.bus = smbus.SMBus(1)
-        # set ports A and B as input
-        self.bus.write_byte_data(self.IC, self.IODIRA, 0b11111111)
-        self.bus.write_byte_data(self.IC, self.IODIRB, 0b11111111)
+    def __init__(self, int_pin: Optional[int] = None, address: int = IC, bus_number: int = 1):
+        """
+        :param int_pin: BCM number of the Raspberry Pi GPIO wired to the expander's INTA/INTB line. When None the
+            module falls back to polling the bus.
+        :param address: i2c address of the sense expander, boards sharing a bus are strapped to different addresses
+        :param bus_number: i2c bus the expander is on
+        """
+        log.info(f"Initializing sense module at {address:#04x} on bus {bus_number}")
+        self.IC = address
+        self.bus_number = bus_number
+        self.int_pin = int_pin
+        self._state_changed = threading.Condition()
+        # set by SenseSampler while a background thread keeps the current event fresh
+        self.sampling = False
+        self.last_sample = Sample(0, self._current_event)
+        # transitions only, see RelayStateHistory
+        self.history = RelayStateHistory(RELAY_HISTORY_MAX_ENTRIES, RELAY_HISTORY_MAX_AGE)
+        # callables receiving the new Sample on every state change
+        self._listeners = []
+        bus_owner = BusOwner.get(bus_number)
+        self.transport = bus_owner.view()
+        # the bus stays open across sessions, so the expander only needs setting up once per process
+        if bus_owner.claim_init(self.IC):
+            # set ports A and B as input
+            self.transport.write_port_pair(self.IC, self.IODIRA, 0b11111111, 0b11111111)
+
+            # Reverse the polarity of input pins so that 1 = ON. By default 0 = ON
+            self.transport.write_port_pair(self.IC, self.IPOLA, 0b00000000, 0b00000000)
 
-        # Reverse the polarity of input pins so that 1 = ON. By default 0 = ON
-        self.bus.write_byte_data(self.IC, self.IPOLA, 0b00000000)
-        self.bus.write_byte_data(self.IC, self.IPOLB, 0b00000000)
+        if self.int_pin is not None:
+            self._enable_interrupts(bus_owner)
 
     def __enter__(self):
         """Context manager entry point"""
@@ -108,13 +154,80 @@ class SenseModule:
 
     def cleanup(self):
         """Cleanup method"""
-        self.bus.close()
+        if self.int_pin is not None:
+            GPIO.remove_event_detect(self.int_pin)
+        self.transport.close()
+
+    def _enable_interrupts(self, bus_owner):
+        """Configures interrupt on change for every enabled terminal and routes the INT line to `int_pin`"""
+        log.info(f"Sense module interrupts enabled on GPIO {self.int_pin}")
+        # once per process, unless the expander was reset in between (interrupt registers back to power-on defaults)
+        if bus_owner.claim_init((self.IC, "interrupts")) or not self._interrupts_configured():
+            self.transport.write_register(self.IC, self.IOCON, self.IOCON_MIRROR)
+            self.transport.write_port_pair(self.IC, self.INTCONA, 0b00000000, 0b00000000)
+            self.transport.write_port_pair(
+                self.IC, self.GPINTENA, self.ENABLED_TERMINALS & 0xFF, self.ENABLED_TERMINALS >> 8
+            )
+        # INT is active low
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(self.int_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.add_event_detect(self.int_pin, GPIO.FALLING, callback=self._on_interrupt)
+        # reading GPIO clears any interrupt left pending, otherwise INT would stay low and no edge would ever come
+        self._update_current_event()
+
+    def _interrupts_configured(self) -> bool:
+        """Checks that the expander still has the interrupt configuration _enable_interrupts writes
+
+        :return: True if IOCON, INTCONA/B and GPINTENA/B hold the configured values
+        """
+        return (
+            self.transport.read_register(self.IC, self.IOCON) == self.IOCON_MIRROR
+            and self.transport.read_port_pair(self.IC, self.INTCONA) == (0b00000000, 0b00000000)
+            and self.transport.read_port_pair(self.IC, self.GPINTENA)
+            == (self.ENABLED_TERMINALS & 0xFF, self.ENABLED_TERMINALS >> 8)
+        )
+
+    def _on_interrupt(self, channel):
+        """RPi.GPIO edge callback. Reading GPIO clears the interrupt on the expander."""
+        try:
+            self._update_current_event()
+        except OSError as e:
+            log.warning(f"Sense module interrupt read failed: {e}")
+
+    def _update_current_event(self) -> bool:
+        """Private function to read bus data, then update the current event. Both ports are read in one transaction.
+        Waiters are woken if the state changed.
 
-    def _update_current_event(self):
-        """Private function to read bus data, then update the current event."""
-        current_event_a = self.bus.read_byte_data(self.IC, self.GPIOA)
-        current_event_b = self.bus.read_byte_data(self.IC, self.GPIOB)
-        self._current_event = current_event_a | current_event_b << 8
+        :return: True if the state changed, False otherwise
+        """
+        current_event = self.transport.read_word(self.IC, self.GPIOA)
+        with self._state_changed:
+            sample = Sample(time.monotonic_ns(), current_event)
+            self.last_sample = sample
+            self.history.record(sample.timestamp_ns, current_event)
+            if current_event == self._current_event:
+                return False
+            self._current_event = current_event
+            self._state_changed.notify_all()
+        for listener in self._listeners:
+            listener(sample)
+        return True
+
+    def add_listener(self, listener):
+        """Registers a callable that receives the new Sample on every state change. Listeners run on the thread that
+        read the bus and must not block."""
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        """Unregisters a listener added with add_listener"""
+        self._listeners = [registered for registered in self._listeners if registered != listener]
+
+    def sample(self) -> bool:
+        """Reads the sense expander once and publishes the result as the latest sample
+
+        :return: True if the state changed since the previous sample, False otherwise
+        """
+        return self._update_current_event()
 
     def log_relay_states(self, timeout: int, delta: float):
         """Logs the current and expected relay state into the arb_server_logs
@@ -122,21 +235,67 @@ class SenseModule:
         :param timeout: max number of seconds to wait for current event
         :param delta: elapsed time that has passed
         """
-        ce = "{0:016b}".format(self._current_event)
-        ee = "{0:016b}".format(self._expected_event)
-        log.info(
-            f"Current state: ACC={ce[1]} OB={ce[2]} W2/G3={ce[3]} Y2/G2={ce[4]} W1={ce[5]} "
-            f"Y1={ce[6]} G={ce[7]} PEK_ALT={ce[12]} "
-        )
-        log.info(
-            f"Wait for state: ACC={ee[1]} OB={ee[2]} W2/G3={ee[3]} Y2/G2={ee[4]} W1={ee[5]} "
-            f"Y1={ee[6]} G={ee[7]} PEK_ALT={ee[12]}"
-        )
+        log.info(f"Current state: {relay_state.format_terminals(self._current_event)} ")
+        log.info(f"Wait for state: {relay_state.format_terminals(self._expected_event)}")
         log.info(f"Expected (Max) time: {timeout} Elapsed time: {round(delta)}\n")
 
     def _wait_for_condition(self, timeout: int) -> bool:
         """Private function to block until expected event occurs or timeout condition is reached
 
+        :param timeout: max number of seconds to wait for current event
+        :return: True if event occured, False otherwise
+        """
+        if self.int_pin is not None or self.sampling:
+            return self._wait_for_notification(timeout)
+        return self._poll_for_condition(timeout)
+
+    def _wait_for_notification(self, timeout: int) -> bool:
+        """Private function to block until expected event occurs or timeout condition is reached. Sleeps until the
+        interrupt callback or the sampler reports a change. Without a sampler the bus is re-read every
+        INTERRUPT_RESYNC_INTERVAL seconds to guard against a missed interrupt.
+
+        :param timeout: max number of seconds to wait for current event
+        :return: True if event occured, False otherwise
+        """
+        start = time.time()
+        last_print_time = 0
+        # one read up front so a simple check (timeout = 0) sees the current state, the sampler already keeps it fresh
+        if not self.sampling:
+            self._update_current_event()
+        last_event = self._current_event
+        while True:
+            delta = time.time() - start
+            with self._state_changed:
+                current_event = self._current_event
+                if current_event == last_event and current_event != self._expected_event and delta < timeout:
+                    woken = self._state_changed.wait(min(timeout - delta, self.INTERRUPT_RESYNC_INTERVAL))
+                    current_event = self._current_event
+                else:
+                    woken = True
+            if not woken and not self.sampling:
+                self._update_current_event()
+                current_event = self._current_event
+            delta = time.time() - start
+
+            if last_event != current_event:
+                log.info("RELAY STATE CHANGE")
+                last_print_time = delta
+                last_event = current_event
+                self.log_relay_states(timeout, delta)
+            elif (delta - last_print_time) > 10:
+                last_print_time = delta
+                self.log_relay_states(timeout, delta)
+            if current_event == self._expected_event:
+                log.info("event matched in {:.2f} s".format(delta))
+                return True
+            if delta >= timeout:
+                break
+        return False
+
+    def _poll_for_condition(self, timeout: int) -> bool:
+        """Private function to block until expected event occurs or timeout condition is reached. Polls the bus every
+        2 seconds, used when no interrupt line is available.
+
         :param timeout: max number of seconds to wait for current event
         :return: True if event occured, False otherwise
         """
@@ -173,23 +332,57 @@ class SenseModule:
         :return: True if event occured, False otherwise
         """
         self._expected_event = event
-        ee = "{0:016b}".format(self._expected_event)
-        log.info(
-            f"Wait for state: ACC={ee[1]} OB={ee[2]} W2/G3={ee[3]} Y2/G2={ee[4]} W1={ee[5]} "
-            f"Y1={ee[6]} G={ee[7]} PEK_ALT={ee[12]}"
-        )
-        return self._wait_for_condition(timeout)
+        log.info(f"Wait for state: {relay_state.format_terminals(self._expected_event)}")
+        start = time.perf_counter()
+        matched = self._wait_for_condition(timeout)
+        self.record_wait(timeout, matched, time.perf_counter() - start)
+        if not matched:
+            log.info(f"Event not matched: {describe_state(self._current_event, event)}")
+        return matched
+
+    def record_wait(self, timeout: float, matched: bool, latency: float):
+        """Counts a finished wait for GET /metrics. Simple checks (timeout 0) are not waits and are left out.
+
+        :param latency: seconds until the event matched
+        """
+        if not timeout:
+            return
+        if matched:
+            WAIT_MATCH.observe(latency, self.bus_number, self.IC)
+        else:
+            WAIT_TIMEOUTS.inc(self.bus_number, self.IC)
+
+    def read_relay_state(self) -> int:
+        """Current sensed state as the raw bitmask. The bus is only read if the sampler is not keeping it fresh.
+
+        :return: relay state represented in binary, each bit representing a relay
+        """
+        if not self.sampling:
+            self._update_current_event()
+        # every read, too chatty for INFO. Skip building the description unless it is logged
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"Relay states: {describe_state(self._current_event)}")
+        return self._current_event
+
+    def relay_states(self) -> Dict[str, bool]:
+        """Current sensed state decoded into the enabled terminals
+
+        :return: dictionary of terminal name to state
+        """
+        return relay_state.decode(self.read_relay_state())
 
     def get_relay_states(self):
         """Provides a list of relay states formattes as a JSON for protocols processing
 
         :return: JSON list
         """
-        self._update_current_event()
-        ce = "{0:016b}".format(self._current_event)
-        relay_mapping = {1: "ACC", 2: "OB", 3: "W2/G3", 4: "Y2/G2", 5: "W1", 6: "Y1", 7: "G", 12: "PEK_ALT"}
+        return json.dumps(self.relay_states())
 
-        relay_states = {}
-        for pin in relay_mapping:
-            relay_states[relay_mapping[pin]] = bool(int(ce[pin]))
-        return json.dumps(relay_states)
\ No newline at end of file
+    @staticmethod
+    def decode_relay_states(state: int) -> Dict[str, bool]:
+        """Decodes a sensed state into the enabled terminals
+
+        :param state: relay state represented in binary, each bit representing a relay
+        :return: dictionary of terminal name to state
+        """
+        return relay_state.decode(state)
\ No newline at end of file
@@ -1,3 +1,6 @@
+from typing import Dict, List, Optional, Tuple
+
+
 class SenseModuleEvents:
     # Input pin to terminal mapping
     # schematic can be found here:<TBD>
@@ -205,3 +208,84 @@ class SenseModuleEvents:
     EVENT_HPCOOL_OB_STAGE_1_FAN3 = IN_G | IN_G2 | IN_G3 | IN_Y1 | IN_OB
     EVENT_HPCOOL_STAGE_1_ACC_FAN3 = IN_G | IN_G2 | IN_G3 | IN_Y1 | IN_ACC
     EVENT_HPCOOL_OB_STAGE_1_ACC_FAN3 = IN_G | IN_G2 | IN_G3 | IN_Y1 | IN_OB | IN_ACC
+
+
+# Wire label of each sensed bit, shared terminals carry both names
+WIRE_NAMES = {
+    SenseModuleEvents.IN_TP64: "TP64",
+    SenseModuleEvents.IN_TP63: "TP63",
+    SenseModuleEvents.IN_TP62: "TP62",
+    SenseModuleEvents.IN_PEK_ALT: "PEK_ALT",
+    SenseModuleEvents.IN_EXT4: "EXT4",
+    SenseModuleEvents.IN_EXT3: "EXT3",
+    SenseModuleEvents.IN_EXT2: "EXT2",
+    SenseModuleEvents.IN_EXT1: "EXT1",
+    SenseModuleEvents.IN_G: "G",
+    SenseModuleEvents.IN_Y1: "Y1",
+    SenseModuleEvents.IN_W1: "W1",
+    SenseModuleEvents.IN_Y2: "Y2/G2",
+    SenseModuleEvents.IN_W2: "W2/G3",
+    SenseModuleEvents.IN_OB: "OB",
+    SenseModuleEvents.IN_ACC: "ACC",
+    SenseModuleEvents.IN_PEK: "PEK",
+}
+
+def _index_events() -> Dict[int, Tuple[str, ...]]:
+    """Bitmask -> every EVENT_* name with that value, in definition order"""
+    index = {}
+    for name, value in vars(SenseModuleEvents).items():
+        if name.startswith("EVENT_"):
+            index.setdefault(value, []).append(name)
+    return {mask: tuple(names) for mask, names in index.items()}
+
+
+# Reverse index built once at import
+EVENTS_BY_MASK = _index_events()
+
+
+def wires(mask: int) -> List[str]:
+    """Wire labels of the bits set in `mask`"""
+    return [name for bit, name in WIRE_NAMES.items() if mask & bit]
+
+
+def classify_state(state: int) -> Dict:
+    """Names a sensed state, or the closest known event by Hamming distance and the wires that differ from it
+
+    :param state: relay state represented in binary, each bit representing a relay
+    :return: {"matched": [names], "closest": [names], "distance": int, "missing": [wires], "unexpected": [wires]}
+    """
+    if state in EVENTS_BY_MASK:
+        return {"matched": list(EVENTS_BY_MASK[state]), "closest": list(EVENTS_BY_MASK[state]), "distance": 0,
+                "missing": [], "unexpected": []}
+    closest = min(EVENTS_BY_MASK, key=lambda mask: bin(mask ^ state).count("1"))
+    return {
+        "matched": [],
+        "closest": list(EVENTS_BY_MASK[closest]),
+        "distance": bin(closest ^ state).count("1"),
+        "missing": wires(closest & ~state),
+        "unexpected": wires(state & ~closest),
+    }
+
+
+def describe_state(state: int, expected: Optional[int] = None) -> str:
+    """One line description of a sensed state for logs, e.g. "closest EVENT_Y, missing W2/G3"
+
+    :param state: relay state represented in binary, each bit representing a relay
+    :param expected: when given, describes how the state differs from this event instead of the closest one
+    """
+    if expected is not None and state != expected:
+        names = EVENTS_BY_MASK.get(expected) or [f"{expected:#018b}"]
+        differences = [f"missing {', '.join(wires(expected & ~state))}"] if expected & ~state else []
+        if state & ~expected:
+            differences.append(f"unexpected {', '.join(wires(state & ~expected))}")
+        return f"expected {'/'.join(names)}, sensed {describe_state(state)}; {'; '.join(differences)}"
+
+    classification = classify_state(state)
+    if classification["matched"]:
+        return f"matched {'/'.join(classification['matched'])}"
+    differences = []
+    if classification["missing"]:
+        differences.append(f"missing {', '.join(classification['missing'])}")
+    if classification["unexpected"]:
+        differences.append(f"unexpected {', '.join(classification['unexpected'])}")
+    return f"closest {'/'.join(classification['closest'])}, {', '.join(differences)}"
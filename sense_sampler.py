@@ -0,0 +1,118 @@
+"""Background sampler for the sense module
+
+One thread per board reads the sense expander at a configurable rate and publishes timestamped samples through the
+SenseModule, so RelayBoard.wait_for_event and the API handlers read the latest sample instead of touching the bus.
+
+The rate adapts to activity: right after a transition the sampler runs at `max_rate` for `boost_duration` seconds,
+then backs off geometrically towards `min_rate` while the inputs are quiet. It keeps its own timing statistics
+(jitter against the schedule and missed deadlines) so the rate can be sized against the i2c bandwidth on the Pi.
+"""
+import threading
+import time
+from collections import namedtuple
+from typing import Dict
+
+from service_logging import log
+
+# timestamp_ns is time.monotonic_ns() at the end of the read, state is the raw 16 bit sense value
+Sample = namedtuple("Sample", ["timestamp_ns", "state"])
+
+
+class SenseSampler:
+    # factor applied to the sampling period for every quiet sample once the boost has expired
+    BACKOFF_FACTOR = 1.25
+
+    def __init__(self, sense_module, min_rate: float = 20, max_rate: float = 100, boost_duration: float = 1.0):
+        """
+        :param sense_module: SenseModule to sample
+        :param min_rate: sampling rate in Hz while the inputs are quiet
+        :param max_rate: sampling rate in Hz right after a transition
+        :param boost_duration: seconds to stay at max_rate after a transition
+        """
+        if min_rate <= 0 or max_rate < min_rate:
+            raise ValueError(f"Invalid sampling rates: min {min_rate} Hz, max {max_rate} Hz")
+        self.sense_module = sense_module
+        self.min_period = 1 / min_rate
+        self.max_period = 1 / max_rate
+        self.boost_duration = boost_duration
+        self.period = self.min_period
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.samples = 0
+        self.transitions = 0
+        self.missed_deadlines = 0
+        self.read_errors = 0
+        self.jitter_max = 0.0
+        self._jitter_total = 0.0
+
+    def start(self):
+        """Starts the sampler thread"""
+        if self._thread is not None:
+            return
+        log.info(f"Starting sense sampler ({1 / self.min_period:.0f}-{1 / self.max_period:.0f} Hz)")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sense-sampler", daemon=True)
+        self._thread.start()
+        self.sense_module.sampling = True
+
+    def stop(self, timeout: float = 1.0):
+        """Stops the sampler thread, the sense module goes back to reading the bus itself"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        self.sense_module.sampling = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def _run(self):
+        deadline = time.monotonic()
+        boost_until = 0.0
+        while not self._stop.is_set():
+            woke = time.monotonic()
+            jitter = max(woke - deadline, 0.0)
+            self._jitter_total += jitter
+            self.jitter_max = max(self.jitter_max, jitter)
+
+            try:
+                changed = self.sense_module.sample()
+            except OSError as e:
+                self.read_errors += 1
+                log.warning(f"Sense sampler read failed: {e}")
+                changed = False
+            self.samples += 1
+
+            now = time.monotonic()
+            if changed:
+                self.transitions += 1
+                boost_until = now + self.boost_duration
+                self.period = self.max_period
+            elif now >= boost_until:
+                self.period = min(self.period * self.BACKOFF_FACTOR, self.min_period)
+
+            deadline += self.period
+            if now > deadline:
+                # the read overran the next slot, count it and re-anchor the schedule instead of bursting
+                self.missed_deadlines += 1
+                deadline = now
+            self._stop.wait(deadline - now)
+
+    def stats(self) -> Dict:
+        """Timing statistics of the sampler
+
+        :return: dictionary with the current rate, sample/transition counts, jitter (s) and missed deadlines
+        """
+        return {
+            "running": self.running,
+            "rate_hz": round(1 / self.period, 2),
+            "samples": self.samples,
+            "transitions": self.transitions,
+            "read_errors": self.read_errors,
+            "missed_deadlines": self.missed_deadlines,
+            "jitter_mean_s": self._jitter_total / self.samples if self.samples else 0.0,
+            "jitter_max_s": self.jitter_max,
+        }
@@ -0,0 +1,221 @@
+"""Process wide metrics, rendered in the Prometheus text exposition format by GET /metrics
+
+Metrics are recorded on the hardware path (every i2c transaction, configure and wait), so recording never takes a
+lock: every thread counts into its own shard and a scrape sums the shards. A shard is registered once per thread, the
+only time a lock is taken. Gauges are not recorded at all, their values are read from a function at scrape time.
+
+    from service_metrics import I2C_TRANSACTIONS
+    I2C_TRANSACTIONS.inc(bus_number, address)
+"""
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# latency buckets in seconds, from a single i2c transaction up to a long wait for a thermostat call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# every metric created, in the order they are rendered
+_METRICS: List["_Metric"] = []
+
+
+class _Shards:
+    """One dict per recording thread, label values -> cell. Only the owning thread writes its dict."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Dict] = []
+
+    def local(self) -> Dict:
+        try:
+            return self._local.cells
+        except AttributeError:
+            cells = self._local.cells = {}
+            with self._lock:
+                self._shards.append(cells)
+            return cells
+
+    def snapshot(self) -> List[Dict]:
+        """Copies of every shard, threads keep recording meanwhile"""
+        with self._lock:
+            shards = list(self._shards)
+        return [dict(shard) for shard in shards]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 formats: Optional[Tuple[str, ...]] = None):
+        """
+        :param labelnames: names of the labels, values are passed positionally in this order
+        :param formats: format spec of each label value (e.g. "#04x" for an address), applied when rendering so the
+            hot path passes raw values
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.formats = formats or ("",) * len(labelnames)
+        _METRICS.append(self)
+
+    def _labels(self, values: Tuple, **extra: str) -> str:
+        pairs = [f'{name}="{_escape(format(value, spec))}"'
+                 for name, value, spec in zip(self.labelnames, values, self.formats)]
+        pairs.extend(f'{name}="{value}"' for name, value in extra.items())
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._shards = _Shards()
+
+    def inc(self, *labels, amount: float = 1):
+        cells = self._shards.local()
+        cells[labels] = cells.get(labels, 0) + amount
+
+    def values(self) -> Dict[Tuple, float]:
+        """Label values -> total over every thread"""
+        totals = {}
+        for shard in self._shards.snapshot():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.values().items()):
+            yield f"{self.name}{self._labels(labels)} {value}"
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        self._shards = _Shards()
+
+    def observe(self, value: float, *labels):
+        cells = self._shards.local()
+        cell = cells.get(labels)
+        if cell is None:
+            # one count per bucket, one for +Inf, then the sum
+            cell = cells[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def values(self) -> Dict[Tuple, List[float]]:
+        """Label values -> per bucket counts (not cumulative) followed by the sum, over every thread"""
+        totals = {}
+        for shard in self._shards.snapshot():
+            for labels, cell in shard.items():
+                total = totals.setdefault(labels, [0] * len(cell))
+                for i, value in enumerate(list(cell)):
+                    total[i] += value
+        return totals
+
+    def samples(self) -> Iterable[str]:
+        for labels, cell in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), cell):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{self._labels(labels, le=le)} {cumulative}"
+            yield f"{self.name}_sum{self._labels(labels)} {cell[-1]}"
+            yield f"{self.name}_count{self._labels(labels)} {cumulative}"
+
+
+class Gauge(_Metric):
+    TYPE = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], Iterable[Tuple[Tuple, float]]]] = None
+
+    def set_function(self, function: Callable[[], Iterable[Tuple[Tuple, float]]]):
+        """Reads the gauge from `function` on every scrape, replacing any function set before
+
+        :param function: returns (label values, value) pairs
+        """
+        self._function = function
+
+    def samples(self) -> Iterable[str]:
+        if self._function is None:
+            return
+        for labels, value in self._function():
+            yield f"{self.name}{self._labels(labels)} {value}"
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in _METRICS) + "\n"
+
+
+class RequestMetrics:
+    """ASGI middleware observing the latency of every HTTP request, labelled by route template so path parameters
+    don't create series"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.observe(time.perf_counter() - start, scope["method"],
+                                    route.path if route is not None else "unmatched", status[0])
+
+
+REQUEST_LATENCY = Histogram(
+    "hvac_http_request_duration_seconds", "HTTP request latency by endpoint", ("method", "path", "status")
+)
+I2C_TRANSACTIONS = Counter(
+    "hvac_i2c_transactions_total", "i2c transactions by expander", ("bus", "address"), ("d", "#04x")
+)
+I2C_ERRORS = Counter(
+    "hvac_i2c_errors_total", "Failed i2c transactions by expander", ("bus", "address"), ("d", "#04x")
+)
+CONFIGURE_PHASE = Histogram(
+    "hvac_configure_phase_duration_seconds",
+    "SwitchModule.configure time by phase (cleanup: power pins off, non_power, power: power pins on), including "
+    "relay settling",
+    ("bus", "address", "phase"), ("d", "#04x", ""),
+)
+WAIT_MATCH = Histogram(
+    "hvac_wait_for_event_match_seconds", "Time wait_for_event took to match the expected event",
+    ("bus", "address"), ("d", "#04x"),
+)
+WAIT_TIMEOUTS = Counter(
+    "hvac_wait_for_event_timeouts_total", "wait_for_event calls that timed out", ("bus", "address"), ("d", "#04x")
+)
+SESSIONS = Counter("hvac_sessions_total", "Sessions by lifecycle event (started, ended, expired)", ("event",))
+SENSED_STATE = Gauge("hvac_sensed_state", "Current sensed state of each wire, 1 when energized", ("board", "wire"))
@@ -0,0 +1,379 @@
+"""Session leases over the pool of relay boards
+
+The FastAPI server owns every board of the board registry. A session leases one free board that takes the requested
+model, and every session scoped request is routed to its board by session ID, so there are as many concurrent
+sessions as there are fixtures. Each lease has its own reaper task that ends the session once it has been idle for
+the TTL, instead of the TTL being checked whenever a request happens to arrive.
+
+Hardware work of a board runs on the executor of its bus. Releasing a lease frees the board at once and queues the
+reset on that executor, so a session started right after on the same board runs after the reset.
+
+Clients that find every board busy queue a ticket instead of polling the status. Tickets are served first come first
+served per board: whenever a board is freed it is reserved for the oldest waiting ticket that takes its model, and
+the session is started on it before the ticket holder's long-poll returns. Boards a ticket is waiting for are not
+handed to direct session starts, so nobody jumps the queue.
+"""
+import asyncio
+import time
+from binascii import b2a_hex
+from collections import OrderedDict
+from concurrent.futures import Future
+from os import urandom
+from typing import Dict, List, Optional
+
+from service_logging import log
+from board_registry import BoardRegistry
+from relay_board import BoardDescriptor, RelayBoard
+from relay_stream import RelayStateBroadcaster
+from service_metrics import SESSIONS
+
+
+class BoardSlot:
+    """One board of the pool with the relay board, executor and broadcaster its sessions use"""
+
+    def __init__(self, board: BoardDescriptor):
+        self.board = board
+        # relay and bus work for this board, shared with the other boards on its bus
+        self.hw = BoardRegistry.executor(board)
+        self.broadcaster = RelayStateBroadcaster()
+        self.rb: Optional[RelayBoard] = None
+        self.lease: Optional["Lease"] = None
+
+    def accepts(self, model: str) -> bool:
+        """True if the board's fixture takes `model`"""
+        return self.board.models is None or model in self.board.models
+
+    def init_relay_board(self, model: str = "ares"):
+        """Builds the relay board in the default powered state. Runs on the hardware executor."""
+        self.rb = RelayBoard(model, board=self.board)
+        self.broadcaster.attach(self.rb.sense_module)
+        self.rb.configure(self.rb.configurations.CONFIG_POWER)
+
+    def start(self, flags: Dict):
+        """Switches the relay board to a session's model and flags and powers it. Runs on the hardware executor.
+
+        :raises ValueError: if the flag combination is invalid
+        """
+        # GPIO, the buses and the sampler stay up between sessions, only the configurations and relays change
+        self.rb.switch_session(**flags)
+        self.rb.configure(self.rb.configurations.CONFIG_POWER)
+
+    def reset(self, full: bool = False):
+        """Brings the relay board back to the default powered state. Runs on the hardware executor.
+
+        :param full: tear down the board's GPIO and rebuild the relay board instead of switching it back in place
+        """
+        if self.rb and not full:
+            self.rb.switch_session("ares")
+            self.rb.configure(self.rb.configurations.CONFIG_POWER)
+            return
+        if self.rb:
+            self.rb.cleanup()
+        self.init_relay_board()
+
+    def status(self) -> Dict:
+        """Board name, bus, models and whether it is leased. Session IDs are not exposed."""
+        return {
+            "board": self.board.name,
+            "bus_number": self.board.bus_number,
+            "models": list(self.board.models) if self.board.models is not None else None,
+            "busy": self.lease is not None,
+            "model": self.lease.flags["model"] if self.lease else None,
+            "expires_in": self.lease.expires_in() if self.lease else None,
+        }
+
+
+class Lease:
+    """A session holding one board"""
+
+    def __init__(self, session_id: str, slot: BoardSlot, flags: Dict, ttl: float):
+        self.session_id = session_id
+        self.slot = slot
+        self.flags = flags
+        self.ttl = ttl
+        self.start_time = time.time()
+        self.last_event_time = time.monotonic()
+        self.reaper: Optional[asyncio.Task] = None
+
+    def touch(self):
+        """Records session activity, pushing the expiry back by the TTL"""
+        self.last_event_time = time.monotonic()
+
+    def expires_in(self) -> float:
+        """Seconds of idle time left before the reaper ends the session"""
+        return max(self.last_event_time + self.ttl - time.monotonic(), 0.0)
+
+
+class Ticket:
+    """A place in the reservation queue, turned into a lease once a board that takes its model is free"""
+
+    def __init__(self, ticket_id: str, flags: Dict, ttl: float):
+        self.ticket_id = ticket_id
+        self.flags = flags
+        self.ttl = ttl
+        self.created = time.time()
+        self.last_poll = time.monotonic()
+        # long-polls currently waiting on the ticket, a ticket is never dropped while one is in progress
+        self.waiters = 0
+        # set once a board is reserved for the ticket
+        self.lease: Optional[Lease] = None
+        # why the ticket ended without a session, if it did
+        self.error: Optional[str] = None
+        # completes with the started lease, or None if the ticket ended without one
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.reaper: Optional[asyncio.Task] = None
+
+    def touch(self):
+        self.last_poll = time.monotonic()
+
+    def expires_in(self) -> float:
+        """Seconds left before an unpolled ticket is dropped"""
+        if self.waiters:
+            return self.ttl
+        return max(self.last_poll + self.ttl - time.monotonic(), 0.0)
+
+
+class LeaseManager:
+
+    # ended session IDs remembered, so a late request is told its session expired rather than that it is unknown
+    EXPIRED_MEMORY = 256
+
+    def __init__(self, registry: BoardRegistry, ttl: float, ticket_ttl: float):
+        """
+        :param registry: boards to lease out
+        :param ttl: seconds a session may stay idle before it is ended
+        :param ticket_ttl: seconds a queued ticket may go without being polled before it is dropped, also the time
+            its holder has to pick up the session once the ticket is turned into one
+        """
+        self.ttl = ttl
+        self.ticket_ttl = ticket_ttl
+        # board name -> slot, in registry order
+        self.slots: Dict[str, BoardSlot] = OrderedDict((board.name, BoardSlot(board)) for board in registry)
+        self._leases: Dict[str, Lease] = {}
+        self._expired: Dict[str, None] = OrderedDict()
+        # ticket ID -> ticket, oldest first
+        self._tickets: Dict[str, Ticket] = OrderedDict()
+
+    def init_boards(self):
+        """Builds every relay board, boards on different buses in parallel. Blocks until all are up."""
+        futures = [slot.hw.submit(slot.init_relay_board) for slot in self.slots.values()]
+        for future in futures:
+            future.result()
+
+    def default_slot(self) -> BoardSlot:
+        return next(iter(self.slots.values()))
+
+    def get(self, session_id: str) -> Optional[Lease]:
+        """The lease of an active session, None if there is none"""
+        return self._leases.get(session_id)
+
+    def expired(self, session_id: str) -> bool:
+        """True if `session_id` belonged to a session that has since ended"""
+        return session_id in self._expired
+
+    def leases(self) -> List[Lease]:
+        return list(self._leases.values())
+
+    def free_slot(self, model: Optional[str] = None, skip_queued: bool = False) -> Optional[BoardSlot]:
+        """First free board that takes `model` (any model if None), None if every such board is leased
+
+        :param skip_queued: leave out boards a queued ticket is waiting for, so nobody jumps the queue
+        """
+        waiting = self.waiting() if skip_queued else []
+        for slot in self.slots.values():
+            if slot.lease is not None or (model is not None and not slot.accepts(model)):
+                continue
+            if any(slot.accepts(ticket.flags["model"]) for ticket in waiting):
+                continue
+            return slot
+        return None
+
+    async def acquire(self, flags: Dict) -> Optional[Lease]:
+        """Leases a free board taking `flags["model"]` and starts the session on it. Boards queued tickets are
+        waiting for are not handed out.
+
+        :param flags: model, has_pek, has_rh, has_rc, in_phase and acc_minus of the session
+        :return: the new lease, None if no such board is free
+        :raises ValueError: if the flag combination is invalid, the board is reset and freed again
+        """
+        # picking and reserving the board do not await, so no other request can take it in between
+        slot = self.free_slot(flags["model"], skip_queued=True)
+        if slot is None:
+            return None
+        lease = self._reserve(slot, flags)
+        await self._start(lease)
+        return lease
+
+    def _reserve(self, slot: BoardSlot, flags: Dict) -> Lease:
+        """Marks `slot` as taken by a new lease that is not started yet"""
+        lease = Lease(b2a_hex(urandom(15)).decode("utf-8"), slot, dict(flags), self.ttl)
+        slot.lease = lease
+        return lease
+
+    async def _start(self, lease: Lease):
+        """Starts a reserved lease on its board and arms its reaper
+
+        :raises ValueError: if the flag combination is invalid. On this or any other failure the board is reset and
+            freed again before the exception propagates
+        """
+        slot = lease.slot
+        try:
+            await slot.hw.run(slot.start, lease.flags)
+        except Exception:
+            if slot.lease is lease:
+                slot.lease = None
+            slot.hw.submit(slot.reset)
+            self._dispatch()
+            raise
+        self._leases[lease.session_id] = lease
+        SESSIONS.inc("started")
+        lease.touch()
+        lease.reaper = asyncio.create_task(self._reap(lease))
+        log.info(f"Session started on {slot.board.name} for {lease.flags['model']}")
+
+    def release(self, lease: Lease, full: bool = False, expired: bool = False) -> Future:
+        """Ends a session. The board is free at once, its reset is queued on the board's executor and the board is
+        handed to the oldest queued ticket that takes it.
+
+        :param full: rebuild the relay board from scratch instead of switching it back in place
+        :param expired: remember the session ID as expired
+        :return: future completing once the board is back in its default powered state
+        """
+        self._end(lease, expired)
+        future = lease.slot.hw.submit(lease.slot.reset, full)
+        self._dispatch()
+        return future
+
+    def release_all(self, full: bool = False) -> List[Future]:
+        """Ends every session and resets every board, leased or not. Queued tickets keep their place.
+
+        :return: futures of the board resets
+        """
+        for lease in self.leases():
+            self._end(lease)
+        futures = [slot.hw.submit(slot.reset, full) for slot in self.slots.values()]
+        self._dispatch()
+        return futures
+
+    def _end(self, lease: Lease, expired: bool = False):
+        """Drops a lease and frees its board without touching the hardware"""
+        if self._leases.pop(lease.session_id, None) is not None:
+            SESSIONS.inc("expired" if expired else "ended")
+            if expired:
+                self._expired[lease.session_id] = None
+                while len(self._expired) > self.EXPIRED_MEMORY:
+                    self._expired.popitem(last=False)
+        if lease.reaper is not None and lease.reaper is not asyncio.current_task():
+            lease.reaper.cancel()
+        if lease.slot.lease is lease:
+            lease.slot.lease = None
+
+    async def _reap(self, lease: Lease):
+        """Ends the session once it has been idle for the TTL"""
+        while True:
+            remaining = lease.expires_in()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        log.info(f"Session on {lease.slot.board.name} expired after {self.ttl} s idle")
+        self.release(lease, expired=True)
+
+    # --------------------------
+    # Reservation queue
+    # --------------------------
+    def enqueue(self, flags: Dict) -> Ticket:
+        """Queues a reservation for a board taking `flags["model"]`. If one is free and nobody is ahead, the ticket
+        is turned into a session right away.
+
+        :param flags: model, has_pek, has_rh, has_rc, in_phase and acc_minus of the session
+        """
+        ticket = Ticket(b2a_hex(urandom(15)).decode("utf-8"), dict(flags), self.ticket_ttl)
+        self._tickets[ticket.ticket_id] = ticket
+        ticket.reaper = asyncio.create_task(self._reap_ticket(ticket))
+        self._dispatch()
+        return ticket
+
+    def ticket(self, ticket_id: str) -> Optional[Ticket]:
+        return self._tickets.get(ticket_id)
+
+    def waiting(self) -> List[Ticket]:
+        """Tickets still waiting for a board, oldest first"""
+        return [ticket for ticket in self._tickets.values() if ticket.lease is None]
+
+    def position(self, ticket: Ticket) -> int:
+        """1 based place of a waiting ticket in the queue, 0 once a board is reserved for it"""
+        if ticket.lease is not None:
+            return 0
+        return next(i for i, waiting in enumerate(self.waiting(), 1) if waiting is ticket)
+
+    async def wait(self, ticket: Ticket, timeout: float) -> bool:
+        """Long-polls a ticket until it has ended or `timeout` seconds have passed
+
+        :return: True if the ticket has ended, check ticket.ready for the lease
+        """
+        ticket.waiters += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.ready), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            ticket.waiters -= 1
+            ticket.touch()
+
+    def claim(self, ticket: Ticket) -> Lease:
+        """Hands the started lease to the ticket holder, the ticket is done with"""
+        self._drop_ticket(ticket)
+        lease = ticket.ready.result()
+        lease.touch()
+        return lease
+
+    def cancel(self, ticket: Ticket, reason: str = "Ticket cancelled"):
+        """Leaves the queue. A session the ticket was already turned into is ended."""
+        self._drop_ticket(ticket)
+        if ticket.error is None:
+            ticket.error = reason
+        if ticket.lease is not None and self._leases.get(ticket.lease.session_id) is ticket.lease:
+            self.release(ticket.lease)
+        if not ticket.ready.done():
+            ticket.ready.set_result(None)
+
+    def _drop_ticket(self, ticket: Ticket):
+        self._tickets.pop(ticket.ticket_id, None)
+        if ticket.reaper is not None and ticket.reaper is not asyncio.current_task():
+            ticket.reaper.cancel()
+
+    def _dispatch(self):
+        """Reserves free boards for waiting tickets, oldest first. A ticket only waits behind older tickets that
+        take the same boards."""
+        for ticket in self.waiting():
+            slot = self.free_slot(ticket.flags["model"])
+            if slot is not None:
+                ticket.lease = self._reserve(slot, ticket.flags)
+                asyncio.create_task(self._start_ticket(ticket))
+
+    async def _start_ticket(self, ticket: Ticket):
+        """Starts the lease reserved for a ticket and wakes its holder"""
+        try:
+            await self._start(ticket.lease)
+        except Exception as e:
+            # the board is freed already, wake the holder instead of leaving the ticket reserved forever
+            log.warning(f"Session start for ticket failed on {ticket.lease.slot.board.name}: {e}")
+            self.cancel(ticket, str(e))
+            return
+        if ticket.ticket_id not in self._tickets:
+            # cancelled while the board was starting
+            self.release(ticket.lease)
+            return
+        log.info(f"Ticket turned into a session on {ticket.lease.slot.board.name}")
+        ticket.ready.set_result(ticket.lease)
+
+    async def _reap_ticket(self, ticket: Ticket):
+        """Drops a ticket whose holder stopped polling, ending the session it was turned into if never picked up"""
+        while True:
+            remaining = ticket.expires_in()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        log.info(f"Ticket dropped after {self.ticket_ttl} s without a poll")
+        self.cancel(ticket, "Ticket expired")
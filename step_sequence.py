@@ -0,0 +1,216 @@
+"""Server side execution of test step sequences
+
+A step is "configure X, run an aquastat action, wait for event Y within T, dwell D", every part optional. The steps of
+a sequence are validated up front and then run back to back, reporting per step timing and pass/fail as each step
+finishes. run_sequence runs everything on the caller's thread. run_sequence_async is for the servers: only configure
+and aquastat actions go to the board's hardware executor, waits and dwells run on the event loop.
+
+Steps are plain dictionaries:
+
+    {"config": "CONFIG_FAN", "aquastat": None, "event": "EVENT_FAN", "timeout": 30, "dwell": 5}
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+from sense_module_events import SenseModuleEvents, describe_state
+
+# aquastat action -> SwitchModule method
+AQUASTAT_ACTIONS = {
+    "start": "start_aquastat_mode",
+    "end": "end_aquastat_mode",
+    "open": "open_aquastat",
+    "close": "close_aquastat",
+}
+
+
+def resolve_event(event: Union[int, str]) -> int:
+    """Converts an event given as a bitmask or a SenseModuleEvents EVENT_* name to its bitmask
+
+    :raises ValueError: if the name is unknown or the mask is not a 16 bit relay state
+    """
+    if isinstance(event, str):
+        if not event.startswith("EVENT_") or not hasattr(SenseModuleEvents, event):
+            raise ValueError(f"Unknown event {event}")
+        event = getattr(SenseModuleEvents, event)
+    if not 0 <= event <= 0xFFFF:
+        raise ValueError("Event must be a 16 bit relay state")
+    return event
+
+
+def validate_steps(steps: List[Dict], registry) -> List[Dict]:
+    """Checks every step before anything is run
+
+    :param steps: steps as dictionaries with optional config, aquastat, event, timeout and dwell
+    :param registry: ConfigRegistry of the relay board's current model and flags
+    :return: normalized steps, with the event resolved to a bitmask and the config's pins looked up
+    :raises ValueError: naming the first invalid step
+    """
+    normalized = []
+    for i, step in enumerate(steps):
+        config = step.get("config")
+        aquastat = step.get("aquastat")
+        event = step.get("event")
+        timeout = step.get("timeout") or 0
+        dwell = step.get("dwell") or 0
+        if config is not None and config not in registry:
+            raise ValueError(f"Step {i}: invalid configuration command {config}")
+        if aquastat is not None and aquastat not in AQUASTAT_ACTIONS:
+            raise ValueError(f"Step {i}: aquastat action must be one of {list(AQUASTAT_ACTIONS)}")
+        if timeout < 0 or dwell < 0:
+            raise ValueError(f"Step {i}: timeout and dwell must not be negative")
+        try:
+            expected = resolve_event(event) if event is not None else None
+        except ValueError as e:
+            raise ValueError(f"Step {i}: {e}")
+        normalized.append({
+            "config": config,
+            "pins": registry[config] if config is not None else None,
+            "aquastat": aquastat,
+            "event": expected,
+            "timeout": timeout,
+            "dwell": dwell,
+        })
+    return normalized
+
+
+def _new_result(step: Dict) -> Dict:
+    return {"config": step["config"], "aquastat": step["aquastat"], "event": step["event"], "passed": True,
+            "error": None}
+
+
+def _fail(result: Dict, error: str):
+    result["passed"] = False
+    result["error"] = error
+
+
+def apply_step(relay_board, step: Dict, result: Dict):
+    """Runs the hardware actions of a normalized step, configure then aquastat, recording their timing and any failure
+    in `result`. This is the only part of a step that has to run on the hardware executor.
+    """
+    start = time.monotonic()
+    try:
+        if step["pins"] is not None:
+            relay_board.configure(step["pins"])
+        result["configure_s"] = time.monotonic() - start
+
+        if step["aquastat"] is not None:
+            response = getattr(relay_board.switch_module, AQUASTAT_ACTIONS[step["aquastat"]])()
+            if response.status_code != 200:
+                _fail(result, response.body.decode())
+        result["aquastat_s"] = time.monotonic() - start - result["configure_s"]
+    except (ValueError, OSError) as e:
+        _fail(result, str(e))
+
+
+def _check_event(relay_board, step: Dict, result: Dict, matched: bool):
+    if not matched:
+        sensed = relay_board.sense_module.last_sample.state
+        _fail(result, f"Event not seen within {step['timeout']} s: {describe_state(sensed, step['event'])}")
+
+
+def _finish(relay_board, result: Dict, start: float) -> Dict:
+    result["dwell_s"] = result.get("dwell_s", 0) if result["passed"] else 0
+    result["state"] = relay_board.sense_module.last_sample.state
+    result["elapsed_s"] = time.monotonic() - start
+    return result
+
+
+def run_step(relay_board, step: Dict) -> Dict:
+    """Runs one normalized step on the caller's thread
+
+    :return: dictionary with pass/fail, the sensed state and the time spent in each phase in seconds
+    """
+    start = time.monotonic()
+    result = _new_result(step)
+    apply_step(relay_board, step, result)
+    wait_start = time.monotonic()
+    try:
+        if result["passed"] and step["event"] is not None:
+            _check_event(relay_board, step, result, relay_board.wait_for_event(step["event"], step["timeout"]))
+        result["wait_s"] = time.monotonic() - wait_start
+
+        if result["passed"] and step["dwell"]:
+            time.sleep(step["dwell"])
+            result["dwell_s"] = step["dwell"]
+    except (ValueError, OSError) as e:
+        _fail(result, str(e))
+    return _finish(relay_board, result, start)
+
+
+async def run_step_async(relay_board, step: Dict, hardware: Callable[..., Awaitable],
+                         wait_for_event: Callable[[int, float], Awaitable[bool]]) -> Dict:
+    """Runs one normalized step from the event loop. Only configure and aquastat go through `hardware`, the wait and
+    the dwell don't hold the hardware executor so other requests for the board keep being served.
+
+    :param hardware: awaits a function run on the board's hardware executor, HardwareExecutor.run
+    :param wait_for_event: awaits (expected, timeout) and returns whether the event was seen
+    :return: same as run_step
+    """
+    start = time.monotonic()
+    result = _new_result(step)
+    await hardware(apply_step, relay_board, step, result)
+    wait_start = time.monotonic()
+    try:
+        if result["passed"] and step["event"] is not None:
+            _check_event(relay_board, step, result, await wait_for_event(step["event"], step["timeout"]))
+        result["wait_s"] = time.monotonic() - wait_start
+
+        if result["passed"] and step["dwell"]:
+            await asyncio.sleep(step["dwell"])
+            result["dwell_s"] = step["dwell"]
+    except (ValueError, OSError) as e:
+        _fail(result, str(e))
+    return _finish(relay_board, result, start)
+
+
+def _add_result(results: List[Dict], result: Dict, on_result: Optional[Callable[[Dict], None]]):
+    result["step"] = len(results)
+    results.append(result)
+    if on_result is not None:
+        on_result(result)
+
+
+def _summary(steps: List[Dict], results: List[Dict], start: float) -> Dict:
+    return {
+        "passed": len(results) == len(steps) and all(result["passed"] for result in results),
+        "steps_run": len(results),
+        "steps_total": len(steps),
+        "elapsed_s": time.monotonic() - start,
+        "results": results,
+    }
+
+
+def run_sequence(relay_board, steps: List[Dict], stop_on_failure: bool = True,
+                 on_result: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """Runs normalized steps in order on the caller's thread
+
+    :param relay_board: RelayBoard to drive
+    :param steps: steps returned by validate_steps
+    :param stop_on_failure: skip the remaining steps after the first failure
+    :param on_result: called with each step result as soon as the step finishes
+    :return: summary with overall pass/fail, elapsed seconds and the step results
+    """
+    start = time.monotonic()
+    results = []
+    for step in steps:
+        _add_result(results, run_step(relay_board, step), on_result)
+        if stop_on_failure and not results[-1]["passed"]:
+            break
+    return _summary(steps, results, start)
+
+
+async def run_sequence_async(relay_board, steps: List[Dict], hardware: Callable[..., Awaitable],
+                             wait_for_event: Callable[[int, float], Awaitable[bool]], stop_on_failure: bool = True,
+                             on_result: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """Runs normalized steps in order from the event loop, see run_step_async for `hardware` and `wait_for_event`
+
+    :return: same as run_sequence
+    """
+    start = time.monotonic()
+    results = []
+    for step in steps:
+        _add_result(results, await run_step_async(relay_board, step, hardware, wait_for_event), on_result)
+        if stop_on_failure and not results[-1]["passed"]:
+            break
+    return _summary(steps, results, start)
@@ -3,15 +3,18 @@
 Make sure i2c is enabled in raspi-config
 """
 import time
-from typing import List
+from typing import List, Tuple
 
 from service_logging import log
 from fastapi import Response
 
-from switch_module_configurations import SwitchModuleConfigurations
-from constants import AquastatBoardMode, AquastatState
-
-import smbus2 as smbus
+from switch_module_configurations import POWER_MASK, SwitchModuleConfigurations, compile_config, pins_to_image
+from constants import AquastatBoardMode, AquastatState, BOARD_REVISION, RELAY_PROFILE_PATH, SHADOW_VERIFY_INTERVAL
+from register_transport import BusOwner
+from register_shadow import BANK_NAMES, IC2_GPIOA, RegisterShadow
+from relay_counters import RelayCounters
+from relay_settling import RelayProfile, RelaySettler
+from service_metrics import CONFIGURE_PHASE
 
 
 class SwitchModule:
@@ -49,28 +52,49 @@ class SwitchModule:
     OLATA = 0x14
     OLATB = 0x15
 
-    IC1_GPIOA_DATA = 0b00000000
-    IC1_GPIOB_DATA = 0b00000000
-    IC2_GPIOA_DATA = 0b00000000
-    IC2_GPIOB_DATA = 0b00000000
-
     # add params: model, has_pek, has_rh (some configs of these are invalid)
-    def __init__(self, model, has_pek=False, has_rh=False, has_rc=True, in_phase=True, acc_minus=False):
-
-        log.info("Initializing Switch Module")
+    def __init__(self, model, has_pek=False, has_rh=False, has_rc=True, in_phase=True, acc_minus=False,
+                 settler: RelaySettler = None, ic1: int = IC1, ic2: int = IC2, bus_number: int = 1,
+                 counters: RelayCounters = None):
+        """
+        :param settler: waits for relays to settle after each write, by default uses the profile times of the board
+            revision without sense module confirmation
+        :param ic1: i2c address of switch expander IC1
+        :param ic2: i2c address of switch expander IC2
+        :param bus_number: i2c bus both expanders are on
+        :param counters: actuation counters of the board's relays, None to not count
+        """
+        log.info(f"Initializing Switch Module at {ic1:#04x}/{ic2:#04x} on bus {bus_number}")
+        self.IC1 = ic1
+        self.IC2 = ic2
+        self.bus_number = bus_number
+        self.counters = counters
         self.model = model
         self.has_pek = has_pek
         self.has_rh = has_rh
-        self.SwitchModuleConfigurations = SwitchModuleConfigurations(
+        self.SwitchModuleConfigurations = SwitchModuleConfigurations.get(
             model, has_pek, has_rh, has_rc, in_phase, acc_minus
         )
-        self.bus = smbus.SMBus(1)
+        self.settler = settler or RelaySettler(RelayProfile.load(RELAY_PROFILE_PATH, BOARD_REVISION))
+        bus_owner = BusOwner.get(bus_number)
+        self.transport = bus_owner.view()
+
+        # the shadow is the source of truth for what the expanders are driving and lives as long as the bus
+        self.shadow = bus_owner.shadow(
+            (self.IC1, self.IC2, self.GPIOA),
+            lambda: RegisterShadow(self.transport, self.IC1, self.IC2, self.GPIOA)
+        )
 
-        # set all GPIOs to output
-        self.bus.write_byte_data(self.IC1, self.IODIRA, 0b00000000)
-        self.bus.write_byte_data(self.IC1, self.IODIRB, 0b00000000)
-        self.bus.write_byte_data(self.IC2, self.IODIRA, 0b00000000)
-        self.bus.write_byte_data(self.IC2, self.IODIRB, 0b00000000)
+        # expanders only need setting up once per process, unless they were reset in between (IODIR back to inputs)
+        if bus_owner.claim_init((self.IC1, self.IC2)) or not self._outputs_configured():
+            # set all GPIOs to output
+            self.transport.write_port_pair(self.IC1, self.IODIRA, 0b00000000, 0b00000000)
+            self.transport.write_port_pair(self.IC2, self.IODIRA, 0b00000000, 0b00000000)
+            # seed the shadow from the hardware in case the outputs were left on by a previous process
+            self.shadow.load()
+        self.IC1_GPIOA_DATA, self.IC1_GPIOB_DATA, self.IC2_GPIOA_DATA, self.IC2_GPIOB_DATA = self.shadow.image
+        if SHADOW_VERIFY_INTERVAL > 0:
+            self.shadow.start_verification(SHADOW_VERIFY_INTERVAL)
 
         # set all GPIOs to zero (disconnect all terminals)
         self.cleanup()
@@ -91,44 +115,93 @@ class SwitchModule:
         self.terminate_bus()
         return False  # Never suppress exceptions in HVAC control
 
+    def _outputs_configured(self) -> bool:
+        """Checks that both expanders still have every GPIO set as an output
+
+        :return: True if IODIRA/IODIRB are all outputs on both ICs
+        """
+        return (
+            self.transport.read_port_pair(self.IC1, self.IODIRA) == (0b00000000, 0b00000000)
+            and self.transport.read_port_pair(self.IC2, self.IODIRA) == (0b00000000, 0b00000000)
+        )
+
+    def switch_model(self, model, has_pek, has_rh, configurations: SwitchModuleConfigurations):
+        """Switches to the configurations of another model/flag combination without touching the hardware
+
+        :param configurations: shared configurations from SwitchModuleConfigurations.get
+        """
+        log.info(f"Switching Switch Module to {model}")
+        self.model = model
+        self.has_pek = has_pek
+        self.has_rh = has_rh
+        self.SwitchModuleConfigurations = configurations
+
     def terminate_bus(self):
         """Cleanup method"""
-        self.bus.close()
+        self.shadow.stop_verification()
+        self.transport.close()
 
     def _write_pin_data_to_registers(self):
         """Turns on pins, closing relays. DOES NOT consider necessary order of opening and closing relays"""
-        time.sleep(1)
-        self.bus.write_byte_data(self.IC1, self.GPIOA, self.IC1_GPIOA_DATA)
-        self.bus.write_byte_data(self.IC1, self.GPIOB, self.IC1_GPIOB_DATA)
-        self.bus.write_byte_data(self.IC2, self.GPIOA, self.IC2_GPIOA_DATA)
-        self.bus.write_byte_data(self.IC2, self.GPIOB, self.IC2_GPIOB_DATA)
+        self._apply_pin_data()
+
+    def _apply_pin_data(self):
+        """Writes the prepared pin data through the shadow, only bytes that changed go out on the bus. The call returns
+        once the relays that changed have settled. Drift is caught by the verification thread (SHADOW_VERIFY_INTERVAL)
+        or an explicit verify()."""
+        previous = self.shadow.image
+        if not self.write_image((self.IC1_GPIOA_DATA, self.IC1_GPIOB_DATA, self.IC2_GPIOA_DATA, self.IC2_GPIOB_DATA)):
+            return
+        closed, opened = self._changed_pins(previous, self.shadow.image)
+        waited = self.settler.settle(closed, opened)
+        log.info(f"Relays settled in {waited * 1000:.1f} ms")
+
+    def write_image(self, image: Tuple[int, int, int, int]) -> bool:
+        """Writes a register image through the shadow and counts the relays it switched. Does not wait for them to
+        settle.
+
+        :param image: (IC1_GPIOA, IC1_GPIOB, IC2_GPIOA, IC2_GPIOB)
+        :return: True if anything was written
+        """
+        previous = self.shadow.image
+        if not self.shadow.write(image):
+            return False
+        if self.counters is not None:
+            self.counters.record(previous, self.shadow.image)
+        return True
+
+    def _changed_pins(self, before: Tuple[int, int, int, int],
+                      after: Tuple[int, int, int, int]) -> Tuple[List[str], List[str]]:
+        """Pins that differ between two register images
+
+        :return: (pins turned on, pins turned off)
+        """
+        closed, opened = [], []
+        for pin, bank in self.SwitchModuleConfigurations.BANK.items():
+            i = BANK_NAMES.index(bank)
+            bit = self.SwitchModuleConfigurations.DATA[pin]
+            if (before[i] ^ after[i]) & bit:
+                (closed if after[i] & bit else opened).append(pin)
+        return closed, opened
 
     # can't do a nice | operation to write to pins since pins are distributed
     # and some use same registers on different I/O expanders
     def _add_pins_to_pin_data(self, pins):
         """Prepares pins to be turned on. DOES NOT turn any pins on/off. DOES NOT consider if pins were already on."""
-        for pin in pins:
-            if self.SwitchModuleConfigurations.BANK[pin] == "IC1_GPIOA":
-                self.IC1_GPIOA_DATA |= self.SwitchModuleConfigurations.DATA[pin]
-            elif self.SwitchModuleConfigurations.BANK[pin] == "IC1_GPIOB":
-                self.IC1_GPIOB_DATA |= self.SwitchModuleConfigurations.DATA[pin]
-            elif self.SwitchModuleConfigurations.BANK[pin] == "IC2_GPIOA":
-                self.IC2_GPIOA_DATA |= self.SwitchModuleConfigurations.DATA[pin]
-            elif self.SwitchModuleConfigurations.BANK[pin] == "IC2_GPIOB":
-                self.IC2_GPIOB_DATA |= self.SwitchModuleConfigurations.DATA[pin]
+        ic1_gpioa, ic1_gpiob, ic2_gpioa, ic2_gpiob = pins_to_image(tuple(pins))
+        self.IC1_GPIOA_DATA |= ic1_gpioa
+        self.IC1_GPIOB_DATA |= ic1_gpiob
+        self.IC2_GPIOA_DATA |= ic2_gpioa
+        self.IC2_GPIOB_DATA |= ic2_gpiob
 
     def _remove_pins_from_pin_data(self, pins):
         """Prepares pins to be turned off. DOES NOT turn any pins on/off. DOES NOT consider if pins were already off."""
-        # AND's the complement, which has all 1's and one 0 at pin to turn off that pin
-        for pin in pins:
-            if self.SwitchModuleConfigurations.BANK[pin] == "IC1_GPIOA":
-                self.IC1_GPIOA_DATA &= ~self.SwitchModuleConfigurations.DATA[pin]
-            elif self.SwitchModuleConfigurations.BANK[pin] == "IC1_GPIOB":
-                self.IC1_GPIOB_DATA &= ~self.SwitchModuleConfigurations.DATA[pin]
-            elif self.SwitchModuleConfigurations.BANK[pin] == "IC2_GPIOA":
-                self.IC2_GPIOA_DATA &= ~self.SwitchModuleConfigurations.DATA[pin]
-            elif self.SwitchModuleConfigurations.BANK[pin] == "IC2_GPIOB":
-                self.IC2_GPIOB_DATA &= ~self.SwitchModuleConfigurations.DATA[pin]
+        # AND's the complement, which has all 1's and 0's at the pins to turn off
+        ic1_gpioa, ic1_gpiob, ic2_gpioa, ic2_gpiob = pins_to_image(tuple(pins))
+        self.IC1_GPIOA_DATA &= ~ic1_gpioa
+        self.IC1_GPIOB_DATA &= ~ic1_gpiob
+        self.IC2_GPIOA_DATA &= ~ic2_gpioa
+        self.IC2_GPIOB_DATA &= ~ic2_gpiob
 
     def _remove_all_pins_from_pin_data(self):
         """Prepares all pins to be turned off. DOES NOT turn any pins on/off.
@@ -146,34 +219,56 @@ class SwitchModule:
         self.IC2_GPIOA_DATA = 0b00000000
         self.IC2_GPIOB_DATA = 0b00000000
 
-    def _log_register_bank_data(self):
-        """Reads the data on all registers and logs it"""
-        log.info(f"Bank IC1_GPIOA: {self.bus.read_byte_data(self.IC1, self.GPIOA):>08b}")
-        log.info(f"Bank IC1_GPIOB: {self.bus.read_byte_data(self.IC1, self.GPIOB):>08b}")
-        log.info(f"Bank IC2_GPIOA: {self.bus.read_byte_data(self.IC2, self.GPIOA):>08b}")
-        log.info(f"Bank IC2_GPIOB: {self.bus.read_byte_data(self.IC2, self.GPIOB):>08b}")
+    def _read_register_banks(self) -> Tuple[int, int, int, int]:
+        """Returns the GPIO registers of both expanders as held by the shadow. No bus access.
+
+        :return: (IC1_GPIOA, IC1_GPIOB, IC2_GPIOA, IC2_GPIOB)
+        """
+        return self.shadow.image
+
+    def verify_shadow(self) -> bool:
+        """Reads the expanders back and compares them against the shadow, logging any drift
+
+        :return: True if the hardware matches the shadow, False otherwise
+        """
+        return self.shadow.verify()
+
+    def _log_register_bank_data(self, banks=None):
+        """Logs the data on all registers
+
+        :param banks: register values previously returned by _read_register_banks, taken from the shadow if not given
+        """
+        if banks is None:
+            banks = self._read_register_banks()
+        ic1_gpioa, ic1_gpiob, ic2_gpioa, ic2_gpiob = banks
+        log.info(f"Bank IC1_GPIOA: {ic1_gpioa:>08b}")
+        log.info(f"Bank IC1_GPIOB: {ic1_gpiob:>08b}")
+        log.info(f"Bank IC2_GPIOA: {ic2_gpioa:>08b}")
+        log.info(f"Bank IC2_GPIOB: {ic2_gpiob:>08b}")
 
     def _read_pins(self) -> List:
         """Reads the IC pins of the switch module and determines which pins are activated on the switch module
 
         :return: list of pins that are currently activated on the switch module
         """
-        # reads and logs each pin
-        self._log_register_bank_data()
+        # takes and logs one snapshot of the banks, then decodes every pin from it
+        banks = self._read_register_banks()
+        self._log_register_bank_data(banks)
+        ic1_gpioa, ic1_gpiob, ic2_gpioa, ic2_gpiob = banks
 
-        # reads each pin and determines if the pin has been turned on or not to determine its config
+        # determines if each pin has been turned on or not to determine its config
         config = []
         for key, val in self.SwitchModuleConfigurations.DATA_IC1_GPA.items():
-            if (self.bus.read_byte_data(self.IC1, self.GPIOA) & val) == val:
+            if (ic1_gpioa & val) == val:
                 config.append(key)
         for key, val in self.SwitchModuleConfigurations.DATA_IC1_GPB.items():
-            if (self.bus.read_byte_data(self.IC1, self.GPIOB) & val) == val:
+            if (ic1_gpiob & val) == val:
                 config.append(key)
         for key, val in self.SwitchModuleConfigurations.DATA_IC2_GPA.items():
-            if (self.bus.read_byte_data(self.IC2, self.GPIOA) & val) == val:
+            if (ic2_gpioa & val) == val:
                 config.append(key)
         for key, val in self.SwitchModuleConfigurations.DATA_IC2_GPB.items():
-            if (self.bus.read_byte_data(self.IC2, self.GPIOB) & val) == val:
+            if (ic2_gpiob & val) == val:
                 config.append(key)
         log.info(f"HVACSim currently configured with: {config}")
 
@@ -197,53 +292,64 @@ class SwitchModule:
         return current_config
 
     def configure(self, config):
-        """Clean up pins and configure switch module with new pin configuration"""
-        log.info(f"Configure Switch Module with {config}")
+        """Moves the switch module to a new pin configuration, switching only the relays that differ.
 
-        # confirm that configuration is valid
-        pek_pins = [pin for pin in config if pin in self.SwitchModuleConfigurations.PEK_PINS]
-        no_pek_pins = [pin for pin in config if pin in self.SwitchModuleConfigurations.NO_PEK_PINS]
-        if pek_pins and no_pek_pins:
-            log.info("Invalid pin configuration detected (PEK and NO_PEK pins)")
-            raise ValueError(f"pek pins: {pek_pins}, cannot be used with no_pek pins: {no_pek_pins}")
-        athena_pins = [pin for pin in config if pin in self.SwitchModuleConfigurations.ATHENA_PINS]
-        not_athena_pins = [pin for pin in config if pin in self.SwitchModuleConfigurations.NOT_ATHENA_PINS]
-        if athena_pins and not_athena_pins:
-            log.info("Invalid pin configuration detected (ATHENA and NOT_ATHENA pins)")
-            raise ValueError(f"athena pins: {athena_pins}, cannot be used with not_athena pins:{not_athena_pins}")
-        pek_plus = [pin for pin in config if pin in self.SwitchModuleConfigurations.PEK_PLUS]
-        if pek_pins and pek_plus:
-            log.info("Invalid pin configuration detected (PEK_PLUS and PEK pins")
-            raise ValueError(f"pek_plus pin: {pek_plus}, cannot be used with pek pins: {pek_pins}")
-
-        # reset all lines (will turn off tstat)
-        self.cleanup()
-        time.sleep(1)
-
-        log.info("Configuring non-power pins")
-        # set non power lines first (so not switching with possibly high
-        # current running through)
-        used_main_power_pins = [pin for pin in config if pin in self.SwitchModuleConfigurations.MAIN_POWER_PINS]
-        self._add_pins_to_pin_data(config)
-        self._remove_pins_from_pin_data(used_main_power_pins)
-        self._write_pin_data_to_registers()
-
-        time.sleep(1)
+        Power pins that turn off are removed first and power pins that turn on are added last, the thermostat is only
+        power cycled when its power pins actually change.
+        """
+        log.info(f"Configure Switch Module with {config}")
 
-        log.info("Configuring power pins")
-        # set power pins and let power go through board
-        self._add_pins_to_pin_data(used_main_power_pins)
-        self._write_pin_data_to_registers()
+        try:
+            compiled = compile_config(tuple(config))
+        except ValueError as e:
+            log.info(f"Invalid pin configuration detected: {e}")
+            raise
+
+        current = self.shadow.image
+        target = compiled.image
+        if current == target:
+            log.info("Switch module already in requested configuration")
+            return
+
+        # power pins that are on now but not in the target, and the ones that have to come on
+        leaving_power = tuple(c & p & ~t for c, p, t in zip(current, POWER_MASK, target))
+        entering_power = tuple(tp & ~c for c, tp in zip(current, compiled.power))
+
+        if any(leaving_power):
+            # stop power going through the relays that change, power pins that stay on are left alone
+            log.info("Removing power pins")
+            current = tuple(c & ~lp for c, lp in zip(current, leaving_power))
+            self._set_phase_pin_data(current, "cleanup")
+
+        # toggle only the non power relays that differ, power pins keep their current state
+        non_power = tuple((c & p) | (t & ~p) for c, p, t in zip(current, POWER_MASK, target))
+        if non_power != current:
+            log.info("Configuring non-power pins")
+            self._set_phase_pin_data(non_power, "non_power")
+
+        if any(entering_power):
+            # set power pins last, once the other lines have settled (so not switching with current running through)
+            log.info("Configuring power pins")
+            self._set_phase_pin_data(target, "power")
 
         log.info("Fully configured")
         self._read_pins()
 
+    def _set_phase_pin_data(self, image: Tuple[int, int, int, int], phase: str):
+        """_set_pin_data for one phase of configure, timed for GET /metrics"""
+        start = time.perf_counter()
+        self._set_pin_data(image)
+        CONFIGURE_PHASE.observe(time.perf_counter() - start, self.bus_number, self.IC1, phase)
+
+    def _set_pin_data(self, image: Tuple[int, int, int, int]):
+        """Prepares the pin data from a register image, writes it out and waits for the relays to settle"""
+        self.IC1_GPIOA_DATA, self.IC1_GPIOB_DATA, self.IC2_GPIOA_DATA, self.IC2_GPIOB_DATA = image
+        self._apply_pin_data()
+
     # MAKE SURE THIS IS CALLED
     def cleanup(self):
         """Clear GPIO connections and stop power from going to the thermostat"""
         log.info("Cleanup Switch Module")
-        # Adding delay before reading the current relay state
-        time.sleep(1)
         if self._read_pins():
             #  stop power going through board, concentrates any damage on power switching relays
             log.info("Clean up power pins")
@@ -251,16 +357,12 @@ class SwitchModule:
             self._write_pin_data_to_registers()
             self._log_register_bank_data()
 
-            # Adding delay for relays to switch properly
-            time.sleep(1)
-
             # reset rest of lines
             log.info("Clean up non-power pins")
             # self._remove_non_power_pins_from_pin_data()
             self._remove_all_pins_from_pin_data()
             self._write_pin_data_to_registers()
             self._log_register_bank_data()
-            time.sleep(1)
         log.info("Fully cleaned")
 
     def start_aquastat_mode(self) -> Response:
@@ -278,10 +380,8 @@ class SwitchModule:
             return Response(content="Aquastat mode already started", status_code=200)
 
         # Activating S22_AQUA
-        self.IC2_GPIOA_DATA |= self.SwitchModuleConfigurations.DATA["S22_AQUA"] + self.bus.read_byte_data(
-            self.IC2, self.GPIOA
-        )
-        self.bus.write_byte_data(self.IC2, self.GPIOA, self.IC2_GPIOA_DATA)
+        self.IC2_GPIOA_DATA |= self.SwitchModuleConfigurations.DATA["S22_AQUA"]
+        self._apply_pin_data()
 
         if self.current_mode() == AquastatBoardMode.OFF:
             return Response(content="Hardware couldn't activate aquastat mode", status_code=417)
@@ -305,9 +405,8 @@ class SwitchModule:
             self.SwitchModuleConfigurations.DATA["S22_AQUA"] + self.SwitchModuleConfigurations.DATA["S23_TOGGLE"]
         )
 
-        # Delay execution for 10ms to allow for DPDT relay to open
-        time.sleep(0.01)
-        self.bus.write_byte_data(self.IC2, self.GPIOA, self.IC2_GPIOA_DATA)
+        # returns once the DPDT relay has opened
+        self._apply_pin_data()
 
         if self.current_mode() == AquastatBoardMode.ON or self.current_state() == AquastatState.CLOSED:
             return Response(content="Hardware couldn't deactivate aquastat mode", status_code=417)
@@ -331,7 +430,7 @@ class SwitchModule:
 
         # Activating S23_TOGGLE
         self.IC2_GPIOA_DATA &= ~self.SwitchModuleConfigurations.DATA["S23_TOGGLE"]
-        self.bus.write_byte_data(self.IC2, self.GPIOA, self.IC2_GPIOA_DATA)
+        self._apply_pin_data()
 
         if self.current_state() == AquastatState.CLOSED:
             return Response(content="Hardware couldn't open aquastat", status_code=417)
@@ -355,9 +454,8 @@ class SwitchModule:
         # Deactivating S23_TOGGLE
         self.IC2_GPIOA_DATA |= self.SwitchModuleConfigurations.DATA["S23_TOGGLE"]
 
-        # Delay execution for 10ms to allow for relay to close
-        time.sleep(0.01)
-        self.bus.write_byte_data(self.IC2, self.GPIOA, self.IC2_GPIOA_DATA)
+        # returns once the relay has closed
+        self._apply_pin_data()
 
         if self.current_state() == AquastatState.OPEN:
             return Response(content="Hardware couldn't close Aquastat", status_code=417)
@@ -371,7 +469,7 @@ class SwitchModule:
         """
 
         if (
-            self.bus.read_byte_data(self.IC2, self.GPIOA) & self.SwitchModuleConfigurations.DATA["S22_AQUA"]
+            self.shadow.image[IC2_GPIOA] & self.SwitchModuleConfigurations.DATA["S22_AQUA"]
             == self.SwitchModuleConfigurations.DATA["S22_AQUA"]
         ):
             return AquastatBoardMode.ON
@@ -384,7 +482,7 @@ class SwitchModule:
         """
 
         if (
-            self.bus.read_byte_data(self.IC2, self.GPIOA) & self.SwitchModuleConfigurations.DATA["S23_TOGGLE"]
+            self.shadow.image[IC2_GPIOA] & self.SwitchModuleConfigurations.DATA["S23_TOGGLE"]
             == self.SwitchModuleConfigurations.DATA["S23_TOGGLE"]
         ):
             return AquastatState.CLOSED
@@ -1,3 +1,15 @@
+import threading
+from collections import namedtuple
+from functools import lru_cache
+from typing import Tuple
+
+# index of each bank in a register image, same order as register_shadow.BANK_NAMES
+BANK_INDEX = {"IC1_GPIOA": 0, "IC1_GPIOB": 1, "IC2_GPIOA": 2, "IC2_GPIOB": 3}
+
+# image: (IC1_GPIOA, IC1_GPIOB, IC2_GPIOA, IC2_GPIOB) with every pin of the configuration turned on
+# power: same layout, only the main power pins of the configuration
+CompiledConfig = namedtuple("CompiledConfig", ["image", "power"])
+
 
 class SwitchModuleConfigurations(object):
     """Stores pin level configuration data for different equipment combinations.
@@ -12,6 +24,8 @@ class SwitchModuleConfigurations(object):
 
     Distribute new pins over both GPIO expanders to minimize current draw
     """
+    # thermostat models the configurations know about
+    MODELS = ("athena", "nike", "apollo", "vulcan", "ares", "artemis", "attisPro", "attisRetail")
     BANK = {
         "RH_OUT_PHASE": "IC1_GPIOA",  # IC1:GPA0
         "TP1": "IC1_GPIOA",  # IC1:GPA1  # No Use in hvac sim V2
@@ -144,11 +158,30 @@ class SwitchModuleConfigurations(object):
     # Multi-purpose pek pin
     PEK_PLUS = ["PEK_ALT"]
 
+    # one instance per flag combination, shared by every board and session of the process
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, model, has_pek=False, has_rh=False, has_rc=True, in_phase=True, acc_minus=False):
+        """Returns the configurations of a flag combination, built and compiled only the first time it is seen
+
+        :return: shared SwitchModuleConfigurations, must not be modified
+        :raises ValueError: if the model is unknown or the flag combination is invalid, nothing is cached then
+        """
+        key = (model, has_pek, has_rh, has_rc, in_phase, acc_minus)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(*key)
+            return cls._instances[key]
+
     def __init__(self, model, has_pek=False, has_rh=False, has_rc=True, in_phase=True, acc_minus=False):
         # TODO: KEEP TRACK OF ALLOWABLE CONFIGS IN NEW EQUIPMENT/NEW DEVICES
         # (after apollo)
         # rh can only replace rc as power with athena device, as of nike, need
         # to use rc
+        if model not in self.MODELS:
+            raise ValueError(f"Unknown model {model}. Must be one of: {self.MODELS}")
         if model != "athena" and has_rh and not has_rc:
             raise ValueError(f"Cannot power {model} with RH-only. Only athena can "
                              "be powered by RH-only")
@@ -429,3 +462,54 @@ class SwitchModuleConfigurations(object):
         self.CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE_ACC_2_STAGE = self.CONFIG_HPHEAT_2_STAGE_AUX_2_STAGE_ACC + self.PEK_PLUS
 
         self.CONFIG_ALL = self.CONFIG_HPCOOL_2_STAGE_AUX_2_STAGE + self.ACC_RELAYS
+
+        # every configuration compiled to register images up front, applying one is then a few byte operations.
+        # Combinations that are invalid for these flags are left out and raise when they are applied
+        self.COMPILED = {}
+        for name, pins in list(vars(self).items()):
+            if name.startswith("CONFIG_"):
+                try:
+                    self.COMPILED[name] = compile_config(tuple(pins))
+                except ValueError:
+                    pass
+
+
+@lru_cache(maxsize=None)
+def pins_to_image(pins: Tuple[str, ...]) -> Tuple[int, int, int, int]:
+    """Register image with only `pins` turned on
+
+    :param pins: pin names of SwitchModuleConfigurations
+    :return: (IC1_GPIOA, IC1_GPIOB, IC2_GPIOA, IC2_GPIOB)
+    """
+    image = [0b00000000, 0b00000000, 0b00000000, 0b00000000]
+    for pin in pins:
+        image[BANK_INDEX[SwitchModuleConfigurations.BANK[pin]]] |= SwitchModuleConfigurations.DATA[pin]
+    return tuple(image)
+
+
+# every main power pin of the switch module
+POWER_MASK = pins_to_image(tuple(SwitchModuleConfigurations.MAIN_POWER_PINS))
+
+
+@lru_cache(maxsize=None)
+def compile_config(pins: Tuple[str, ...]) -> CompiledConfig:
+    """Validates a pin configuration and compiles it to register images
+
+    :param pins: pin names of SwitchModuleConfigurations
+    :return: CompiledConfig of the pins
+    :raises ValueError: if the configuration mixes pins that cannot be used together
+    """
+    pek_pins = [pin for pin in pins if pin in SwitchModuleConfigurations.PEK_PINS]
+    no_pek_pins = [pin for pin in pins if pin in SwitchModuleConfigurations.NO_PEK_PINS]
+    if pek_pins and no_pek_pins:
+        raise ValueError(f"pek pins: {pek_pins}, cannot be used with no_pek pins: {no_pek_pins}")
+    athena_pins = [pin for pin in pins if pin in SwitchModuleConfigurations.ATHENA_PINS]
+    not_athena_pins = [pin for pin in pins if pin in SwitchModuleConfigurations.NOT_ATHENA_PINS]
+    if athena_pins and not_athena_pins:
+        raise ValueError(f"athena pins: {athena_pins}, cannot be used with not_athena pins:{not_athena_pins}")
+    pek_plus = [pin for pin in pins if pin in SwitchModuleConfigurations.PEK_PLUS]
+    if pek_pins and pek_plus:
+        raise ValueError(f"pek_plus pin: {pek_plus}, cannot be used with pek pins: {pek_pins}")
+
+    image = pins_to_image(pins)
+    return CompiledConfig(image, tuple(i & p for i, p in zip(image, POWER_MASK)))
@@ -0,0 +1,23 @@
+"""Every test runs against the software simulator (HVAC_BACKEND=sim), with the runtime state in a temporary directory.
+
+The environment has to be set before constants.py is imported, so it is set when pytest loads this file.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+STATE_DIR = tempfile.mkdtemp(prefix="hvac_sim_tests_")
+atexit.register(shutil.rmtree, STATE_DIR, True)
+
+os.environ["HVAC_BACKEND"] = "sim"
+os.environ["HVAC_STATE_DIR"] = STATE_DIR
+os.environ["RELAY_COUNTERS_DIR"] = os.path.join(STATE_DIR, "relay_counters")
+os.environ["BOARDS_CONFIG"] = ""
+os.environ["SENSE_SAMPLER"] = "0"
+os.environ["SENSE_INTERRUPTS"] = "0"
+os.environ["SHADOW_VERIFY_INTERVAL"] = "0"
+
+# the modules are flat at the repository root and import each other by bare name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,172 @@
+"""LeaseManager reservation and ticket state machine on the simulated board"""
+import asyncio
+import threading
+
+import pytest
+
+from board_registry import BoardRegistry
+from session_leases import LeaseManager
+
+FLAGS = {"model": "ares", "has_pek": False, "has_rh": False, "has_rc": True, "in_phase": True, "acc_minus": False}
+
+
+@pytest.fixture
+def manager():
+    manager = LeaseManager(BoardRegistry.load(), ttl=60, ticket_ttl=60)
+    manager.init_boards()
+    yield manager
+    for slot in manager.slots.values():
+        slot.hw.call(slot.rb.cleanup)
+
+
+async def until(condition, timeout: float = 5):
+    """Lets the event loop run until `condition()` holds, background tasks finish their work meanwhile"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.01)
+
+
+def failing_start(exception: Exception):
+    def start(flags):
+        raise exception
+    return start
+
+
+def test_failed_start_frees_board(manager, monkeypatch):
+    slot = manager.default_slot()
+    start = slot.start
+    monkeypatch.setattr(slot, "start", failing_start(OSError(121, "Remote I/O error")))
+
+    async def scenario():
+        with pytest.raises(OSError):
+            await manager.acquire(FLAGS)
+        assert slot.lease is None
+        assert manager.leases() == []
+
+        monkeypatch.setattr(slot, "start", start)
+        lease = await manager.acquire(FLAGS)
+        assert lease is not None
+        assert slot.lease is lease
+        await asyncio.wrap_future(manager.release(lease))
+
+    asyncio.run(scenario())
+
+
+def test_invalid_flags_free_board(manager):
+    slot = manager.default_slot()
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await manager.acquire(dict(FLAGS, has_pek=True, has_rh=True))
+        assert slot.lease is None
+        assert manager.free_slot("ares") is slot
+
+    asyncio.run(scenario())
+
+
+def test_failed_start_ends_ticket(manager, monkeypatch):
+    slot = manager.default_slot()
+    monkeypatch.setattr(slot, "start", failing_start(RuntimeError("GPIO busy")))
+
+    async def scenario():
+        ticket = manager.enqueue(FLAGS)
+        assert await manager.wait(ticket, 2)
+        assert ticket.ready.result() is None
+        assert ticket.error == "GPIO busy"
+        assert manager.ticket(ticket.ticket_id) is None
+        assert slot.lease is None
+        assert manager.waiting() == []
+
+    asyncio.run(scenario())
+
+
+def test_cancel_ticket_while_board_starts(manager, monkeypatch):
+    slot = manager.default_slot()
+    start = slot.start
+    starting, proceed = threading.Event(), threading.Event()
+
+    def slow_start(flags):
+        starting.set()
+        proceed.wait(5)
+        start(flags)
+
+    monkeypatch.setattr(slot, "start", slow_start)
+
+    async def scenario():
+        ticket = manager.enqueue(FLAGS)
+        # the board is free, so it is reserved for the ticket at once
+        assert ticket.lease is not None
+        assert manager.position(ticket) == 0
+        await asyncio.get_running_loop().run_in_executor(None, starting.wait, 5)
+
+        manager.cancel(ticket)
+        assert ticket.ready.result() is None
+        assert ticket.error == "Ticket cancelled"
+
+        proceed.set()
+        # the session started for nobody is ended as soon as the start completes
+        await until(lambda: slot.lease is None)
+        assert manager.leases() == []
+        assert manager.get(ticket.lease.session_id) is None
+
+    asyncio.run(scenario())
+
+
+def test_released_board_goes_to_oldest_ticket(manager):
+    slot = manager.default_slot()
+
+    async def scenario():
+        lease = await manager.acquire(FLAGS)
+        first = manager.enqueue(FLAGS)
+        second = manager.enqueue(FLAGS)
+        assert (manager.position(first), manager.position(second)) == (1, 2)
+        assert await manager.acquire(FLAGS) is None
+
+        manager.release(lease)
+        assert await manager.wait(first, 5)
+        assert manager.claim(first).slot is slot
+        assert manager.position(second) == 1
+
+    asyncio.run(scenario())
+
+
+def test_idle_session_is_reaped(manager):
+    manager.ttl = 0.3
+    slot = manager.default_slot()
+
+    async def scenario():
+        lease = await manager.acquire(FLAGS)
+        await asyncio.sleep(0.2)
+        lease.touch()
+        await asyncio.sleep(0.2)
+        # activity pushed the expiry back
+        assert manager.get(lease.session_id) is lease
+
+        await until(lambda: manager.get(lease.session_id) is None, timeout=2)
+        assert manager.expired(lease.session_id)
+        assert slot.lease is None
+
+    asyncio.run(scenario())
+
+
+def test_unpolled_ticket_is_dropped(manager):
+    manager.ticket_ttl = 0.2
+    slot = manager.default_slot()
+
+    async def scenario():
+        lease = await manager.acquire(FLAGS)
+        ticket = manager.enqueue(FLAGS)
+        assert manager.position(ticket) == 1
+
+        await until(lambda: manager.ticket(ticket.ticket_id) is None, timeout=2)
+        assert ticket.error == "Ticket expired"
+        assert ticket.ready.result() is None
+
+        # nobody is queued any more, the board is simply freed
+        manager.release(lease)
+        assert slot.lease is None
+        assert manager.free_slot("ares") is slot
+
+    asyncio.run(scenario())
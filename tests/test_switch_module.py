@@ -0,0 +1,85 @@
+"""SwitchModule.configure write ordering between power and non-power relays on the simulated board"""
+from typing import List, Tuple
+
+import pytest
+
+from board_registry import BoardRegistry
+from hvac_simulator import SIMULATOR
+from relay_board import RelayBoard
+from switch_module_configurations import POWER_MASK
+
+
+@pytest.fixture(scope="module")
+def relay_board():
+    relay_board = RelayBoard("ares", board=BoardRegistry.load().default())
+    yield relay_board
+    relay_board.cleanup()
+
+
+@pytest.fixture
+def relay_images(relay_board, monkeypatch) -> List[Tuple[int, int, int, int]]:
+    """Relay image the simulated board drives after every register write to the switch expanders"""
+    board = SIMULATOR.board(relay_board.board.name)
+    images = []
+    for expander in (board.ic1, board.ic2):
+        def on_output(changed, forward=expander.on_output):
+            forward(changed)
+            images.append(board.relay_image())
+        monkeypatch.setattr(expander, "on_output", on_output)
+    return images
+
+
+def non_power(image) -> Tuple[int, ...]:
+    return tuple(i & ~p for i, p in zip(image, POWER_MASK))
+
+
+def power(image) -> Tuple[int, ...]:
+    return tuple(i & p for i, p in zip(image, POWER_MASK))
+
+
+def assert_power_ordered(images, start, target):
+    """Power pins leaving are off before any other relay moves, power pins entering come on after all others"""
+    leaving = tuple(s & p & ~t for s, p, t in zip(start, POWER_MASK, target))
+    entering = tuple(t & p & ~s for s, p, t in zip(start, POWER_MASK, target))
+    for image in images:
+        if non_power(image) != non_power(start):
+            assert not any(i & bits for i, bits in zip(image, leaving)), f"relays moved under power in {image}"
+        if any(i & bits for i, bits in zip(image, entering)):
+            assert non_power(image) == non_power(target), f"power came on before the relays settled in {image}"
+    assert images[-1] == target
+
+
+def test_power_pins_switch_around_other_relays(relay_board, relay_images):
+    switch_module = relay_board.switch_module
+    switch_module.configure(["S3_RC", "S6_G_NO_PEK"])
+    start = switch_module.shadow.image
+    relay_images.clear()
+
+    switch_module.configure(["S21_RH", "S11_Y1_NO_PEK"])
+    target = switch_module.shadow.image
+    assert power(start) != power(target)
+    assert_power_ordered(relay_images, start, target)
+
+
+def test_power_pins_that_stay_on_are_not_cycled(relay_board, relay_images):
+    switch_module = relay_board.switch_module
+    configurations = relay_board.configurations
+    switch_module.configure(configurations.CONFIG_FAN)
+    start = switch_module.shadow.image
+    relay_images.clear()
+
+    switch_module.configure(configurations.CONFIG_AC_1_STAGE)
+    target = switch_module.shadow.image
+    assert non_power(start) != non_power(target)
+    assert relay_images
+    assert all(power(image) == power(start) for image in relay_images)
+    assert_power_ordered(relay_images, start, target)
+
+
+def test_same_configuration_writes_nothing(relay_board, relay_images):
+    switch_module = relay_board.switch_module
+    switch_module.configure(relay_board.configurations.CONFIG_FAN)
+    relay_images.clear()
+
+    switch_module.configure(relay_board.configurations.CONFIG_FAN)
+    assert relay_images == []